@@ -0,0 +1,136 @@
+"""
+Скільки коштує знайти хендлер для одного апдейту.
+
+Порівнюємо два роутери з однаковими (порожніми) хендлерами:
+  * «було»  — окремий фільтр F.text == "..." на кожну кнопку меню і
+              каскад if action == ... в універсальному хендлері;
+  * «стало» — один фільтр F.text.in_(MENU_BUTTONS) + пошук у dict,
+              як зараз у main.py.
+Кнопки і стани беруться з main.MENU_BUTTONS / main.ACTION_HANDLERS,
+тож бенчмарк росте разом з ботом.
+
+Запуск:
+    python bench/bench_dispatch.py [ітерацій]
+"""
+import asyncio
+import datetime
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+import main  # noqa: E402
+from aiogram import Bot, Dispatcher, F, Router  # noqa: E402
+from aiogram.filters import Command, CommandStart  # noqa: E402
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+LABELS = list(main.MENU_BUTTONS)
+ACTIONS = list(main.ACTION_HANDLERS)
+PENDING: dict[int, str] = {}
+HITS: dict[str, int] = {}
+
+
+async def noop(message: Message) -> None:
+    HITS["ok"] = HITS.get("ok", 0) + 1
+
+
+def common(router: Router) -> None:
+    router.message(F.animation)(noop)
+    router.message(CommandStart())(noop)
+    router.message(Command("admin"))(noop)
+    router.message(Command("cancel"))(noop)
+    router.message(F.reply_to_message)(noop)
+
+
+def old_router() -> Router:
+    router = Router()
+    for label in LABELS:
+        router.message(F.text == label)(noop)
+    common(router)
+
+    @router.message()
+    async def universal(message: Message) -> None:
+        action = PENDING.get(message.from_user.id)
+        if not action:
+            return await noop(message)
+        # той самий лінійний каскад порівнянь, що й раніше
+        for name in ACTIONS:
+            if action == name:
+                return await noop(message)
+
+    return router
+
+
+def new_router() -> Router:
+    router = Router()
+    table = {label: noop for label in LABELS}
+    actions = {name: noop for name in ACTIONS}
+
+    @router.message(F.text.in_(table))
+    async def menu(message: Message) -> None:
+        await table[message.text](message)
+
+    common(router)
+
+    @router.message()
+    async def universal(message: Message) -> None:
+        action = PENDING.get(message.from_user.id)
+        handler = actions.get(action) if action else None
+        await (handler or noop)(message)
+
+    return router
+
+
+def update(uid: int, text: str) -> Update:
+    return Update(
+        update_id=1,
+        message=Message(
+            message_id=1,
+            date=datetime.datetime.now(),
+            chat=Chat(id=uid, type="private"),
+            from_user=User(id=uid, is_bot=False, first_name="Гість"),
+            text=text,
+        ),
+    )
+
+
+CASES = {
+    "перша кнопка меню": (1, LABELS[0], None),
+    "остання кнопка меню": (2, LABELS[-1], None),
+    "текст у стані (останній)": (3, "Мій текст", ACTIONS[-1]),
+    "текст у стані (перший)": (4, "Мій текст", ACTIONS[0]),
+    "просто текст": (5, "привіт", None),
+}
+
+
+async def measure(router: Router, upd: Update, n: int, bot: Bot) -> float:
+    dp = Dispatcher()
+    dp.include_router(router)
+    for _ in range(200):
+        await dp.feed_update(bot, upd)
+    t = time.perf_counter()
+    for _ in range(n):
+        await dp.feed_update(bot, upd)
+    return (time.perf_counter() - t) / n * 1e6
+
+
+async def run(n: int) -> None:
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    bot = Bot("0:bench")
+    print(f"{len(LABELS)} кнопок меню, {len(ACTIONS)} станів, {n} апдейтів на випадок")
+    print(f"{'випадок':<28}{'було, мкс':>12}{'стало, мкс':>12}")
+    for name, (uid, text, action) in CASES.items():
+        if action:
+            PENDING[uid] = action
+        upd = update(uid, text)
+        old = await measure(old_router(), upd, n, bot)
+        new = await measure(new_router(), upd, n, bot)
+        print(f"{name:<28}{old:>12.1f}{new:>12.1f}")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
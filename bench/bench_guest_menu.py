@@ -0,0 +1,153 @@
+"""
+Скільки коштує показати «📜 Наше меню», коли всі тиснуть кнопку разом.
+
+Порівнюємо старий підхід (повний прохід по гостях на кожне натискання,
+одним повідомленням, яке Telegram на такій кількості гостей ще й
+відхилить) зі сторінками вечірки (Party.guests_menu): перша сторінка з кешу, перша сторінка
+з холодного кешу, правка одного гостя, і «пік перед вечіркою» — кожен
+гість відкриває список, кожен десятий гортає далі, а кожен сотий
+заодно править своє меню.
+
+Запуск:
+    python bench/bench_guest_menu.py [гостей]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("PARTY_CODE", "BENCH")
+os.chdir(tempfile.mkdtemp(prefix="party_bench_"))
+
+import main  # noqa: E402
+
+
+def fill_users(n: int) -> None:
+    main.USERS.clear()
+    for uid in range(1, n + 1):
+        main.USERS[uid] = main.Guest.from_dict(dict(
+            participant=True,
+            party_code=main.DEFAULT_PARTY.code,
+            name=f"Гість {uid}",
+            menu_dish=f"Страва {uid}",
+            menu_drink="Глінтвейн",
+            menu_dessert="Пряник" if uid % 2 else None,
+            santa_joined=uid % 3 == 0,
+        ))
+    for hook in main.GUEST_CHANGE_HOOKS:
+        hook(())
+
+
+def old_render() -> str:
+    """Те, що робив guests_menu_for_user до кешу."""
+    lines = ["📜 <b>Наше меню</b>\n"]
+    for uid in main.DEFAULT_PARTY.guest_ids():
+        data = main.find_user(uid)
+        if not data:
+            continue
+        color = main.get_color_for_user(uid)
+        color_txt = color["label"] if color else "—"
+        role_txt = color["role"] if color else "—"
+        lines.append(
+            f"• <b>{data.name or f'Гість {uid}'}</b>\n"
+            f"  Образ: {color_txt}\n"
+            f"  Роль: {role_txt}\n"
+            f"  Страва: {data.menu_dish or '—'}\n"
+            f"  Напій: {data.menu_drink or '—'}\n"
+            f"  Десерт: {data.menu_dessert or '—'}\n"
+            f"  У грі Миколайчика: {'✅' if data.santa_joined else '❌'}\n"
+        )
+    return "\n".join(lines)
+
+
+def per_call(fn, repeat: int) -> float:
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat * 1000
+
+
+async def edit(uid: int, i: int) -> None:
+    main.USERS[uid].menu_dish = f"Нова страва {i}"
+    await main.save_data(uid)
+
+
+def all_pages(pages) -> list[str]:
+    out, n = [], 0
+    while True:
+        text, n, has_next = pages.page(n)
+        out.append(text)
+        if not has_next:
+            return out
+        n += 1
+
+
+def bodies_match(pages, old: str) -> bool:
+    header = pages.header + "\n"
+    bodies = [t.split("\n<i>Сторінка")[0][len(header):] for t in all_pages(pages)]
+    return "\n".join(bodies) == old[len(header):]
+
+
+async def run(n: int) -> None:
+    fill_users(n)
+    pages = main.DEFAULT_PARTY.guests_menu
+    old = old_render()
+    assert bodies_match(pages, old), "сторінки розходяться зі старим рендером"
+    count = len(all_pages(pages))
+    print(
+        f"{n} учасників: старий текст {len(old) // 1024} КБ одним повідомленням "
+        f"(ліміт Telegram — 4096 символів), тепер {count} сторінок"
+    )
+    print(f"  старий рендер:               {per_call(old_render, 20):8.3f} мс на натискання")
+    print(f"  1-ша сторінка з кешу:        {per_call(lambda: pages.page(0), 1000):8.4f} мс")
+
+    def cold_first_page() -> None:
+        pages.invalidate(())
+        pages.page(0)
+
+    print(f"  1-ша сторінка, холодний кеш: {per_call(cold_first_page, 20):8.3f} мс")
+
+    i = 0
+
+    def edit_then_read() -> None:
+        nonlocal i
+        i += 1
+        uid = i % 10 + 1  # гість з першої сторінки — найгірший випадок
+        main.USERS[uid].menu_dish = f"Страва {i}"
+        pages.invalidate((uid,))
+        pages.page(0)
+
+    print(f"  правка 1 гостя + читання:    {per_call(edit_then_read, 50):8.3f} мс")
+
+    # пік: кожен відкриває список, кожен десятий гортає ще 2 сторінки,
+    # кожен сотий править меню
+    rendered = pages.rendered
+    t = time.perf_counter()
+    for uid in range(1, n + 1):
+        if uid % 100 == 0:
+            await edit(uid, uid)
+        pages.page(0)
+        if uid % 10 == 0:
+            pages.page(1)
+            pages.page(2)
+    peak_new = time.perf_counter() - t
+    t = time.perf_counter()
+    for _ in range(min(n, 500)):
+        old_render()
+    peak_old = (time.perf_counter() - t) * n / min(n, 500)
+    print(
+        f"  пік ({n} гостей, {n // 100} правок): сторінки {peak_new:.2f} с, "
+        f"старий рендер ≈{peak_old:.1f} с (екстраполяція)"
+    )
+    print(
+        f"  відрендерено блоків за пік: {pages.rendered - rendered}, "
+        f"сторінок з кешу: {pages.page_hits}"
+    )
+    assert bodies_match(pages, old_render())
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,102 @@
+"""
+Скільки алокацій коштують клавіатури на один апдейт.
+
+«Апдейт» тут — типовий набір клавіатур, які бот віддає гостю за одне
+натискання: головне меню, кабінет, завдання, реєстрація й чат Миколайчика
+і (для адміна) адмін-меню. Порівнюємо фабрики без кешу (func.build) з
+KEYBOARDS: скільки блоків памʼяті і байтів виділяється на апдейт
+(tracemalloc) і скільки це займає часу.
+
+Запуск:
+    python bench/bench_keyboards.py [апдейтів]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.chdir(tempfile.mkdtemp(prefix="party_bench_"))
+
+import main  # noqa: E402
+
+
+def guests(n: int) -> list[main.Guest]:
+    colors = list(main.COLOR_TASKS)
+    out = []
+    for i in range(n):
+        g = main.Guest.from_dict(dict(
+            participant=i % 10 != 0,
+            color_id=colors[i % len(colors)],
+            santa_joined=i % 3 == 0,
+            santa_id=i + 1 if i % 2 else None,
+            santa_child_id=i + 2 if i % 2 else None,
+        ))
+        g.is_admin = i == 0
+        g.tasks_done = [(i >> k) % 3 for k in range(len(main.COLOR_TASKS[g.color_id]))]
+        out.append(g)
+    return out
+
+
+def one_update(user: main.Guest, cached: bool) -> list:
+    def kb(func, *args):
+        return func(*args) if cached else func.build(*args)
+
+    out = [
+        kb(main.main_menu_kb, user),
+        kb(main.cabinet_menu_kb),
+        kb(main.tasks_inline_kb, user),
+        kb(main.santa_join_menu_kb, user),
+        kb(main.santa_chat_kb, user),
+    ]
+    if user.is_admin:
+        out.append(kb(main.admin_menu_kb))
+        out.append(kb(main.admin_santa_menu_kb))
+    return out
+
+
+def allocations(users: list[main.Guest], cached: bool) -> tuple[float, float]:
+    """Блоки і байти, що лишаються виділеними після кожного апдейту."""
+    kept = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for user in users:
+        kept.append(one_update(user, cached))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    blocks = sum(s.count_diff for s in diff)
+    size = sum(s.size_diff for s in diff)
+    return blocks / len(users), size / len(users)
+
+
+def per_update(users: list[main.Guest], cached: bool) -> float:
+    t = time.perf_counter()
+    for user in users:
+        one_update(user, cached)
+    return (time.perf_counter() - t) / len(users) * 1e6
+
+
+def run(n: int) -> None:
+    users = guests(n)
+    main.DEFAULT_PARTY.santa.registration_open = True
+    # прогрів: pydantic будує схеми ліниво, кеш заповнюється
+    for user in users[:200]:
+        one_update(user, False)
+        one_update(user, True)
+
+    print(f"{n} апдейтів, {len(main.COLOR_TASKS)} кольорів із завданнями")
+    print(f"{'':<12}{'блоків':>10}{'байтів':>10}{'мкс':>10}")
+    for name, cached in (("без кешу", False), ("KEYBOARDS", True)):
+        blocks, size = allocations(users, cached)
+        print(f"{name:<12}{blocks:>10.1f}{size:>10.0f}{per_update(users, cached):>10.1f}")
+    print(
+        f"варіантів у кеші: {len(main.KEYBOARDS)}, "
+        f"влучань {main.KEYBOARDS.hits}, промахів {main.KEYBOARDS.misses}"
+    )
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,94 @@
+"""
+Скільки чекає гість на «GIF + відповідь».
+
+Проти фейкового Telegram з заданою затримкою API порівнюємо:
+  * «було»     — await send_gif(); await message.answer() — два
+                 послідовні round-trip'и;
+  * «підпис»   — answer_with_gif(): одна анімація з підписом;
+  * «паралельно» — answer_with_gif(combine=False): GIF і текст разом.
+Друкуємо середній час до останньої відповіді і метрики MEDIA.
+
+Запуск:
+    python bench/bench_media.py [натискань] [затримка_API_с]
+"""
+import asyncio
+import datetime
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+FAKE_PORT = 18083
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("TELEGRAM_API_URL", f"http://127.0.0.1:{FAKE_PORT}")
+os.chdir(tempfile.mkdtemp(prefix="party_bench_"))
+
+import main  # noqa: E402
+from aiogram.types import Chat, Message, User  # noqa: E402
+from fake_telegram import FakeTelegram, serve  # noqa: E402
+
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+TEXT = "Організатор ще не відкрив реєстрацію на гру «Таємний Миколайчик». Трохи терпіння 🎅"
+
+
+def message(bot, uid: int) -> Message:
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=uid, type="private"),
+        from_user=User(id=uid, is_bot=False, first_name="Гість"),
+        text="🎅 Мій Миколайчик",
+    ).as_(bot)
+
+
+async def old_way(msg: Message) -> None:
+    await main.send_gif(msg, main.SANTA_GIF_ID)
+    await msg.answer(TEXT)
+
+
+async def caption_way(msg: Message) -> None:
+    await main.answer_with_gif(msg, main.SANTA_GIF_ID, TEXT)
+
+
+async def parallel_way(msg: Message) -> None:
+    await main.answer_with_gif(msg, main.SANTA_GIF_ID, TEXT, combine=False)
+
+
+async def measure(fn, bot, taps: int) -> float:
+    t = time.perf_counter()
+    for i in range(taps):
+        await fn(message(bot, 1000 + i))
+    return (time.perf_counter() - t) / taps * 1000
+
+
+async def run(taps: int, latency: float) -> None:
+    fake = FakeTelegram(latency=latency)
+    fake_runner = await serve(fake, port=FAKE_PORT)
+    bot = main.create_bot()
+    print(f"{taps} натискань, затримка API {latency * 1000:.0f} мс")
+    for name, fn in (("було", old_way), ("підпис", caption_way), ("паралельно", parallel_way)):
+        calls = sum(fake.calls.values())
+        ms = await measure(fn, bot, taps)
+        per_tap = (sum(fake.calls.values()) - calls) / taps
+        print(f"  {name:<12}{ms:8.1f} мс до відповіді, {per_tap:.0f} виклик(и) API")
+    print(f"  MEDIA: {main.MEDIA.stats()}")
+    main.MEDIA.close()
+    await bot.session.close()
+    await fake_runner.cleanup()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(
+        run(
+            taps=int(args[0]) if len(args) > 0 else 100,
+            latency=float(args[1]) if len(args) > 1 else 0.05,
+        )
+    )
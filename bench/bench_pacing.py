@@ -0,0 +1,134 @@
+"""
+Скільки хендлери онбордингу тримають апдейт.
+
+Раніше /start, введення коду, підтвердження правил і кроки меню робили
+asyncio.sleep(0.5–2) прямо в хендлері. Тепер паузи живуть в OUTBOX
+(PacedReply), а хендлер повертається одразу. N гостей паралельно
+проходять увесь онбординг проти фейкового Telegram
+(bench/fake_telegram.py); для кожного кроку друкуємо, скільки хендлер
+раніше мусив проспати, і скільки він займає тепер (p50 / p99).
+Наостанок — коли гості отримали останнє повідомлення.
+
+Запуск:
+    python bench/bench_pacing.py [гостей] [затримка_API_с]
+"""
+import asyncio
+import datetime
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+FAKE_PORT = 18082
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("TELEGRAM_API_URL", f"http://127.0.0.1:{FAKE_PORT}")
+os.environ.setdefault("PARTY_CODE", "BENCH")
+# фейковому Telegram'у глобальний ліміт 30/с ні до чого
+os.environ.setdefault("TG_RATE_LIMIT", "100000")
+os.chdir(tempfile.mkdtemp(prefix="party_bench_"))
+
+import main  # noqa: E402
+from aiogram.types import CallbackQuery, Chat, Message, Update, User  # noqa: E402
+from fake_telegram import FakeTelegram, serve  # noqa: E402
+
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+logging.getLogger("main").setLevel(logging.WARNING)
+
+# крок → (апдейт, скільки секунд хендлер спав раніше)
+STEPS = [
+    ("/start", "text", "/start", 1.0),
+    ("код вечірки", "text", "BENCH", 1.0),
+    ("party_yes", "callback", "party_yes", 0.0),
+    ("party_confirm_rules", "callback", "party_confirm_rules", 3.0),
+    ("menu_now", "callback", "menu_now", 0.0),
+    ("страва", "text", "Борщ", 0.5),
+    ("напій", "text", "Узвар", 0.5),
+    ("десерт", "text", "Пампушки", 0.5),
+]
+
+_ids = iter(range(1, 10**9))
+
+
+def update(uid: int, kind: str, payload: str) -> Update:
+    user = User(id=uid, is_bot=False, first_name=f"Гість {uid}")
+    msg = Message(
+        message_id=next(_ids),
+        date=datetime.datetime.now(),
+        chat=Chat(id=uid, type="private"),
+        from_user=user,
+        text=payload if kind == "text" else "…",
+    )
+    if kind == "text":
+        return Update(update_id=next(_ids), message=msg)
+    return Update(
+        update_id=next(_ids),
+        callback_query=CallbackQuery(
+            id=str(next(_ids)), from_user=user, chat_instance="bench", message=msg, data=payload
+        ),
+    )
+
+
+def pct(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+async def run(guests: int, latency: float) -> None:
+    fake = FakeTelegram(latency=latency)
+    fake_runner = await serve(fake, port=FAKE_PORT)
+    bot = main.create_bot()
+    dp = main.create_dispatcher()
+    await main.on_startup(bot, dp)
+
+    uids = [50_000 + i for i in range(guests)]
+    for i, uid in enumerate(uids):
+        main.PREASSIGNED_COLORS[uid] = 1 + i % len(main.COLORS)
+    took: dict[str, list[float]] = {name: [] for name, *_ in STEPS}
+
+    async def guest(uid: int) -> None:
+        for name, kind, payload, _ in STEPS:
+            t = time.perf_counter()
+            await dp.feed_update(bot, update(uid, kind, payload))
+            took[name].append(time.perf_counter() - t)
+
+    t0 = time.monotonic()
+    await asyncio.gather(*(guest(uid) for uid in uids))
+    handlers_done = time.monotonic() - t0
+    while main.OUTBOX.depth() or main.OUTBOX._busy_chats:
+        await asyncio.sleep(0.05)
+    delivered = time.monotonic() - t0
+
+    print(f"{guests} гостей, затримка API {latency * 1000:.0f} мс")
+    print(f"{'крок':<22}{'спав раніше, мс':>16}{'p50, мс':>10}{'p99, мс':>10}")
+    for name, _, _, slept in STEPS:
+        print(f"{name:<22}{slept * 1000:>16.0f}{pct(took[name], 0.5):>10.1f}{pct(took[name], 0.99):>10.1f}")
+    total_slept = sum(s for *_, s in STEPS)
+    print(
+        f"онбординг одного гостя: хендлери раніше ≥{total_slept:.1f} с, "
+        f"тепер усі {guests} за {handlers_done:.2f} с; "
+        f"останнє повідомлення дійшло через {delivered:.2f} с"
+    )
+    print(f"HANDLER_LATENCY: {main.HANDLER_LATENCY.summary_ms()}")
+    await main.OUTBOX.flush_states()
+    print(f"outbox: {main.OUTBOX.state_counts()}")
+
+    await main.on_shutdown()
+    await bot.session.close()
+    await fake_runner.cleanup()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(
+        run(
+            guests=int(args[0]) if len(args) > 0 else 200,
+            latency=float(args[1]) if len(args) > 1 else 0.02,
+        )
+    )
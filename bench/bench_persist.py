@@ -0,0 +1,106 @@
+"""
+Скільки event loop простоює під час збереження даних.
+
+Порівнюємо старий синхронний json.dump на event loop'і з новим
+flush_data() (знімок копіюється на loop'і, серіалізація — у потоці).
+
+Запуск:
+    python bench/bench_persist.py [1000 10000 100000]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("PERSIST_INTERVAL", "3600")
+
+import main  # noqa: E402
+
+
+def fill_users(n: int) -> None:
+    main.USERS.clear()
+    for uid in range(1, n + 1):
+        main.USERS[uid] = main.Guest.from_dict(dict(
+            participant=uid % 3 != 0,
+            color_id=uid % 7 + 1,
+            name=f"Гість {uid}",
+            username=f"guest{uid}",
+            menu_dish="Олівʼє з мандаринами",
+            menu_drink="Глінтвейн",
+            menu_dessert="Пряники",
+            tasks_done=[1, 0, 2, 0, 0, 1, 0],
+            santa_joined=uid % 2 == 0,
+        ))
+
+
+async def max_stall(coro_factory) -> tuple[float, float]:
+    """
+    Паралельно з coro_factory() крутимо тікер із кроком 1 мс
+    і запамʼятовуємо найбільшу паузу між його пробудженнями.
+    Повертає (макс. простій loop'а, загальний час), мс.
+    """
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall = max(stall, now - last)
+            last = now
+
+    t = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    await coro_factory()
+    total = time.perf_counter() - started
+    done = True
+    await t
+    return stall * 1000, total * 1000
+
+
+async def old_save_data():
+    # так працював save_data() до write-behind: усе на event loop'і
+    data = {"USERS": {uid: u.to_dict() for uid, u in main.USERS.items()}, **main._party_state(), "PARTY": main.DEFAULT_PARTY.to_dict()}
+    with open(main.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+async def new_snapshot_flush():
+    main.STORAGE_MODE = "snapshot"
+    await main.save_data(*main.USERS)
+    await main.flush_data()
+
+
+async def new_journal_flush():
+    main.STORAGE_MODE = "journal"
+    main.JOURNAL_COMPACT_RECORDS = 10**9
+    await main.save_data(1)
+    await main.flush_data()
+
+
+async def run(sizes: list[int]) -> None:
+    print(f"{'guests':>8} | {'scenario':<22} | {'max stall, ms':>13} | {'total, ms':>10}")
+    print("-" * 64)
+    for n in sizes:
+        fill_users(n)
+        for name, factory in (
+            ("old sync json.dump", old_save_data),
+            ("flush: full snapshot", new_snapshot_flush),
+            ("flush: journal, 1 user", new_journal_flush),
+        ):
+            stall, total = await max_stall(factory)
+            print(f"{n:>8} | {name:<22} | {stall:>13.1f} | {total:>10.1f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(sizes))
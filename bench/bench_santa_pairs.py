@@ -0,0 +1,102 @@
+"""
+Скільки триває розподіл пар Таємного Миколайчика.
+
+Для кількох розмірів гри і щільностей обмежень міряємо make_santa_pairs
+і перевіряємо результат: кожен дарує рівно одному, кожен отримує рівно
+від одного, ніхто не дарує собі і тим, кого забороняють обмеження.
+Щільності:
+  * «без обмежень»;
+  * «пари»          — половина гравців парами (не дарують одне одному);
+  * «сімʼї + 1 рік» — сімʼї по 4 і минулорічна пара для кожного;
+  * «щільно»        — кожному заборонено ще 10% випадкових гравців
+                      (тільки для невеликих ігор).
+Наостанок — маленька гра, де розподіл існує лише один, і гра, де його немає.
+
+Запуск:
+    python bench/bench_santa_pairs.py [макс_гравців]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.chdir(tempfile.mkdtemp(prefix="party_bench_"))
+
+import main  # noqa: E402
+
+
+def groups_forbidden(players: list[int], size: int, share: float) -> dict[int, set[int]]:
+    forbidden: dict[int, set[int]] = {}
+    grouped = players[: int(len(players) * share) // size * size]
+    for start in range(0, len(grouped), size):
+        group = grouped[start:start + size]
+        for uid in group:
+            forbidden.setdefault(uid, set()).update(o for o in group if o != uid)
+    return forbidden
+
+
+def last_year(players: list[int], forbidden: dict[int, set[int]], rng: random.Random) -> None:
+    shuffled = players[:]
+    rng.shuffle(shuffled)
+    for i, uid in enumerate(shuffled):
+        forbidden.setdefault(uid, set()).add(shuffled[(i + 1) % len(shuffled)])
+
+
+def dense(players: list[int], share: float, rng: random.Random) -> dict[int, set[int]]:
+    k = int(len(players) * share)
+    return {uid: set(rng.sample(players, k)) for uid in players}
+
+
+def check(players: list[int], forbidden: dict[int, set[int]], child_of: dict[int, int]) -> None:
+    assert set(child_of) == set(players), "не всі дарують"
+    assert sorted(child_of.values()) == sorted(players), "хтось отримує двічі"
+    for s, c in child_of.items():
+        assert s != c and c not in forbidden.get(s, ()), (s, c)
+
+
+def measure(players: list[int], forbidden: dict[int, set[int]], seed: int) -> float:
+    t = time.perf_counter()
+    child_of = main.make_santa_pairs(players, forbidden, seed)
+    elapsed = time.perf_counter() - t
+    check(players, forbidden, child_of)
+    assert child_of == main.make_santa_pairs(players, forbidden, seed), "seed не відтворює"
+    return elapsed * 1000
+
+
+def run(max_players: int) -> None:
+    rng = random.Random(1)
+    sizes = [n for n in (100, 1_000, 10_000, 50_000, 100_000) if n <= max_players]
+    print(f"{'гравців':>8}{'без обмежень':>15}{'пари':>10}{'сімʼї + 1 рік':>15}{'щільно':>10}   мс")
+    for n in sizes:
+        players = list(range(1, n + 1))
+        fam = groups_forbidden(players, 4, 1.0)
+        last_year(players, fam, rng)
+        cells = [
+            measure(players, {}, 7),
+            measure(players, groups_forbidden(players, 2, 0.5), 7),
+            measure(players, fam, 7),
+        ]
+        row = "".join(f"{c:>{w}.1f}" for c, w in zip(cells, (15, 10, 15)))
+        if n <= 10_000:
+            row += f"{measure(players, dense(players, 0.1, rng), 7):>10.1f}"
+        else:
+            row += f"{'—':>10}"
+        print(f"{n:>8}{row}")
+
+    # 6 гравців: 1 і 2 можуть дарувати лише одне одному, решта — по колу
+    players = [1, 2, 3, 4, 5, 6]
+    forbidden = {1: {3, 4, 5, 6}, 2: {3, 4, 5, 6}, 3: {1, 2, 5, 6}, 4: {1, 2, 3}, 5: {1, 2, 4}, 6: {1, 2, 5}}
+    for seed in range(50):
+        check(players, forbidden, main.make_santa_pairs(players, forbidden, seed))
+    print("єдиний можливий розподіл: знаходиться для 50 seed'ів")
+    try:
+        main.make_santa_pairs([1, 2, 3], {1: {2, 3}})
+    except ValueError as e:
+        print(f"неможливий розподіл: ValueError({e})")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,126 @@
+"""
+Навантажувальний тест webhook-режиму без мережі.
+
+Піднімає фейковий Telegram (bench/fake_telegram.py) і бота в режимі
+webhook в одному процесі, а потім N «гостей» паралельно шлють /start
+на webhook з правильним секретом. Міряємо:
+  * скільки часу webhook відповідає Telegram'у (має бути ~миттєво);
+  * скільки минає від апдейту до першої відповіді бота в чат.
+
+Запуск:
+    python bench/bench_webhook.py [гостей] [паралельно] [затримка_API_с]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+FAKE_PORT = 18081
+BOT_PORT = 18080
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("TELEGRAM_API_URL", f"http://127.0.0.1:{FAKE_PORT}")
+os.environ.setdefault("BOT_MODE", "webhook")
+os.environ.setdefault("WEBHOOK_BASE_URL", f"http://127.0.0.1:{BOT_PORT}")
+os.environ.setdefault("PORT", str(BOT_PORT))
+
+# усі файли даних бота — у тимчасовій теці
+os.chdir(tempfile.mkdtemp(prefix="party_bench_"))
+
+import main  # noqa: E402
+from fake_telegram import FakeTelegram, serve  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+# лог доступу і «Update id=… is handled» на кожен апдейт лише заважають
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+
+def start_update(update_id: int, uid: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"Гість {uid}"},
+            "text": "/start",
+        },
+    }
+
+
+def pct(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+async def run(guests: int, concurrency: int, latency: float) -> None:
+    fake = FakeTelegram(latency=latency)
+    fake_runner = await serve(fake, port=FAKE_PORT)
+
+    bot = main.create_bot()
+    dp = main.create_dispatcher()
+    bot_runner = web.AppRunner(main.create_webhook_app(dp, bot))
+    await bot_runner.setup()
+    await web.TCPSite(bot_runner, "127.0.0.1", BOT_PORT).start()
+    assert fake.webhook is not None, "бот не встановив webhook"
+
+    url = f"http://127.0.0.1:{BOT_PORT}{main.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": main.WEBHOOK_SECRET}
+    posted: dict[int, float] = {}
+    ack: list[float] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as http:
+        async with http.post(url, json=start_update(0, 1), headers={"X-Telegram-Bot-Api-Secret-Token": "bad"}) as r:
+            print(f"неправильний секрет → HTTP {r.status}")
+
+        async def one(i: int) -> None:
+            uid = 10_000 + i
+            async with sem:
+                t = time.monotonic()
+                posted[uid] = t
+                async with http.post(url, json=start_update(i + 1, uid), headers=headers) as r:
+                    await r.read()
+                    assert r.status == 200, r.status
+                ack.append(time.monotonic() - t)
+
+        t0 = time.monotonic()
+        await asyncio.gather(*(one(i) for i in range(guests)))
+        while any(uid not in fake.sent for uid in posted):
+            await asyncio.sleep(0.01)
+        total = time.monotonic() - t0
+
+        async with http.get(f"http://127.0.0.1:{BOT_PORT}/healthz") as r:
+            health = await r.json()
+
+    first_reply = [fake.sent[uid][0] - t for uid, t in posted.items()]
+    print(
+        f"{guests} гостей, {concurrency} паралельно, затримка API {latency * 1000:.0f} мс: "
+        f"{total:.2f} с, {guests / total:.0f} апдейтів/с"
+    )
+    print(f"  відповідь webhook: p50 {pct(ack, 0.5):.1f} мс, p99 {pct(ack, 0.99):.1f} мс")
+    print(f"  перша відповідь у чат: p50 {pct(first_reply, 0.5):.1f} мс, p99 {pct(first_reply, 0.99):.1f} мс")
+    print(f"  викликів API: {sum(fake.calls.values())}, /healthz: {health}")
+
+    await bot_runner.cleanup()
+    await fake_runner.cleanup()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(
+        run(
+            guests=int(args[0]) if len(args) > 0 else 500,
+            concurrency=int(args[1]) if len(args) > 1 else 50,
+            latency=float(args[2]) if len(args) > 2 else 0.02,
+        )
+    )
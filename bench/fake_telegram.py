@@ -0,0 +1,200 @@
+"""
+Локальний «фейковий Telegram» для офлайн-тестів webhook-режиму.
+
+Приймає виклики Bot API на /bot<token>/<method>, відповідає правдоподібними
+обʼєктами і записує, що і коли бот надіслав. Бот підключається до нього
+через TELEGRAM_API_URL.
+
+MockSession — те саме без сервера: сесія aiogram, що відповідає одразу
+(loadtest і tests/).
+
+Окремий запуск (наприклад, щоб погратися з ботом руками):
+    python bench/fake_telegram.py [port]
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook \\
+        WEBHOOK_BASE_URL=http://127.0.0.1:8080 python main.py
+"""
+import asyncio
+import datetime
+import itertools
+import json
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import (
+    CopyMessage,
+    CopyMessages,
+    EditMessageText,
+    SendAnimation,
+    SendMessage,
+    SendPhoto,
+)
+from aiogram.methods.base import TelegramMethod
+from aiogram.types import Chat, Message, MessageId
+from aiohttp import web
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Party Bot", "username": "party_bot"}
+
+
+class FakeTelegram:
+    """
+    latency — штучна затримка відповіді API, секунди.
+    sent[chat_id] — моменти (time.monotonic()) кожного повідомлення в чат.
+    """
+
+    MESSAGE_METHODS = {"sendmessage", "sendanimation", "sendphoto", "editmessagetext"}
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self.sent: Dict[int, list[float]] = {}
+        self.webhook: Optional[Dict[str, Any]] = None
+        self._ids = itertools.count(1)
+        self._waiters: list[tuple[int, asyncio.Future]] = []
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        params: Dict[str, Any] = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def _message(self, chat_id: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        msg = {
+            "message_id": params.get("message_id") or next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            msg["text"] = str(params["text"])
+        if "caption" in params:
+            msg["caption"] = str(params["caption"])
+        return msg
+
+    def _record(self, chat_id: int) -> None:
+        now = time.monotonic()
+        self.sent.setdefault(chat_id, []).append(now)
+        still_waiting = []
+        for count, fut in self._waiters:
+            if self.total_sent() >= count and not fut.done():
+                fut.set_result(now)
+            elif not fut.done():
+                still_waiting.append((count, fut))
+        self._waiters = still_waiting
+
+    def total_sent(self) -> int:
+        return sum(map(len, self.sent.values()))
+
+    async def wait_sent(self, count: int) -> None:
+        if self.total_sent() >= count:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((count, fut))
+        await fut
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        result: Any = True
+        if method == "getme":
+            result = BOT_USER
+        elif method == "setwebhook":
+            self.webhook = params
+        elif method == "deletewebhook":
+            self.webhook = None
+        elif method == "getupdates":
+            result = []
+        elif method in self.MESSAGE_METHODS:
+            chat_id = int(params["chat_id"])
+            result = self._message(chat_id, params)
+            if method != "editmessagetext":
+                self._record(chat_id)
+        elif method == "copymessage":
+            self._record(int(params["chat_id"]))
+            result = {"message_id": next(self._ids)}
+        elif method == "copymessages":
+            result = []
+            for _ in params["message_ids"]:
+                self._record(int(params["chat_id"]))
+                result.append({"message_id": next(self._ids)})
+        return web.json_response({"ok": True, "result": result})
+
+
+class MockSession(BaseSession):
+    """
+    Bot API без мережі: правдоподібні відповіді і лічильник викликів.
+
+    sent — (chat_id, метод, текст) кожного повідомлення в порядку відправки.
+    fail(method) — якщо задано і повертає виняток, виклик падає з ним
+    (так тести імітують 429, блокування чи обрив мережі).
+    """
+
+    def __init__(self, fail: Optional[Callable[[TelegramMethod], Optional[Exception]]] = None) -> None:
+        super().__init__()
+        self.calls: Counter = Counter()
+        self.sent: list[tuple[int, str, Optional[str]]] = []
+        self.fail = fail
+        self._ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[method.__api_method__] += 1
+        if self.fail is not None:
+            error = self.fail(method)
+            if error is not None:
+                raise error
+        if isinstance(method, (SendMessage, SendAnimation, SendPhoto, EditMessageText)):
+            if not isinstance(method, EditMessageText):
+                self.sent.append(
+                    (int(method.chat_id), method.__api_method__, getattr(method, "text", None))
+                )
+            return Message(
+                message_id=next(self._ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=int(method.chat_id or 0), type="private"),
+                text=getattr(method, "text", None),
+            )
+        if isinstance(method, CopyMessage):
+            return MessageId(message_id=next(self._ids))
+        if isinstance(method, CopyMessages):
+            return [MessageId(message_id=next(self._ids)) for _ in method.message_ids]
+        return True
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+async def serve(fake: FakeTelegram, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+
+    async def _main() -> None:
+        await serve(FakeTelegram(), port=port)
+        print(f"Фейковий Telegram слухає http://127.0.0.1:{port}")
+        await asyncio.Event().wait()
+
+    asyncio.run(_main())
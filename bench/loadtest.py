@@ -0,0 +1,234 @@
+"""
+Навантажувальний тест: синтетичні апдейти крізь справжні router і Dispatcher.
+
+Апдейти йдуть так само, як з webhook'а: dp.feed_update() з
+UserSequenceMiddleware, OUTBOX, SCHEDULER і persist_loop. Bot API
+підмінений сесією MockSession (bench/fake_telegram.py), тож мережі немає
+взагалі — тест ганяється на ноутбуці офлайн. Гості працюють паралельно
+(не більше CONCURRENCY апдейтів в обробці одночасно), кроки одного
+гостя — по черзі.
+Сценарії:
+  * «/start»    — /start, код вечірки, «буду», згода з правилами;
+  * «меню»      — «заповнити зараз», страва, напій, десерт;
+  * «завдання»  — «Мої завдання» і три перемикання;
+  * «мости»     — питання організатору, потім відповідь орга на кожне;
+  * «розсилка»  — оголошення адміна всім учасникам.
+Для кожного: апдейтів/с, p50 / p99 обробки апдейту, скільки викликів
+Bot API пішло і за скільки OUTBOX їх доставив (разом з паузами
+PacedReply), і пікове RSS процесу.
+
+Кожен розмір запускається окремим процесом, щоб пікове RSS більшої гри
+не маскувало меншу.
+
+Запуск:
+    python bench/loadtest.py [гостей ...]     # за замовчуванням 1000 10000
+    LOADTEST_CONCURRENCY=500 python bench/loadtest.py 1000 10000 50000
+"""
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = os.path.abspath(__file__)
+sys.path.insert(0, os.path.dirname(os.path.dirname(SCRIPT)))
+sys.path.insert(0, os.path.dirname(SCRIPT))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("PARTY_CODE", "LOAD")
+# ліміти Telegram тут ні до чого: міряємо сам бот
+os.environ.setdefault("TG_RATE_LIMIT", "1000000")
+os.environ.setdefault("TG_PER_CHAT_INTERVAL", "0")
+os.environ.setdefault("BRIDGE_MAX_ENTRIES", "1000000")
+os.chdir(tempfile.mkdtemp(prefix="party_bench_"))
+
+import main  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiogram.types import CallbackQuery, Chat, Message, Update, User  # noqa: E402
+from fake_telegram import MockSession  # noqa: E402
+
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+logging.getLogger("main").setLevel(logging.WARNING)
+
+# скільки апдейтів webhook тримає в обробці одночасно; від цього залежить
+# p50/p99 (черга на event loop), а не апдейтів/с
+CONCURRENCY = int(os.getenv("LOADTEST_CONCURRENCY", "100"))
+ADMIN = main.ADMIN_ID
+FIRST_GUEST = 100_000
+
+
+_ids = itertools.count(1)
+
+
+def user(uid: int) -> User:
+    return User(id=uid, is_bot=False, first_name=f"Гість {uid}", username=f"guest{uid}")
+
+
+def text_update(uid: int, text: str, reply_to: int = None) -> Update:
+    chat = Chat(id=uid, type="private")
+    anchor = None
+    if reply_to is not None:
+        anchor = Message(message_id=reply_to, date=datetime.datetime.now(), chat=chat, text="…")
+    return Update(
+        update_id=next(_ids),
+        message=Message(
+            message_id=next(_ids),
+            date=datetime.datetime.now(),
+            chat=chat,
+            from_user=user(uid),
+            text=text,
+            reply_to_message=anchor,
+        ),
+    )
+
+
+def callback_update(uid: int, data: str) -> Update:
+    msg = Message(
+        message_id=next(_ids),
+        date=datetime.datetime.now(),
+        chat=Chat(id=uid, type="private"),
+        text="…",
+    )
+    return Update(
+        update_id=next(_ids),
+        callback_query=CallbackQuery(
+            id=str(next(_ids)), from_user=user(uid), chat_instance="load", message=msg, data=data
+        ),
+    )
+
+
+def pct(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux рахує в КБ, macOS — у байтах
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def drain() -> None:
+    while main.OUTBOX.depth() or main.OUTBOX._busy_chats:
+        await asyncio.sleep(0.01)
+
+
+class LoadTest:
+    def __init__(self, guests: int) -> None:
+        self.uids = [FIRST_GUEST + i for i in range(guests)]
+        self.session = MockSession()
+        self.session.middleware(main.ApiTimingMiddleware())
+        self.bot = Bot(
+            main.BOT_TOKEN,
+            session=self.session,
+            default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        )
+        self.dp = main.create_dispatcher()
+        self.slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def feed(self, update: Update, took: list[float]) -> None:
+        async with self.slots:
+            t = time.perf_counter()
+            await self.dp.feed_update(self.bot, update)
+            took.append(time.perf_counter() - t)
+
+    async def steps(self, uid: int, updates, took: list[float]) -> None:
+        for make in updates:
+            await self.feed(make(uid), took)
+
+    async def scenario(self, name: str, play) -> None:
+        took: list[float] = []
+        calls = sum(self.session.calls.values())
+        t0 = time.perf_counter()
+        await play(took)
+        handled = time.perf_counter() - t0
+        await drain()
+        delivered = time.perf_counter() - t0
+        took.sort()
+        print(
+            f"{name:<12}{len(took):>9}{len(took) / handled:>11.0f}"
+            f"{pct(took, 0.5):>9.2f}{pct(took, 0.99):>9.2f}"
+            f"{sum(self.session.calls.values()) - calls:>11}{delivered:>13.2f}"
+            f"{peak_rss_mb():>9.0f}"
+        )
+
+    def each_guest(self, *updates):
+        async def play(took: list[float]) -> None:
+            await asyncio.gather(*(self.steps(uid, updates, took) for uid in self.uids))
+
+        return play
+
+    async def bridges(self, took: list[float]) -> None:
+        await self.each_guest(
+            lambda uid: callback_update(uid, "ask_org"),
+            lambda uid: text_update(uid, "Коли починаємо?"),
+        )(took)
+        # якорі мостів зʼявляються після доставки повідомлень адміну
+        await drain()
+        anchors = [msg_id for chat_id, msg_id in list(main.BRIDGE_REPLIES.entries) if chat_id == ADMIN]
+        await asyncio.gather(
+            *(self.feed(text_update(ADMIN, "О сьомій 🎄", reply_to=msg_id), took) for msg_id in anchors)
+        )
+
+    async def broadcast(self, took: list[float]) -> None:
+        await self.feed(callback_update(ADMIN, "admin_broadcast"), took)
+        await self.feed(text_update(ADMIN, "Нагадування: дрес-код обовʼязковий!"), took)
+        # чекаємо, поки всі повідомлення розсилки стануть у чергу
+        await asyncio.sleep(0)
+
+    async def run(self) -> None:
+        for i, uid in enumerate(self.uids):
+            main.PREASSIGNED_COLORS[uid] = 1 + i % len(main.COLORS)
+        await main.on_startup(self.bot, self.dp)
+
+        print(f"{len(self.uids)} гостей, до {CONCURRENCY} апдейтів одночасно, Bot API — MockSession")
+        print(
+            f"{'сценарій':<12}{'апдейтів':>9}{'апдейтів/с':>11}{'p50, мс':>9}{'p99, мс':>9}"
+            f"{'викл. API':>11}{'доставка, с':>13}{'RSS, МБ':>9}"
+        )
+        try:
+            await self.scenario("/start", self.each_guest(
+                lambda uid: text_update(uid, "/start"),
+                lambda uid: text_update(uid, main.DEFAULT_PARTY.code),
+                lambda uid: callback_update(uid, "party_yes"),
+                lambda uid: callback_update(uid, "party_confirm_rules"),
+            ))
+            await self.scenario("меню", self.each_guest(
+                lambda uid: callback_update(uid, "menu_now"),
+                lambda uid: text_update(uid, "Борщ"),
+                lambda uid: text_update(uid, "Узвар"),
+                lambda uid: text_update(uid, "Пампушки"),
+            ))
+            await self.scenario("завдання", self.each_guest(
+                lambda uid: text_update(uid, "📋 Мої завдання"),
+                lambda uid: callback_update(uid, "task_toggle:0"),
+                lambda uid: callback_update(uid, "task_toggle:1"),
+                lambda uid: callback_update(uid, "task_toggle:0"),
+            ))
+            await self.scenario("мости", self.bridges)
+            await self.scenario("розсилка", self.broadcast)
+
+            print(f"Bot API: {dict(self.session.calls.most_common())}")
+            await main.OUTBOX.flush_states()
+            print(f"учасників: {len(main.DEFAULT_PARTY.guest_ids())}, outbox: {main.OUTBOX.state_counts()}")
+        finally:
+            for task in list(main.BROADCAST_TASKS):
+                task.cancel()
+            await main.on_shutdown()
+        await self.bot.session.close()
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000]
+    if len(sizes) > 1:
+        for n in sizes:
+            subprocess.run([sys.executable, SCRIPT, str(n)], check=True)
+            print()
+    else:
+        asyncio.run(LoadTest(sizes[0]).run())
@@ -1,13 +1,26 @@
 import os
 import asyncio
+import bisect
+import functools
+import hashlib
+import heapq
+import html
 import random
+import signal
 import json
 import logging
-from typing import Dict, Optional, Any
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Any
 
-from aiogram import Bot, Dispatcher, F, Router
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router
 from aiogram.filters import CommandStart, Command
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import (
     Message,
     CallbackQuery,
@@ -15,8 +28,16 @@ from aiogram.types import (
     KeyboardButton,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
+    TelegramObject,
+    FSInputFile,
 )
-from aiogram.enums import ParseMode
+from aiogram.enums import ChatAction, ParseMode
+from aiogram.fsm.state import State
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 from datetime import datetime, date
 
@@ -24,6 +45,117 @@ from datetime import datetime, date
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+# ================== МЕТРИКИ ==================
+# Гістограми тривалостей у форматі Prometheus: /metrics на webhook-сервері
+# (або на METRICS_PORT у polling-режимі) і коротка зведенка в /stats.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+
+    def quantile(self, q: float) -> float:
+        """Оцінка квантиля: верхня межа кошика, в який він потрапив."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class HistogramFamily:
+    """Одна метрика з мітками: значення міток → Histogram."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets=LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self.series: Dict[str, Histogram] = {}
+
+    def observe(self, value: float, label_value: str) -> None:
+        h = self.series.get(label_value)
+        if h is None:
+            h = self.series[label_value] = Histogram(self.buckets)
+        h.observe(value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, h in sorted(self.series.items()):
+            label = f'{self.label}="{_prom_escape(value)}"'
+            cumulative = 0
+            for bound, n in zip(h.buckets, h.counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {h.count}')
+            lines.append(f"{self.name}_sum{{{label}}} {h.sum:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {h.count}")
+        return lines
+
+
+def _prom_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.histograms: Dict[str, HistogramFamily] = {}
+        # gauge: name → (help, fn); fn рахує значення в момент запиту
+        self.gauges: Dict[str, tuple[str, Callable[[], float]]] = {}
+
+    def histogram(self, name: str, help_text: str, label: str) -> HistogramFamily:
+        family = self.histograms[name] = HistogramFamily(name, help_text, label)
+        return family
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], float]) -> None:
+        self.gauges[name] = (help_text, fn)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for family in self.histograms.values():
+            lines += family.render()
+        for name, (help_text, fn) in self.gauges.items():
+            try:
+                value = fn()
+            except Exception as e:
+                logger.warning("Метрика %s не порахувалась: %s", name, e)
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+HANDLER_SECONDS = METRICS.histogram(
+    "party_handler_seconds", "Тривалість хендлера", "handler"
+)
+ACTION_SECONDS = METRICS.histogram(
+    "party_pending_action_seconds", "Тривалість обробки тексту в стані PENDING_ACTION", "action"
+)
+API_SECONDS = METRICS.histogram(
+    "party_bot_api_seconds", "Тривалість виклику Bot API", "method"
+)
+SAVE_SECONDS = METRICS.histogram(
+    "party_persist_seconds", "Тривалість save_data / flush_data", "op"
+)
+
 # ================== ENV CONFIG ==================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
@@ -31,10 +163,6 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 PARTY_CHANNEL_LINK = os.getenv("PARTY_CHANNEL_LINK")  # канал
 PARTY_CHAT_LINK = os.getenv("PARTY_CHAT_LINK")        # чат вечірки (опційно)
 
-# Ключ: (chat_id, message_id) → міст
-# value: {"peer_id": int, "prefix_to_peer": str, "reply_prefix_back": str}
-BRIDGE_REPLIES: Dict[tuple[int, int], Dict[str, Any]] = {}
-
 # GIF-и
 START_GIF_ID = "CgACAgIAAxkBAAIGaWklx4T4qipoaoAnQ-zZtONcI3PSAAKtggACY8QxSbsclWHIN-W8NgQ"  # START_ID
 
@@ -62,16 +190,6 @@ PARTY_ACTIVE = os.getenv("PARTY_ACTIVE", "1")  # "1" або "0"
 PARTY_CODE_ENV = os.getenv("PARTY_CODE")       # код вечірки, який ти задаєш вручну
 PARTY_FEEDBACK_DATE_ENV = os.getenv("PARTY_FEEDBACK_DATE")  # YYYY-MM-DD або порожньо
 
-# ================== АКТИВНА ВЕЧІРКА ==================
-PARTY = {
-    "active": PARTY_ACTIVE == "1",
-    "name": PARTY_NAME,
-    "location": PARTY_LOCATION,
-    "dates_text": PARTY_DATES_TEXT,
-    "code": PARTY_CODE_ENV,
-    "feedback_date": PARTY_FEEDBACK_DATE_ENV,  # YYYY-MM-DD, з якого дня просимо відгук
-}
-
 
 def register_bridge_message(
     chat_id: int,
@@ -87,21 +205,14 @@ def register_bridge_message(
     reply_prefix_back — префікс для наступного "дзеркального" повідомлення
     у відповідь від peer_id назад (для багатокрокового діалогу).
     """
-    BRIDGE_REPLIES[(chat_id, message_id)] = {
-        "peer_id": peer_id,
-        "prefix_to_peer": prefix_to_peer,
-        "reply_prefix_back": reply_prefix_back,
-    }
-
-
-def apply_party_to_globals():
-    global PARTY_NAME, PARTY_LOCATION, PARTY_DATES_TEXT
-    if PARTY.get("name"):
-        PARTY_NAME = PARTY["name"]
-    if PARTY.get("location"):
-        PARTY_LOCATION = PARTY["location"]
-    if PARTY.get("dates_text"):
-        PARTY_DATES_TEXT = PARTY["dates_text"]
+    BRIDGE_REPLIES.put(
+        (chat_id, message_id),
+        {
+            "peer_id": peer_id,
+            "prefix_to_peer": prefix_to_peer,
+            "reply_prefix_back": reply_prefix_back,
+        },
+    )
 
 
 def generate_party_code(length: int = 6) -> str:
@@ -110,9 +221,9 @@ def generate_party_code(length: int = 6) -> str:
     return "".join(random.choice(chars) for _ in range(length))
 
 
-def party_rules_text(include_cta: bool = True) -> str:
+def party_rules_text(party: "Party", include_cta: bool = True) -> str:
     base = (
-        f"📜 <b>Правила вечірки «{PARTY_NAME}»</b>\n\n"
+        f"📜 <b>Правила вечірки «{party.name}»</b>\n\n"
         "1. У кожного гостя є <b>свій колір-образ</b>. "
         "Це має бути <b>моно-образ</b> — весь твій лук в одному кольорі.\n\n"
         "2. Разом з кольором у тебе є <b>роль</b> та <b>набір міні-завдань</b>. "
@@ -271,20 +382,6 @@ COLOR_TASKS: Dict[int, list[str]] = {
 }
 
 
-def get_color_for_user(user_id: int) -> Optional[Dict[str, Any]]:
-    cid = PREASSIGNED_COLORS.get(user_id)
-    if not cid:
-        return None
-    return COLORS.get(cid)
-
-
-def get_tasks_for_user(user_id: int) -> Optional[list[str]]:
-    cid = PREASSIGNED_COLORS.get(user_id)
-    if not cid:
-        return None
-    return COLOR_TASKS.get(cid)
-
-
 # ================== СТАН SANTA ==================
 class SantaConfig:
     def __init__(self) -> None:
@@ -293,334 +390,2885 @@ class SantaConfig:
         self.budget_text: Optional[str] = None
         self.description: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "registration_open": self.registration_open,
+            "started": self.started,
+            "budget_text": self.budget_text,
+            "description": self.description,
+        }
+
+    def apply(self, raw: Dict[str, Any]) -> None:
+        self.registration_open = raw.get("registration_open", False)
+        self.started = raw.get("started", False)
+        self.budget_text = raw.get("budget_text")
+        self.description = raw.get("description")
+
+
+# ================== ВЕЧІРКИ ==================
+# Один бот веде кілька вечірок одночасно. Кожна — окремий Party зі своїм
+# кодом, кольорами й завданнями, станом Миколайчика і гостями: гість
+# належить вечірці, код якої ввів (Guest.party_code).
+# Вечірка з PARTY_* env — DEFAULT_PARTY, решта описуються в PARTIES_FILE:
+#   [{"code": "NY2025", "name": "...", "location": "...", "dates_text": "...",
+#     "feedback_date": "2025-01-02", "active": true,
+#     "channel_link": "...", "chat_link": "...",
+#     "guests": {"<uid>": <color_id>, ...}}]
+# Кольори й завдання за замовчуванням — спільні COLORS / COLOR_TASKS;
+# вечірка може задати свої ("colors" / "color_tasks", ключі — color_id).
+PARTIES_FILE = os.getenv("PARTIES_FILE", "parties.json")
+
+
+class Party:
+    """
+    Одна вечірка. Опис береться з env / PARTIES_FILE, а змінний стан
+    (Миколайчик) зберігається разом з гостями — див. _party_state().
+    """
 
-SANTA = SantaConfig()
+    def __init__(
+        self,
+        code: Optional[str],
+        name: str,
+        location: str,
+        dates_text: str,
+        active: bool = True,
+        feedback_date: Optional[str] = None,
+        colors: Optional[Dict[int, Dict[str, Any]]] = None,
+        color_tasks: Optional[Dict[int, list[str]]] = None,
+        guests: Optional[Dict[int, int]] = None,
+        channel_link: Optional[str] = None,
+        chat_link: Optional[str] = None,
+    ) -> None:
+        self.code = code.strip().upper() if code else None
+        self.name = name
+        self.location = location
+        self.dates_text = dates_text
+        self.active = active
+        self.feedback_date = feedback_date  # YYYY-MM-DD, з якого дня просимо відгук
+        self.colors = colors if colors is not None else COLORS
+        self.color_tasks = color_tasks if color_tasks is not None else COLOR_TASKS
+        # uid → color_id гостей, яких організатор знає заздалегідь
+        self.guests = guests if guests is not None else {}
+        self.channel_link = channel_link
+        self.chat_link = chat_link
+        self.santa = SantaConfig()
+        # (рядок дати, розібрана дата) — strptime на кожну клавіатуру ні до чого
+        self._feedback_day: tuple[Optional[str], Optional[date]] = (None, None)
+        self._guests_menu: Optional["GuestListPages"] = None
+        self._admin_guests: Optional["GuestListPages"] = None
+
+    @classmethod
+    def from_config(cls, raw: Dict[str, Any]) -> "Party":
+        colors = raw.get("colors")
+        color_tasks = raw.get("color_tasks")
+        return cls(
+            code=raw["code"],
+            name=raw.get("name") or raw["code"],
+            location=raw.get("location") or PARTY_LOCATION,
+            dates_text=raw.get("dates_text") or "",
+            active=raw.get("active", True),
+            feedback_date=raw.get("feedback_date"),
+            colors={int(k): v for k, v in colors.items()} if colors else None,
+            color_tasks={int(k): v for k, v in color_tasks.items()} if color_tasks else None,
+            guests={int(k): int(v) for k, v in raw.get("guests", {}).items()},
+            channel_link=raw.get("channel_link", PARTY_CHANNEL_LINK),
+            chat_link=raw.get("chat_link", PARTY_CHAT_LINK),
+        )
 
-# ================== ПЕРСИСТ ==================
-USERS: Dict[int, Dict[str, Any]] = {}
-PENDING_ACTION: Dict[int, str] = {}
-PENDING_CONTEXT: Dict[int, Any] = {}
-DATA_FILE = "party_data.json"
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "name": self.name,
+            "location": self.location,
+            "dates_text": self.dates_text,
+            "code": self.code,
+            "feedback_date": self.feedback_date,
+        }
+
+    @property
+    def is_open(self) -> bool:
+        """Чи пускає вечірка гостей (активна і має код)."""
+        return bool(self.active and self.code)
+
+    def is_feedback_time(self) -> bool:
+        fb = self.feedback_date
+        if not fb:
+            return False
+        raw, d = self._feedback_day
+        if raw != fb:
+            try:
+                d = datetime.strptime(fb, "%Y-%m-%d").date()
+            except Exception:
+                d = None
+            self._feedback_day = (fb, d)
+        if d is None:
+            return False
+        return date.today() >= d
+
+    def color_id_of(self, user_id: int) -> Optional[int]:
+        cid = self.guests.get(user_id)
+        return cid if cid in self.colors else None
+
+    def guest_ids(self, field: str = "participant", value: Any = True) -> list[int]:
+        """uid гостей цієї вечірки з field == value (через GUEST_INDEX)."""
+        return GUEST_INDEX.ids_in(field, value, self.code)
+
+    def is_member(self, guest: "Guest") -> bool:
+        return guest.participant and guest.party_code == self.code
+
+    @property
+    def guests_menu(self) -> "GuestListPages":
+        if self._guests_menu is None:
+            self._guests_menu = guests_menu_pages(self)
+        return self._guests_menu
+
+    @property
+    def admin_guests(self) -> "GuestListPages":
+        if self._admin_guests is None:
+            self._admin_guests = admin_guests_pages(self)
+        return self._admin_guests
+
+
+DEFAULT_PARTY = Party(
+    code=PARTY_CODE_ENV,
+    name=PARTY_NAME,
+    location=PARTY_LOCATION,
+    dates_text=PARTY_DATES_TEXT,
+    active=PARTY_ACTIVE == "1",
+    feedback_date=PARTY_FEEDBACK_DATE_ENV,
+    guests=PREASSIGNED_COLORS,
+    channel_link=PARTY_CHANNEL_LINK,
+    chat_link=PARTY_CHAT_LINK,
+)
+# код → вечірка; за ним і гість знаходить свою вечірку, і код на вході
+PARTIES: Dict[str, Party] = {}
+# uid відомого гостя → вечірка, куди його пускаємо без коду
+KNOWN_GUESTS: Dict[int, Party] = {}
 
 
-def _base_user_template() -> Dict[str, Any]:
-    return {
-        "participant": False,
-        "color_id": None,
-        "menu_dish": None,
-        "menu_drink": None,
-        "menu_dessert": None,
-        "tasks_done": [],          # список bool по 7 завдань
-        "santa_joined": False,
-        "santa_wish": None,
-        "santa_child_id": None,
-        "santa_id": None,
-        "santa_gift_ready": False,
-        "name": None,
-        "username": None,
-        "has_valid_code": False,
-        "party_code": None,
-        "feedback_requested": False,  # чи вже просили в нього відгук
-        "is_admin": False,
-        "postmenu_followups_blocked": False,  # блокуємо авто-нагадування після меню
-    }
+def register_party(party: Party) -> None:
+    if party.code:
+        if party.code in PARTIES:
+            logger.warning("Вечірка з кодом %s вже є — пропускаю дубль", party.code)
+            return
+        PARTIES[party.code] = party
+    for uid in party.guests:
+        KNOWN_GUESTS.setdefault(uid, party)
 
 
-async def save_data():
-    data = {
-        "USERS": USERS,
-        "SANTA": {
-            "registration_open": SANTA.registration_open,
-            "started": SANTA.started,
-            "budget_text": SANTA.budget_text,
-            "description": SANTA.description,
-        },
-        "PARTY": PARTY,
-    }
+def load_parties_file() -> None:
+    """
+    Вечірки з PARTIES_FILE. Битий файл чи запис не валить бота:
+    логуємо, і працюємо з тим, що вдалось прочитати.
+    """
+    if not os.path.exists(PARTIES_FILE):
+        return
     try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info("Дані збережено (%d гостей)", len(USERS))
+        with open(PARTIES_FILE, "r", encoding="utf-8") as f:
+            raw = json.load(f)
     except Exception as e:
-        logger.error("Помилка збереження даних: %s", e)
+        logger.error("Файл вечірок %s пошкоджений: %s", PARTIES_FILE, e)
+        return
+    for item in raw:
+        try:
+            register_party(Party.from_config(item))
+        except Exception as e:
+            logger.error("Не зміг прочитати вечірку %.80r: %s", item, e)
 
 
-async def load_data():
-    global USERS, PARTY
-    if not os.path.exists(DATA_FILE):
-        return
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-        USERS = {int(k): v for k, v in raw.get("USERS", {}).items()}
+register_party(DEFAULT_PARTY)
+load_parties_file()
 
-        santa_raw = raw.get("SANTA", {})
-        SANTA.registration_open = santa_raw.get("registration_open", False)
-        SANTA.started = santa_raw.get("started", False)
-        SANTA.budget_text = santa_raw.get("budget_text")
-        SANTA.description = santa_raw.get("description")
 
-        logger.info("Дані завантажено: %d гостей", len(USERS))
-    except Exception as e:
-        logger.error("Не вдалося завантажити дані: %s", e)
+def party_by_code(code: Optional[str]) -> Optional[Party]:
+    return PARTIES.get((code or "").strip().upper())
 
 
-# ================== УТІЛІТИ ==================
-async def send_gif(msg: Message, gif_id: Optional[str]):
-    if not gif_id:
-        return
-    try:
-        await msg.answer_animation(animation=gif_id)
-    except Exception as e:
-        logger.warning("GIF не відправився: %s", e)
+def party_for(user: Optional["Guest"]) -> Party:
+    """
+    Вечірка гостя — одним пошуком у PARTIES за кодом, який він ввів.
+    Хто ще не ввів код (або його вечірку прибрали) — у DEFAULT_PARTY.
+    """
+    if user is not None and user.party_code:
+        party = PARTIES.get(user.party_code)
+        if party is not None:
+            return party
+    return DEFAULT_PARTY
 
 
-def get_user(uid: int) -> Dict[str, Any]:
-    if uid not in USERS:
-        USERS[uid] = _base_user_template()
-    u = USERS[uid]
-    if uid == ADMIN_ID:
-        u["is_admin"] = True
-    return u
+# вечірка, якою зараз керує адмін. Живе окремо від його участі як гостя:
+# перемикання між вечірками не чіпає його RSVP, меню і Миколайчика
+ADMIN_PARTY_CODE: Optional[str] = None
 
 
-def is_feedback_time() -> bool:
-    fb = PARTY.get("feedback_date")
-    if not fb:
-        return False
-    try:
-        d = datetime.strptime(fb, "%Y-%m-%d").date()
-    except Exception:
-        return False
-    return date.today() >= d
+def managed_party() -> Party:
+    """Вечірка для адмін-панелі: обрана в «🔀 Інша вечірка», інакше — та, де адмін гість."""
+    party = PARTIES.get(ADMIN_PARTY_CODE or "")
+    if party is not None:
+        return party
+    return party_for(find_user(ADMIN_ID))
 
 
-def mark_user_active(user: Dict[str, Any]) -> None:
-    """
-    Позначаємо, що користувач щось натиснув / написав,
-    тому «післяменюшні» автоповідомлення можна гасити.
-    """
-    user["postmenu_followups_blocked"] = True
+def get_color_for_user(user_id: int) -> Optional[Dict[str, Any]]:
+    party = party_for(find_user(user_id))
+    cid = party.color_id_of(user_id)
+    return party.colors[cid] if cid else None
+
 
+def get_tasks_for_user(user_id: int) -> Optional[list[str]]:
+    party = party_for(find_user(user_id))
+    cid = party.color_id_of(user_id)
+    return party.color_tasks.get(cid) if cid else None
+
+
+# поля гостя, що належать його поточній вечірці
+PARTY_GUEST_FIELDS = (
+    "participant",
+    "color_id",
+    "menu_dish",
+    "menu_drink",
+    "menu_dessert",
+    "santa_joined",
+    "santa_wish",
+    "santa_child_id",
+    "santa_id",
+    "santa_gift_ready",
+    "feedback_requested",
+    "postmenu_followups_blocked",
+)
 
-async def postmenu_followups(bot: Bot, user_id: int):
+
+def reset_party_state(user_id: int, user: "Guest") -> list[int]:
     """
-    Ланцюжок автоматичних повідомлень після того, як користувач заповнив меню.
-    Гаситься, якщо користувач починає щось тиснути в меню.
+    Гість переходить в іншу вечірку — починає там з чистого аркуша.
+
+    Пари Миколайчика в старій вечірці не лишаємо висіти на ньому: його
+    Миколайчик тепер дарує його підопічному (якщо це не заборонено
+    обмеженнями), інакше обидва просто лишаються без пари.
+    Повертає uid гостей старої вечірки, яких теж треба зберегти.
     """
-    await asyncio.sleep(random.uniform(3, 5))
-    user = USERS.get(user_id)
-    if not user or user.get("postmenu_followups_blocked"):
-        return
+    santa_id, child_id = user.santa_id, user.santa_child_id
+    santa = find_user(santa_id) if santa_id else None
+    child = find_user(child_id) if child_id else None
+    # чіпаємо лише тих, хто справді досі вказує на цього гостя
+    if santa is not None and santa.santa_child_id != user_id:
+        santa = None
+    if child is not None and child.santa_id != user_id:
+        child = None
 
-    # 1. Запросити в канал
-    if PARTY_CHANNEL_LINK:
-        try:
-            await bot.send_message(
-                user_id,
-                "Ще один важливий крок! 🎉\n"
-                "Залеті в наш канал — там ми спілкуємось, ділимось фотками та мемами:\n"
-                f"{PARTY_CHANNEL_LINK}"
-            )
-        except Exception as e:
-            logger.warning("Не зміг надіслати нагадування про канал: %s", e)
+    if (
+        santa is not None
+        and child is not None
+        and santa_id != child_id
+        and child_id not in load_santa_exclusions([santa_id, child_id]).get(santa_id, ())
+    ):
+        santa.santa_child_id = child_id
+        child.santa_id = santa_id
+        logger.info("Гість %s пішов з вечірки: тепер %s дарує %s", user_id, santa_id, child_id)
+    elif santa is not None or child is not None:
+        if santa is not None:
+            santa.santa_child_id = None
+        if child is not None:
+            child.santa_id = None
+        logger.info("Гість %s пішов з вечірки: його пари Миколайчика розірвано", user_id)
+    changed = list({uid for uid, g in ((santa_id, santa), (child_id, child)) if g is not None})
+
+    blank = Guest()
+    for field in PARTY_GUEST_FIELDS:
+        setattr(user, field, getattr(blank, field))
+    user.tasks_done = []
+    return changed
 
-    # 2. Почекати 1–5 хвилин
-    await asyncio.sleep(random.uniform(60, 300))
-    user = USERS.get(user_id)
-    if not user or user.get("postmenu_followups_blocked"):
-        return
+# ================== ПЕРСИСТ ==================
+# Стан завдання пакуємо у 2 біти: 0 = ще не виконав, 1 = ✅, 2 = ❌
+_TASK_BITS = 2
+_TASK_MASK = (1 << _TASK_BITS) - 1
 
-    # 2.1 Нагадати про меню
-    try:
-        await bot.send_message(
-            user_id,
-            "Ось так виглядає твоє меню в боті 👇\n"
-            "Завжди можеш глянути або змінити його через розділ «🍽 Моє меню» "
-            "у «👤 Мій кабінет»."
-        )
-    except Exception as e:
-        logger.warning("Не зміг надіслати нагадування про меню: %s", e)
 
-    # 3. Ще 30 секунд → Таємний Миколайчик
-    await asyncio.sleep(30)
-    user = USERS.get(user_id)
-    if not user or user.get("postmenu_followups_blocked"):
-        return
+class Guest:
+    """
+    Запис гостя. __slots__ замість dict: без __dict__ на кожного гостя,
+    а стани завдань лежать в одному int (по 2 біти на завдання).
 
-    try:
-        await bot.send_message(
-            user_id,
-            "Також не забувай про гру «Таємний Миколайчик» 🎅\n"
-            "Як тільки все буде готово — отримаєш від мене окреме повідомлення "
-            "для реєстрації в грі."
-        )
-    except Exception as e:
-        logger.warning("Не зміг надіслати нагадування про Миколайчика: %s", e)
+    to_dict() / from_dict() дають той самий JSON-формат, що й раніше,
+    тож DATA_FILE, журнал і SQLite лишаються сумісними.
+    """
 
-    # 4. Ще 30 секунд → GIF + підказка про допомогу
-    await asyncio.sleep(30)
-    user = USERS.get(user_id)
-    if not user or user.get("postmenu_followups_blocked"):
-        return
+    __slots__ = (
+        "participant",
+        "color_id",
+        "menu_dish",
+        "menu_drink",
+        "menu_dessert",
+        "santa_joined",
+        "santa_wish",
+        "santa_child_id",
+        "santa_id",
+        "santa_gift_ready",
+        "name",
+        "username",
+        "has_valid_code",
+        "party_code",
+        "feedback_requested",
+        "is_admin",
+        "postmenu_followups_blocked",
+        "_tasks_bits",
+        "_tasks_len",
+        "extra",
+    )
 
-    try:
-        msg = await bot.send_message(
-            user_id,
-            "Ну що, якщо будуть питання — я завжди тут 😉\n"
-            "Натискай «❓ Допомога» в меню, а потім кнопку "
-            "«✉ Звʼязатись з організатором Ніколасом»."
-        )
-        await send_gif(msg, REMINDER_GIF_ID)
-    except Exception as e:
-        logger.warning("Не зміг надіслати фінальне нагадування: %s", e)
+    # порядок ключів у JSON — такий самий, як у наявних файлах даних
+    FIELDS = (
+        "participant",
+        "color_id",
+        "menu_dish",
+        "menu_drink",
+        "menu_dessert",
+        "tasks_done",
+        "santa_joined",
+        "santa_wish",
+        "santa_child_id",
+        "santa_id",
+        "santa_gift_ready",
+        "name",
+        "username",
+        "has_valid_code",
+        "party_code",
+        "feedback_requested",
+        "is_admin",
+        "postmenu_followups_blocked",
+    )
 
+    def __init__(self) -> None:
+        self.participant: bool = False
+        self.color_id: Optional[int] = None
+        self.menu_dish: Optional[str] = None
+        self.menu_drink: Optional[str] = None
+        self.menu_dessert: Optional[str] = None
+        self.santa_joined: bool = False
+        self.santa_wish: Optional[str] = None
+        self.santa_child_id: Optional[int] = None
+        self.santa_id: Optional[int] = None
+        self.santa_gift_ready: bool = False
+        self.name: Optional[str] = None
+        self.username: Optional[str] = None
+        self.has_valid_code: bool = False
+        self.party_code: Optional[str] = None
+        self.feedback_requested: bool = False  # чи вже просили в нього відгук
+        self.is_admin: bool = False
+        self.postmenu_followups_blocked: bool = False  # блокуємо авто-нагадування після меню
+        self._tasks_bits: int = 0
+        self._tasks_len: int = 0
+        # невідомі ключі зі старих/новіших файлів — щоб нічого не губити при збереженні
+        self.extra: Optional[Dict[str, Any]] = None
+
+    @property
+    def tasks_done(self) -> list[int]:
+        bits = self._tasks_bits
+        return [(bits >> (i * _TASK_BITS)) & _TASK_MASK for i in range(self._tasks_len)]
+
+    @tasks_done.setter
+    def tasks_done(self, states: list) -> None:
+        bits = 0
+        for i, v in enumerate(states):
+            bits |= (int(v) & _TASK_MASK) << (i * _TASK_BITS)
+        self._tasks_bits = bits
+        self._tasks_len = len(states)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {field: getattr(self, field) for field in self.FIELDS}
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Guest":
+        g = cls()
+        for key, value in d.items():
+            if key in cls.FIELDS:
+                setattr(g, key, value)
+            else:
+                if g.extra is None:
+                    g.extra = {}
+                g.extra[key] = value
+        return g
+
+
+USERS: Dict[int, Guest] = {}
+DATA_FILE = "party_data.json"
 
-# ================== КЛАВІАТУРИ ==================
-def main_menu_kb(user: Dict[str, Any]) -> ReplyKeyboardMarkup:
-    buttons: list[list[KeyboardButton]] = []
 
-    # 1. Учасник / не учасник
-    if user.get("participant"):
-        # перший ряд — кабінет + Миколайчик
-        buttons.append([
-            KeyboardButton(text="👤 Мій кабінет"),
-            KeyboardButton(text="🎅 Мій Миколайчик"),
-        ])
-        # другий ряд — меню + про вечірку
-        buttons.append([
-            KeyboardButton(text="📜 Наше меню"),
-            KeyboardButton(text="ℹ️ Про вечірку"),
-        ])
-    else:
-        # гість не підтвердив участь
-        buttons.append([KeyboardButton(text="ℹ️ Про вечірку")])
+# Write-behind: хендлери лише позначають «брудних» гостей, а на диск
+# усе скидає фоновий persist_loop() — раз на PERSIST_INTERVAL секунд
+# або одразу, щойно назбирається PERSIST_BATCH_SIZE змін.
+PERSIST_INTERVAL = float(os.getenv("PERSIST_INTERVAL", "5"))
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+
+# STORAGE_BACKEND:
+#   "json"   — DATA_FILE (+ журнал, див. STORAGE_MODE), усі гості в памʼяті;
+#   "sqlite" — SQLITE_FILE, гості підвантажуються в USERS за потреби.
+# Фільтри по participant / santa_joined / color_id / party_code в обох
+# випадках ідуть через GUEST_INDEX у памʼяті.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+
+# STORAGE_MODE (тільки для json):
+#   "journal"  — кожна зміна гостя дописується одним рядком у JOURNAL_FILE,
+#                повний знімок DATA_FILE пишеться лише при компактизації;
+#   "snapshot" — старий режим, кожен flush переписує DATA_FILE повністю.
+STORAGE_MODE = os.getenv("STORAGE_MODE", "journal")
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "party_data.journal")
+JOURNAL_COMPACT_RECORDS = int(os.getenv("JOURNAL_COMPACT_RECORDS", "5000"))
+# скільки попередніх знімків тримати поруч: party_data.json.1 … .N
+DATA_BACKUPS = int(os.getenv("DATA_BACKUPS", "3"))
+
+SQLITE_FILE = os.getenv("SQLITE_FILE", "party_data.sqlite3")
+
+DIRTY_USERS: set[int] = set()
+# гості, чиї зміни вже забрав flush, але ще не записав
+_INFLIGHT_USERS: set[int] = set()
+_STATE_DIRTY = False
+_FLUSH_WAKEUP = asyncio.Event()
+_FLUSH_LOCK = asyncio.Lock()
+# підписники на зміни гостей (кеші готового тексту тощо): hook(user_ids);
+# порожній кортеж — дані перечитано повністю
+GUEST_CHANGE_HOOKS: list[Callable[[tuple[int, ...]], None]] = []
+
+
+def _party_state() -> Dict[str, Any]:
+    """
+    Змінний стан вечірок: Миколайчик DEFAULT_PARTY — під старим ключем
+    SANTA (сумісно з наявними даними), решта — в PARTIES за кодом;
+    ADMIN_PARTY — яку вечірку обрав адмін.
+    """
+    return {
+        "SANTA": DEFAULT_PARTY.santa.to_dict(),
+        "PARTIES": {
+            code: {"santa": party.santa.to_dict()}
+            for code, party in PARTIES.items()
+            if party is not DEFAULT_PARTY
+        },
+        "ADMIN_PARTY": ADMIN_PARTY_CODE,
+    }
 
-    # 2. Канал + чат
-    row = [KeyboardButton(text="📢 Канал вечірки")]
-    row.append(KeyboardButton(text="💬 Чат вечірки"))
-    buttons.append(row)
 
-    # 3. Допомога
-    buttons.append([KeyboardButton(text="❓ Допомога")])
+def _apply_party_state(state: Dict[str, Any]) -> None:
+    global ADMIN_PARTY_CODE
+    ADMIN_PARTY_CODE = state.get("ADMIN_PARTY") or None
+    DEFAULT_PARTY.santa.apply(state.get("SANTA") or {})
+    for code, raw in (state.get("PARTIES") or {}).items():
+        party = PARTIES.get(code)
+        if party is None or party is DEFAULT_PARTY:
+            logger.warning("Збережений стан вечірки %s без опису в %s — пропускаю", code, PARTIES_FILE)
+            continue
+        party.santa.apply(raw.get("santa") or {})
 
-    # 4. Відгук (якщо час)
-    if user.get("participant") and is_feedback_time():
-        buttons.append([KeyboardButton(text="⭐ Відгук про вечірку")])
 
-    # 5. Адмін-панель
-    if user.get("is_admin"):
-        buttons.append([KeyboardButton(text="🛠 Адмін-панель")])
+SNAPSHOT_COPY_CHUNK = 2000
 
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
+async def _state_snapshot() -> Dict[str, Any]:
+    """
+    Копія всього стану для запису у фоновому потоці: хендлери можуть
+    і далі змінювати USERS, поки json.dump працює з копією.
+    Копіюємо порціями, віддаючи керування loop'у між ними, — кожен гість
+    у знімку узгоджений, а loop не стоїть на сотнях тисяч записів.
+    """
+    items = list(USERS.items())
+    users: Dict[int, Dict[str, Any]] = {}
+    for start in range(0, len(items), SNAPSHOT_COPY_CHUNK):
+        for uid, u in items[start:start + SNAPSHOT_COPY_CHUNK]:
+            users[uid] = u.to_dict()
+        await asyncio.sleep(0)
+    return {
+        "USERS": users,
+        **_party_state(),
+        "PARTY": DEFAULT_PARTY.to_dict(),
+    }
 
-def cabinet_menu_kb() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="🎨 Мій образ"),
-                KeyboardButton(text="📋 Мої завдання"),
-            ],
-            [KeyboardButton(text="🍽 Моє меню")],
-            [KeyboardButton(text="🔙 Назад")],
-        ],
-        resize_keyboard=True,
-    )
 
+def _fsync_dir(path: str) -> None:
+    """
+    fsync каталогу, щоб rename теж гарантовано потрапив на диск.
+    """
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
 
-@router.message(F.text == "🍽 Моє меню")
-async def my_menu(message: Message):
-    user = get_user(message.from_user.id)
-    if not user.get("participant"):
-        await message.answer("Спочатку підтверди участь у вечірці — напиши /start 🎄")
+
+def _rotate_backups() -> None:
+    """
+    DATA_FILE → DATA_FILE.1 → DATA_FILE.2 … → DATA_FILE.<DATA_BACKUPS>.
+    Найстаріша копія просто перезаписується.
+    """
+    if DATA_BACKUPS <= 0 or not os.path.exists(DATA_FILE):
         return
+    for i in range(DATA_BACKUPS - 1, 0, -1):
+        src_path = f"{DATA_FILE}.{i}"
+        if os.path.exists(src_path):
+            os.replace(src_path, f"{DATA_FILE}.{i + 1}")
+    os.replace(DATA_FILE, f"{DATA_FILE}.1")
 
-    mark_user_active(user)
 
-    dish = user.get("menu_dish")
-    drink = user.get("menu_drink")
-    dessert = user.get("menu_dessert")
+def _write_snapshot(data: Dict[str, Any]) -> None:
+    """
+    Повний знімок стану: tmp-файл → fsync → ротація бекапів → атомарний rename.
+    Обрив посеред запису залишає або старий, або новий файл, але не обрізаний.
+    Викликається у потоці executor'а.
+    """
+    tmp_path = DATA_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    _rotate_backups()
+    os.replace(tmp_path, DATA_FILE)
+    _fsync_dir(DATA_FILE)
 
-    dish_txt = dish or "ще не вказана"
-    drink_txt = drink or "ще не вказаний"
-    dessert_txt = dessert or "ще не вказаний"
 
-    text = (
-        "<b>Твоє меню:</b>\n"
-        f"• Страва: {dish_txt}\n"
-        f"• Напій: {drink_txt}\n"
-        f"• Десерт: {dessert_txt}\n"
-    )
+def _read_snapshot() -> Optional[Dict[str, Any]]:
+    """
+    Читає DATA_FILE, а якщо він битий — найсвіжіший валідний бекап.
+    Битий основний файл відкладаємо в DATA_FILE.corrupt, щоб ротація
+    не витіснила ним справжні бекапи.
+    """
+    candidates = [DATA_FILE] + [f"{DATA_FILE}.{i}" for i in range(1, DATA_BACKUPS + 1)]
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            if not isinstance(raw, dict):
+                raise ValueError("знімок не є JSON-обʼєктом")
+        except Exception as e:
+            logger.error("Файл даних %s пошкоджений: %s", path, e)
+            if path == DATA_FILE:
+                os.replace(DATA_FILE, DATA_FILE + ".corrupt")
+            continue
+        if path != DATA_FILE:
+            logger.warning("Відновлюю дані з резервної копії %s", path)
+        return raw
+    return None
 
-    # Якщо меню ще взагалі не заповнене — пропонуємо заповнити
-    if not dish and not drink and not dessert:
-        text += (
-            "\nЗараз у тебе ще нічого не вказано.\n"
-            "Можеш заповнити меню прямо зараз 👇"
-        )
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="📝 Заповнити меню зараз",
-                        callback_data="menu_now",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text="⏱ Пізніше додам",
-                        callback_data="menu_later",
-                    )
-                ],
-            ]
-        )
-        await message.answer(text, reply_markup=kb)
-        return
 
-    # Якщо щось вже є — питаємо, що саме змінити
-    text += (
-        "\nЩо хочеш змінити?\n"
-        "Можеш обрати варіант нижче, або вручну написати:\n"
-        "«Страва: ...», «Напій: ...» або «Десерт: ...»."
-    )
+def _append_journal(records: list[Dict[str, Any]]) -> int:
+    """
+    Дописує в журнал по одному компактному рядку на кожну зміну.
+    Повертає кількість записаних рядків. Викликається у потоці executor'а.
+    """
+    lines = [
+        json.dumps(rec, ensure_ascii=False, separators=(",", ":")) for rec in records
+    ]
+    with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return len(lines)
 
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✏ Змінити страву", callback_data="edit_dish"),
-            ],
-            [
-                InlineKeyboardButton(text="🥂 Змінити напій", callback_data="edit_drink"),
-            ],
-            [
-                InlineKeyboardButton(text="🍰 Змінити десерт", callback_data="edit_dessert"),
-            ],
-        ]
-    )
 
-    await message.answer(text, reply_markup=kb)
+def _compact_journal(data: Dict[str, Any]) -> None:
+    """
+    Знімок + обнулення журналу. Якщо впадемо між цими кроками —
+    журнал просто переграється поверх свіжого знімка ще раз.
+    """
+    _write_snapshot(data)
+    with open(JOURNAL_FILE, "w", encoding="utf-8"):
+        pass
 
 
-@router.message(F.text == "👤 Мій кабінет")
-async def cabinet_menu(message: Message):
-    user = get_user(message.from_user.id)
-    if not user.get("participant"):
-        await message.answer("Спочатку підтверди участь у вечірці — напиши /start 🎄")
-        return
-    mark_user_active(user)
-    await message.answer("Твій кабінет гостя:", reply_markup=cabinet_menu_kb())
+def _replay_journal(
+    users: Dict[int, Dict[str, Any]],
+    state: Dict[str, Any],
+) -> tuple[int, int]:
+    """
+    Переграє журнал поверх уже завантаженого знімка (users / state змінюються на місці).
+    Битий (недописаний) рядок пропускаємо — решта даних ціла.
+    Повертає (переграно, пропущено).
+    """
+    if not os.path.exists(JOURNAL_FILE):
+        return 0, 0
+    replayed = 0
+    damaged = 0
+    with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                logger.warning("Пропускаю битий запис журналу: %.80s", line)
+                damaged += 1
+                continue
+            if "u" in rec:
+                uid = int(rec["u"])
+                if rec.get("d") is None:
+                    users.pop(uid, None)
+                else:
+                    users[uid] = rec["d"]
+            elif "s" in rec:
+                state["SANTA"] = rec["s"]
+            elif "p" in rec:
+                state["PARTIES"] = rec["p"]
+            elif "a" in rec:
+                state["ADMIN_PARTY"] = rec["a"]
+            replayed += 1
+    return replayed, damaged
+
+
+# ================== СХОВИЩА ==================
+def open_store_db(path: str, schema: tuple[str, ...] = (), **connect_kwargs: Any) -> sqlite3.Connection:
+    """
+    Зʼєднання з SQLite-файлом бота: WAL (читачі не чекають на запис),
+    synchronous=NORMAL і таблиці зі schema, якщо їх ще немає.
+    Кожне сховище відкриває собі одне таке зʼєднання ліниво.
+    """
+    conn = sqlite3.connect(path, **connect_kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for stmt in schema:
+        conn.execute(stmt)
+    conn.commit()
+    return conn
+
+
+# Усі методи, крім load_user / index_rows, викликаються у потоці executor'а
+# і ніколи паралельно між собою (їх серіалізує _FLUSH_LOCK).
+class JsonStorage:
+    """
+    DATA_FILE + журнал. Усі гості живуть у USERS.
+    """
 
+    lazy = False
 
-def santa_join_menu_kb(user: Dict[str, Any]) -> InlineKeyboardMarkup:
-    if not SANTA.registration_open:
-        return InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="Реєстрація ще не відкрита", callback_data="noop")]
-            ]
-        )
+    def __init__(self) -> None:
+        self.journal_records = 0
+
+    def load(self) -> tuple[Dict[int, Dict[str, Any]], Dict[str, Any]]:
+        users: Dict[int, Dict[str, Any]] = {}
+        state: Dict[str, Any] = {"SANTA": {}, "PARTIES": {}, "ADMIN_PARTY": None}
+        raw = _read_snapshot()
+        if raw is not None:
+            users = {int(k): v for k, v in raw.get("USERS", {}).items()}
+            state["SANTA"] = dict(raw.get("SANTA", {}))
+            state["PARTIES"] = dict(raw.get("PARTIES", {}))
+            state["ADMIN_PARTY"] = raw.get("ADMIN_PARTY")
+
+        replayed, damaged = _replay_journal(users, state)
+        if replayed:
+            logger.info("Переграно %d записів журналу", replayed)
+        if damaged:
+            # недописаний хвіст склеївся б з наступним записом — одразу стискаємо
+            _compact_journal({"USERS": users, **state, "PARTY": DEFAULT_PARTY.to_dict()})
+            replayed = 0
+        self.journal_records = replayed
+        return users, state
+
+    def write_changes(
+        self,
+        users: Dict[int, Optional[Dict[str, Any]]],
+        state: Optional[Dict[str, Any]],
+    ) -> None:
+        if STORAGE_MODE != "journal":
+            return
+        records: list[Dict[str, Any]] = [{"u": uid, "d": d} for uid, d in users.items()]
+        if state is not None:
+            records.append({"s": state["SANTA"]})
+            records.append({"p": state["PARTIES"]})
+            records.append({"a": state["ADMIN_PARTY"]})
+        self.journal_records += _append_journal(records)
+
+    def wants_snapshot(self) -> bool:
+        return STORAGE_MODE != "journal" or self.journal_records >= JOURNAL_COMPACT_RECORDS
+
+    def write_snapshot(self, data: Dict[str, Any]) -> None:
+        if STORAGE_MODE == "journal":
+            _compact_journal(data)
+            self.journal_records = 0
+            logger.info("Журнал стиснуто у знімок (%d гостей)", len(data["USERS"]))
+        else:
+            _write_snapshot(data)
+
+    def load_user(self, uid: int) -> Optional[Dict[str, Any]]:
+        return None
+
+    def index_rows(self) -> Optional[list[tuple]]:
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteStorage:
+    """
+    SQLite (WAL): по рядку на гостя, JSON-запис у колонці data
+    і окремі проіндексовані колонки для фільтрів.
+
+    Два зʼєднання: writer — для flush у потоці executor'а,
+    reader — для точкових читань з event loop'а (WAL не блокує їх записом).
+    Текст запитів — константи, тож sqlite3 тримає їх підготовленими
+    у своєму кеші statement'ів.
+    """
+
+    lazy = True
+
+    # колонки, які дублюються з JSON-запису заради індексів
+    INDEXED_FIELDS = ("participant", "santa_joined", "color_id", "party_code")
+
+    SQL_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS users ("
+        " uid INTEGER PRIMARY KEY,"
+        " participant INTEGER NOT NULL DEFAULT 0,"
+        " santa_joined INTEGER NOT NULL DEFAULT 0,"
+        " color_id INTEGER,"
+        " party_code TEXT,"
+        " data TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS users_participant ON users(participant)",
+        "CREATE INDEX IF NOT EXISTS users_santa_joined ON users(santa_joined)",
+        "CREATE INDEX IF NOT EXISTS users_color_id ON users(color_id)",
+        "CREATE INDEX IF NOT EXISTS users_party_code ON users(party_code)",
+        "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    )
+    SQL_UPSERT_USER = (
+        "INSERT INTO users (uid, participant, santa_joined, color_id, party_code, data)"
+        " VALUES (?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT(uid) DO UPDATE SET"
+        " participant = excluded.participant,"
+        " santa_joined = excluded.santa_joined,"
+        " color_id = excluded.color_id,"
+        " party_code = excluded.party_code,"
+        " data = excluded.data"
+    )
+    SQL_DELETE_USER = "DELETE FROM users WHERE uid = ?"
+    SQL_SELECT_USER = "SELECT data FROM users WHERE uid = ?"
+    SQL_COUNT_USERS = "SELECT COUNT(*) FROM users"
+    SQL_UPSERT_STATE = (
+        "INSERT INTO state (key, value) VALUES (?, ?)"
+        " ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+    )
+    SQL_SELECT_STATE = "SELECT value FROM state WHERE key = ?"
+    SQL_SELECT_INDEX_ROWS = (
+        f"SELECT uid, {', '.join(INDEXED_FIELDS)} FROM users ORDER BY uid"
+    )
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._writer = self._connect()
+        for stmt in self.SQL_SCHEMA:
+            self._writer.execute(stmt)
+        self._writer.commit()
+        self._reader = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        return open_store_db(self.path, check_same_thread=False, cached_statements=64)
+
+    @staticmethod
+    def _row(uid: int, d: Dict[str, Any]) -> tuple:
+        return (
+            uid,
+            1 if d.get("participant") else 0,
+            1 if d.get("santa_joined") else 0,
+            d.get("color_id"),
+            d.get("party_code"),
+            json.dumps(d, ensure_ascii=False, separators=(",", ":")),
+        )
+
+    def _import_json(self) -> None:
+        """
+        Разовий перенос з DATA_FILE / журналу, коли база ще порожня.
+        """
+        users, state = JsonStorage().load()
+        if not users and not any(state.values()):
+            return
+        self.write_changes(users, state)
+        logger.info("Імпортовано %d гостей з %s у SQLite", len(users), DATA_FILE)
+
+    def load(self) -> tuple[Dict[int, Dict[str, Any]], Dict[str, Any]]:
+        # гостей не вантажимо — get_user() / find_user() підтягнуть їх за потреби
+        (count,) = self._writer.execute(self.SQL_COUNT_USERS).fetchone()
+        if not count:
+            self._import_json()
+            (count,) = self._writer.execute(self.SQL_COUNT_USERS).fetchone()
+        logger.info("SQLite: у базі %d гостей", count)
+        state: Dict[str, Any] = {}
+        for key in ("SANTA", "PARTIES", "ADMIN_PARTY"):
+            row = self._writer.execute(self.SQL_SELECT_STATE, (key,)).fetchone()
+            state[key] = json.loads(row[0]) if row else {}
+        return {}, state
+
+    def write_changes(
+        self,
+        users: Dict[int, Optional[Dict[str, Any]]],
+        state: Optional[Dict[str, Any]],
+    ) -> None:
+        upserts = [self._row(uid, d) for uid, d in users.items() if d is not None]
+        deletes = [(uid,) for uid, d in users.items() if d is None]
+        with self._writer:
+            if upserts:
+                self._writer.executemany(self.SQL_UPSERT_USER, upserts)
+            if deletes:
+                self._writer.executemany(self.SQL_DELETE_USER, deletes)
+            if state is not None:
+                self._writer.executemany(
+                    self.SQL_UPSERT_STATE,
+                    [(key, json.dumps(value, ensure_ascii=False)) for key, value in state.items()],
+                )
+
+    def wants_snapshot(self) -> bool:
+        return False
+
+    def write_snapshot(self, data: Dict[str, Any]) -> None:
+        pass
+
+    def load_user(self, uid: int) -> Optional[Dict[str, Any]]:
+        row = self._reader.execute(self.SQL_SELECT_USER, (uid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def index_rows(self) -> Optional[list[tuple]]:
+        """(uid, participant, santa_joined, color_id, party_code) усіх гостей."""
+        return [
+            (uid, bool(participant), bool(santa_joined), color_id, party_code)
+            for uid, participant, santa_joined, color_id, party_code
+            in self._reader.execute(self.SQL_SELECT_INDEX_ROWS)
+        ]
+
+    def close(self) -> None:
+        self._reader.close()
+        self._writer.close()
+
+
+def create_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_FILE)
+    return JsonStorage()
+
+
+STORAGE = create_storage()
+
+
+async def save_data(*user_ids: int):
+    """
+    Позначає зміни до збереження і одразу повертає керування.
+
+    save_data(uid) — змінився конкретний гість,
+    save_data() без аргументів — змінився стан вечірки (Миколайчик).
+    Фактичний запис робить flush_data().
+    """
+    global _STATE_DIRTY
+    started = time.perf_counter()
+    if user_ids:
+        DIRTY_USERS.update(user_ids)
+        for hook in GUEST_CHANGE_HOOKS:
+            hook(user_ids)
+    else:
+        _STATE_DIRTY = True
+    if len(DIRTY_USERS) >= PERSIST_BATCH_SIZE:
+        _FLUSH_WAKEUP.set()
+    SAVE_SECONDS.observe(time.perf_counter() - started, "save_data")
+
+
+async def flush_data():
+    """
+    Скидає всі накопичені зміни в сховище (якщо вони є).
+    """
+    global _STATE_DIRTY
+    async with _FLUSH_LOCK:
+        if not DIRTY_USERS and not _STATE_DIRTY:
+            return
+        started = time.perf_counter()
+        dirty = set(DIRTY_USERS)
+        state_dirty = _STATE_DIRTY
+        DIRTY_USERS.clear()
+        _STATE_DIRTY = False
+        _INFLIGHT_USERS.update(dirty)
+
+        try:
+            # копії знімаємо тут, на event loop'і; серіалізація і диск — у потоці
+            changes = {
+                uid: USERS[uid].to_dict() if uid in USERS else None for uid in dirty
+            }
+            state = _party_state() if state_dirty else None
+            await asyncio.to_thread(STORAGE.write_changes, changes, state)
+            if STORAGE.wants_snapshot():
+                await asyncio.to_thread(STORAGE.write_snapshot, await _state_snapshot())
+            logger.info("Дані збережено (змінено %d гостей)", len(dirty))
+        except Exception as e:
+            # не губимо зміни — спробуємо ще раз на наступному flush
+            DIRTY_USERS.update(dirty)
+            _STATE_DIRTY = _STATE_DIRTY or state_dirty
+            logger.error("Помилка збереження даних: %s", e)
+        finally:
+            _INFLIGHT_USERS.clear()
+            SAVE_SECONDS.observe(time.perf_counter() - started, "flush_data")
+
+
+async def persist_loop():
+    """
+    Фоновий flusher: чекає інтервал або сигнал про переповнення батчу.
+    """
+    while True:
+        try:
+            await asyncio.wait_for(_FLUSH_WAKEUP.wait(), timeout=PERSIST_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _FLUSH_WAKEUP.clear()
+        await flush_data()
+
+
+def _load_guests() -> tuple[Dict[int, Guest], Dict[str, Any]]:
+    # і читання, і перетворення dict → Guest — у потоці executor'а
+    users, state = STORAGE.load()
+    return {uid: Guest.from_dict(d) for uid, d in users.items()}, state
+
+
+async def load_data():
+    global USERS
+    try:
+        users, state = await asyncio.to_thread(_load_guests)
+        USERS = users
+        _apply_party_state(state)
+        for hook in GUEST_CHANGE_HOOKS:
+            hook(())
+        if STORAGE.lazy:
+            logger.info("Дані підключено (%s), гості вантажаться за потреби", STORAGE_BACKEND)
+        else:
+            logger.info("Дані завантажено: %d гостей", len(USERS))
+    except Exception as e:
+        logger.error("Не вдалося завантажити дані: %s", e)
+
+
+def find_user(uid: int) -> Optional[Guest]:
+    """
+    Як USERS.get(uid), але з догрузкою зі сховища (для sqlite-бекенду).
+    На відміну від get_user() не створює нового гостя.
+    """
+    u = USERS.get(uid)
+    if u is None and STORAGE.lazy:
+        raw = STORAGE.load_user(uid)
+        if raw is not None:
+            u = USERS[uid] = Guest.from_dict(raw)
+    return u
+
+
+class GuestIndex:
+    """
+    Вторинні індекси по гостях: field → значення → uid, щоб «усі учасники»,
+    «усі гравці Миколайчика», «усі з кольором N» коштували O(k) знайдених,
+    а не прохід по всіх, кого бот будь-коли бачив.
+
+    Оновлюється через GUEST_CHANGE_HOOKS, тобто з кожним save_data(uid).
+    Порожні значення (None / False) не індексуються. Множини — dict'и
+    з None, щоб порядок був стабільний: як у USERS / за uid після
+    завантаження, а хто зʼявився пізніше — в кінці.
+    """
+
+    FIELDS = SqliteStorage.INDEXED_FIELDS
+
+    def __init__(self) -> None:
+        self._by_field: Dict[str, Dict[Any, Dict[int, None]]] = {f: {} for f in self.FIELDS}
+        self._values: Dict[int, tuple] = {}
+        self._field_pos = {f: i for i, f in enumerate(self.FIELDS)}
+
+    def _set(self, uid: int, values: Optional[tuple]) -> None:
+        old = self._values.get(uid)
+        if old == values:
+            return
+        for i, field in enumerate(self.FIELDS):
+            before = old[i] if old else None
+            after = values[i] if values else None
+            if before == after:
+                continue
+            index = self._by_field[field]
+            if before is not None and before is not False:
+                bucket = index.get(before)
+                if bucket is not None:
+                    bucket.pop(uid, None)
+                    if not bucket:
+                        del index[before]
+            if after is not None and after is not False:
+                index.setdefault(after, {})[uid] = None
+        if values is None:
+            self._values.pop(uid, None)
+        else:
+            self._values[uid] = values
+
+    def _values_of(self, guest: Guest) -> tuple:
+        return tuple(getattr(guest, field) for field in self.FIELDS)
+
+    def rebuild(self) -> None:
+        self._by_field = {f: {} for f in self.FIELDS}
+        self._values = {}
+        rows = STORAGE.index_rows()
+        if rows is not None:
+            for uid, *values in rows:
+                self._set(uid, tuple(values))
+        # гості в памʼяті — свіжіші за сховище (ще не записані зміни)
+        for uid, guest in USERS.items():
+            self._set(uid, self._values_of(guest))
+
+    def update(self, user_ids: tuple[int, ...]) -> None:
+        if not user_ids:
+            self.rebuild()
+            return
+        for uid in user_ids:
+            guest = USERS.get(uid)
+            self._set(uid, self._values_of(guest) if guest is not None else None)
+
+    def ids(self, field: str, value: Any) -> list[int]:
+        return list(self._by_field[field].get(value, ()))
+
+    def count(self, field: str, value: Any) -> int:
+        return len(self._by_field[field].get(value, ()))
+
+    def ids_in(self, field: str, value: Any, party_code: Optional[str]) -> list[int]:
+        """
+        Як ids(), але лише серед гостей вечірки party_code — у порядку,
+        в якому вони до неї приєднались. Перебираємо тільки гостей
+        цієї вечірки, скільки б інших вечірок не було.
+        """
+        members = self._by_field["party_code"].get(party_code, ())
+        i = self._field_pos[field]
+        values = self._values
+        return [uid for uid in members if values[uid][i] == value]
+
+
+GUEST_INDEX = GuestIndex()
+GUEST_CHANGE_HOOKS.append(GUEST_INDEX.update)
+
+
+def _select_user_ids(field: str, value: Any) -> list[int]:
+    """uid гостей, у яких field == value (див. GuestIndex)."""
+    return GUEST_INDEX.ids(field, value)
+
+
+def participant_ids() -> list[int]:
+    return _select_user_ids("participant", True)
+
+
+def santa_player_ids() -> list[int]:
+    return _select_user_ids("santa_joined", True)
+
+
+def color_guest_ids(color_id: int) -> list[int]:
+    return _select_user_ids("color_id", color_id)
+
+
+def party_guest_ids(code: str) -> list[int]:
+    return _select_user_ids("party_code", code)
+
+
+# ================== УТІЛІТИ ==================
+async def send_gif(msg: Message, gif_id: Optional[str]):
+    if not gif_id:
+        return
+    try:
+        await MEDIA.send_animation(msg.bot, msg.chat.id, gif_id)
+    except Exception as e:
+        logger.warning("GIF не відправився: %s", e)
+
+
+async def answer_with_gif(
+    msg: Message,
+    gif_id: Optional[str],
+    text: str,
+    reply_markup: Any = None,
+    combine: bool = True,
+):
+    """
+    GIF + текстова відповідь без двох послідовних round-trip'ів:
+      * combine=True і текст влазить у підпис — одне повідомлення
+        (анімація з підписом і клавіатурою);
+      * інакше GIF і текст ідуть паралельно. combine=False — для
+        повідомлень, які потім редагуються через edit_text (сторінки,
+        меню реєстрації): підпис так не відредагуєш.
+    """
+    if gif_id and combine and len(text) <= MEDIA_CAPTION_LIMIT:
+        try:
+            await MEDIA.send_animation(
+                msg.bot, msg.chat.id, gif_id, caption=text, reply_markup=reply_markup
+            )
+            return
+        except Exception as e:
+            logger.warning("GIF з підписом не відправився, шлю текстом: %s", e)
+        await msg.answer(text, reply_markup=reply_markup)
+        return
+    await asyncio.gather(send_gif(msg, gif_id), answer_text(msg, text, reply_markup))
+
+
+async def answer_text(msg: Message, text: str, reply_markup: Any = None) -> Message:
+    # msg.answer() повертає метод API, а не корутину — для asyncio.gather
+    return await msg.answer(text, reply_markup=reply_markup)
+
+
+def get_user(uid: int) -> Guest:
+    u = find_user(uid)
+    if u is None:
+        u = USERS[uid] = Guest()
+    if uid == ADMIN_ID:
+        u.is_admin = True
+    return u
+
+
+def mark_user_active(user_id: int, user: Guest) -> None:
+    """
+    Позначаємо, що користувач щось натиснув / написав,
+    тому «післяменюшні» автоповідомлення можна гасити —
+    разом із уже запланованими кроками в SCHEDULER.
+    """
+    user.postmenu_followups_blocked = True
+    SCHEDULER.cancel_user(user_id, "postmenu")
+
+
+class LatencyStats:
+    """
+    Останні size вимірів тривалості (секунди) у кільцевому буфері —
+    щоб бачити p50 / p99, не тримаючи всю історію.
+    """
+
+    def __init__(self, size: int = 4096) -> None:
+        self.size = size
+        self._samples: list[float] = []
+        self._next = 0
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        if len(self._samples) < self.size:
+            self._samples.append(seconds)
+        else:
+            self._samples[self._next] = seconds
+            self._next = (self._next + 1) % self.size
+
+    def percentile(self, q: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def summary_ms(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "p50": round(self.percentile(0.5) * 1000, 2),
+            "p99": round(self.percentile(0.99) * 1000, 2),
+            "max": round(max(self._samples, default=0.0) * 1000, 2),
+        }
+
+
+# ================== ВИХІДНА ЧЕРГА (OUTBOX) ==================
+# Усе, що бот шле «від себе» (нагадування, розсилки, пересилання через міст,
+# відгуки), спершу записується в OUTBOX_DB_FILE, а доставляють фонові воркери.
+# Хендлер не чекає Telegram, а після рестарту недоставлене дошлеться.
+#
+# Telegram дозволяє боту ~30 повідомлень/с загалом і ~1/с в один чат.
+OUTBOX_DB_FILE = os.getenv("OUTBOX_DB_FILE", "party_runtime.sqlite3")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_KEEP_SENT_DAYS = float(os.getenv("OUTBOX_KEEP_SENT_DAYS", "7"))
+# як часто стани повідомлень (sending / sent / failed) пишуться в базу, секунди
+OUTBOX_STATE_FLUSH_EVERY = float(os.getenv("OUTBOX_STATE_FLUSH_EVERY", "0.5"))
+TG_RATE_LIMIT = float(os.getenv("TG_RATE_LIMIT", "30"))
+TG_PER_CHAT_INTERVAL = float(os.getenv("TG_PER_CHAT_INTERVAL", "1"))
+BROADCAST_PROGRESS_EVERY = 2.0
+# copyMessages приймає до 100 id за виклик
+COPY_MESSAGES_BATCH = 100
+
+
+class RateLimiter:
+    """
+    Глобальний token bucket: rate токенів/с, не більше burst про запас.
+    pause() зупиняє видачу токенів на час, який назвав Telegram у RetryAfter.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class ChatLimiter:
+    """
+    Не частіше одного повідомлення на interval секунд в один чат.
+
+    urgent — відповідь на дію гостя: її паузи вже задав хендлер
+    (PacedReply), тож вона не чекає слоту, а лише займає його, щоб
+    масові повідомлення в цей чат відступили.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.next_at: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int, urgent: bool = False) -> None:
+        now = time.monotonic()
+        booked = self.next_at.get(chat_id, 0.0)
+        slot = now if urgent else max(now, booked)
+        self.next_at[chat_id] = max(booked, slot + self.interval)
+        if len(self.next_at) > 10_000:
+            # чати, чий слот уже минув, більше не потрібні
+            self.next_at = {cid: t for cid, t in self.next_at.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+TG_RATE_LIMITER = RateLimiter(TG_RATE_LIMIT)
+TG_CHAT_LIMITER = ChatLimiter(TG_PER_CHAT_INTERVAL)
+
+
+def _markup_to_dict(markup: Any) -> Optional[Dict[str, Any]]:
+    if markup is None:
+        return None
+    return markup.model_dump(exclude_none=True)
+
+
+def _markup_from_dict(raw: Optional[Dict[str, Any]]) -> Any:
+    if not raw:
+        return None
+    if "inline_keyboard" in raw:
+        return InlineKeyboardMarkup.model_validate(raw)
+    return ReplyKeyboardMarkup.model_validate(raw)
+
+
+# смуги OUTBOX: відповіді гостям ідуть раніше за масові розсилки
+LANE_INTERACTIVE = 0
+LANE_BULK = 1
+
+
+class OutboxItem:
+    __slots__ = ("id", "chat_id", "method", "params", "bridge", "attempts", "next_at", "lane")
+
+    def __init__(
+        self,
+        id: int,
+        chat_id: int,
+        method: str,
+        params: Dict[str, Any],
+        bridge: Optional[Dict[str, Any]],
+        attempts: int,
+        next_at: float,
+        batch: Optional[str] = None,
+    ) -> None:
+        self.id = id
+        self.chat_id = chat_id
+        self.method = method
+        self.params = params
+        self.bridge = bridge
+        self.attempts = attempts
+        self.next_at = next_at
+        # розсилки (batch) — масова смуга, решта — відповіді на дії гостей
+        self.lane = LANE_BULK if batch else LANE_INTERACTIVE
+
+    @property
+    def chat_key(self) -> tuple[int, int]:
+        return (self.lane, self.chat_id)
+
+    def __lt__(self, other: "OutboxItem") -> bool:
+        return (self.next_at, self.id) < (other.next_at, other.id)
+
+
+class Outbox:
+    """
+    Надійна черга вихідних повідомлень у SQLite.
+
+    Стан кожного повідомлення: pending → sending → sent | failed.
+    У памʼяті — heap за часом доставки; диспетчер віддає воркерам те,
+    що вже «дозріло», але не більше одного повідомлення на чат одночасно,
+    щоб порядок у кожному чаті зберігався. Повідомлення, що чекає на повтор
+    після збою, теж тримає свій чат: наступні не підуть раніше за нього.
+
+    Смуг дві: відповіді на дії гостей (LANE_INTERACTIVE) воркери беруть
+    раніше за розсилки (LANE_BULK, усе з batch), тож /start не стоїть за
+    тисячами оголошень. Порядок тримається всередині смуги: відповідь
+    гостю не чекає, поки до нього дійде його ж повідомлення розсилки.
+
+    bridge — якщо задано, після доставки на надіслане повідомлення
+    реєструється міст для reply (див. register_bridge_message).
+
+    Зміни стану не пишуться в базу на кожному кроці: воркер лише
+    запамʼятовує останній стан повідомлення, а раз на
+    OUTBOX_STATE_FLUSH_EVERY вони йдуть однією транзакцією у фоновому
+    потоці (окреме зʼєднання). Лічильники в базі відстають на цей інтервал;
+    після падіння те, що не встигло стати 'sent', просто дошлеться ще раз.
+    """
+
+    METHODS = ("send_message", "copy_message", "copy_messages", "send_animation")
+
+    SQL_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS outbox ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " chat_id INTEGER NOT NULL,"
+        " method TEXT NOT NULL,"
+        " params TEXT NOT NULL,"
+        " bridge TEXT,"
+        " batch TEXT,"
+        " state TEXT NOT NULL DEFAULT 'pending',"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " next_at REAL NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " result_message_id INTEGER,"
+        " last_error TEXT)",
+        "CREATE INDEX IF NOT EXISTS outbox_state ON outbox(state, next_at)",
+        "CREATE INDEX IF NOT EXISTS outbox_batch ON outbox(batch, state)",
+    )
+    SQL_INSERT = (
+        "INSERT INTO outbox (chat_id, method, params, bridge, batch, next_at, created_at, updated_at)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    SQL_SET_STATE = (
+        "UPDATE outbox SET state = ?, attempts = ?, next_at = ?, updated_at = ?,"
+        " result_message_id = ?, last_error = ? WHERE id = ?"
+    )
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        # зʼєднання для фонового запису станів, живе в потоці executor'а
+        self._state_db: Optional[sqlite3.Connection] = None
+        # id → рядок для SQL_SET_STATE; лишається лише останній стан
+        self._states: Dict[int, tuple] = {}
+        self._states_lock = asyncio.Lock()
+        self._heap: list[OutboxItem] = []
+        # ключі — (смуга, chat_id), див. OutboxItem.chat_key
+        self._busy_chats: set[tuple[int, int]] = set()
+        self._waiting: Dict[tuple[int, int], list[OutboxItem]] = {}
+        # id повідомлень на повторі, що досі тримають свій чат у _busy_chats
+        self._holding: set[int] = set()
+        # (смуга, id, item): спершу відповіді гостям, далі за порядком черги
+        self._ready: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self.delivered = 0
+        self.failed = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = open_store_db(self.path, self.SQL_SCHEMA)
+        return self._db
+
+    # ---------- постановка в чергу ----------
+    def enqueue(
+        self,
+        chat_id: int,
+        method: str,
+        *,
+        bridge: Optional[Dict[str, Any]] = None,
+        batch: Optional[str] = None,
+        delay: float = 0.0,
+        **params: Any,
+    ) -> int:
+        return self.enqueue_many(
+            [(chat_id, method, params)], bridge=bridge, batch=batch, delay=delay
+        )[0]
+
+    def enqueue_many(
+        self,
+        items: list[tuple[int, str, Dict[str, Any]]],
+        *,
+        bridge: Optional[Dict[str, Any]] = None,
+        batch: Optional[str] = None,
+        delay: float = 0.0,
+    ) -> list[int]:
+        """
+        Одна транзакція на весь список — так 10k повідомлень розсилки
+        ставляться в чергу за мілісекунди.
+        """
+        now = time.time()
+        next_at = now + delay
+        bridge_json = json.dumps(bridge, ensure_ascii=False) if bridge else None
+        ids: list[int] = []
+        with self.db:
+            for chat_id, method, params in items:
+                if method not in self.METHODS:
+                    raise ValueError(f"Невідомий метод outbox: {method}")
+                params = dict(params)
+                if "reply_markup" in params:
+                    params["reply_markup"] = _markup_to_dict(params["reply_markup"])
+                cur = self.db.execute(
+                    self.SQL_INSERT,
+                    (
+                        chat_id, method, json.dumps(params, ensure_ascii=False),
+                        bridge_json, batch, next_at, now, now,
+                    ),
+                )
+                ids.append(cur.lastrowid)
+                heapq.heappush(
+                    self._heap,
+                    OutboxItem(cur.lastrowid, chat_id, method, params, bridge, 0, next_at, batch),
+                )
+        self._wakeup.set()
+        return ids
+
+    # ---------- стан ----------
+    def _set_state(
+        self,
+        item: OutboxItem,
+        state: str,
+        result_message_id: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        self._states[item.id] = (
+            state, item.attempts, item.next_at, time.time(),
+            result_message_id, error, item.id,
+        )
+
+    def _write_states(self, rows: list[tuple]) -> None:
+        if self._state_db is None:
+            self._state_db = open_store_db(self.path, check_same_thread=False)
+        with self._state_db:
+            self._state_db.executemany(self.SQL_SET_STATE, rows)
+
+    async def _flush_states_locked(self) -> None:
+        if not self._states:
+            return
+        rows = list(self._states.values())
+        self._states = {}
+        await asyncio.to_thread(self._write_states, rows)
+
+    async def flush_states(self) -> None:
+        """Записує накопичені зміни стану повідомлень у базу."""
+        async with self._states_lock:
+            await self._flush_states_locked()
+
+    async def _state_writer(self) -> None:
+        while True:
+            await asyncio.sleep(OUTBOX_STATE_FLUSH_EVERY)
+            try:
+                await self.flush_states()
+            except Exception as e:
+                logger.exception("Outbox: не зміг записати стани повідомлень: %s", e)
+
+    def depth(self) -> int:
+        return len(self._heap) + self._ready.qsize() + sum(map(len, self._waiting.values()))
+
+    def batch_counts(self, batch: str) -> Dict[str, int]:
+        rows = self.db.execute(
+            "SELECT state, COUNT(*) FROM outbox WHERE batch = ? GROUP BY state", (batch,)
+        )
+        return dict(rows.fetchall())
+
+    def state_counts(self) -> Dict[str, int]:
+        rows = self.db.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state")
+        return dict(rows.fetchall())
+
+    def failed_items(self, limit: int = 20) -> list[tuple]:
+        """
+        Останні недоставлені: (id, chat_id, method, attempts, updated_at, last_error).
+        """
+        return self.db.execute(
+            "SELECT id, chat_id, method, attempts, updated_at, last_error FROM outbox"
+            " WHERE state = 'failed' ORDER BY id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    async def retry_failed(self) -> int:
+        async with self._states_lock:
+            # щойно провалені ще можуть чекати запису в базу
+            await self._flush_states_locked()
+            rows = self.db.execute(
+                "SELECT id, chat_id, method, params, bridge, batch FROM outbox WHERE state = 'failed'"
+            ).fetchall()
+            now = time.time()
+            with self.db:
+                self.db.execute(
+                    "UPDATE outbox SET state = 'pending', attempts = 0, next_at = ?, updated_at = ?"
+                    " WHERE state = 'failed'",
+                    (now, now),
+                )
+        for id_, chat_id, method, params, bridge, batch in rows:
+            heapq.heappush(
+                self._heap,
+                OutboxItem(
+                    id_, chat_id, method, json.loads(params),
+                    json.loads(bridge) if bridge else None, 0, now, batch,
+                ),
+            )
+        self._wakeup.set()
+        return len(rows)
+
+    def _restore(self) -> None:
+        """
+        Після рестарту: все, що не встигло піти, — знову в heap.
+        'sending' означає, що впали посеред відправки, тож шлемо ще раз.
+        """
+        rows = self.db.execute(
+            "SELECT id, chat_id, method, params, bridge, attempts, next_at, batch FROM outbox"
+            " WHERE state IN ('pending', 'sending') ORDER BY id"
+        ).fetchall()
+        for id_, chat_id, method, params, bridge, attempts, next_at, batch in rows:
+            heapq.heappush(
+                self._heap,
+                OutboxItem(
+                    id_, chat_id, method, json.loads(params),
+                    json.loads(bridge) if bridge else None, attempts, next_at, batch,
+                ),
+            )
+        if rows:
+            logger.info("Outbox: відновлено %d недоставлених повідомлень", len(rows))
+
+    def _prune(self) -> None:
+        cutoff = time.time() - OUTBOX_KEEP_SENT_DAYS * 86400
+        with self.db:
+            self.db.execute(
+                "DELETE FROM outbox WHERE state = 'sent' AND updated_at < ?", (cutoff,)
+            )
+
+    # ---------- доставка ----------
+    def _make_ready(self, item: OutboxItem) -> None:
+        self._ready.put_nowait((item.lane, item.id, item))
+
+    def _release_chat(self, key: tuple[int, int]) -> None:
+        waiting = self._waiting.get(key)
+        if waiting:
+            self._make_ready(waiting.pop(0))
+            if not waiting:
+                del self._waiting[key]
+        else:
+            self._busy_chats.discard(key)
+
+    async def _dispatch(self) -> None:
+        last_prune = 0.0
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0].next_at <= now:
+                item = heapq.heappop(self._heap)
+                if item.id in self._holding:
+                    self._holding.discard(item.id)
+                    self._make_ready(item)
+                elif item.chat_key in self._busy_chats:
+                    self._waiting.setdefault(item.chat_key, []).append(item)
+                else:
+                    self._busy_chats.add(item.chat_key)
+                    self._make_ready(item)
+            if now - last_prune > 3600:
+                self._prune()
+                last_prune = now
+            timeout = self._heap[0].next_at - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _call(self, bot: Bot, item: OutboxItem) -> Optional[int]:
+        p = item.params
+        if item.method == "send_message":
+            sent = await bot.send_message(
+                item.chat_id, p["text"], reply_markup=_markup_from_dict(p.get("reply_markup"))
+            )
+            return sent.message_id
+        if item.method == "copy_message":
+            sent = await bot.copy_message(item.chat_id, p["from_chat_id"], p["message_id"])
+            return sent.message_id
+        if item.method == "copy_messages":
+            copied = await bot.copy_messages(item.chat_id, p["from_chat_id"], p["message_ids"])
+            return copied[0].message_id if copied else None
+        sent = await MEDIA.send_animation(
+            bot, item.chat_id, p["animation"], caption=p.get("caption"),
+            reply_markup=_markup_from_dict(p.get("reply_markup")),
+        )
+        return sent.message_id
+
+    async def _deliver(self, bot: Bot, item: OutboxItem) -> bool:
+        """
+        Одна спроба доставки; невдала — на повтор або в failed.
+        True — повідомлення пішло на повтор і далі тримає свій чат,
+        щоб наступні в цьому чаті його не обігнали.
+        """
+        item.attempts += 1
+        self._set_state(item, "sending")
+        await TG_CHAT_LIMITER.wait(item.chat_id, urgent=item.lane == LANE_INTERACTIVE)
+        await TG_RATE_LIMITER.acquire()
+        try:
+            message_id = await self._call(bot, item)
+        except TelegramRetryAfter as e:
+            TG_RATE_LIMITER.pause(e.retry_after)
+            return self._retry(item, e.retry_after, str(e))
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # бота заблокували / битий file_id — повторювати немає сенсу
+            self._fail(item, str(e))
+        except Exception as e:
+            return self._retry(item, 2 ** item.attempts, str(e))
+        else:
+            self._delivered(item, message_id)
+        return False
+
+    def _delivered(self, item: OutboxItem, message_id: Optional[int]) -> None:
+        self.delivered += 1
+        self._set_state(item, "sent", result_message_id=message_id)
+        if item.bridge and message_id:
+            try:
+                register_bridge_message(
+                    chat_id=item.chat_id, message_id=message_id, **item.bridge
+                )
+            except Exception as e:
+                # повідомлення вже доставлене — без мосту, але черга йде далі
+                logger.exception("Outbox: не зареєстрував міст для #%d: %s", item.id, e)
+
+    async def _worker(self, bot: Bot) -> None:
+        while True:
+            _, _, item = await self._ready.get()
+            held = False
+            try:
+                held = await self._deliver(bot, item)
+            except Exception as e:
+                # у базі лишилось pending / sending — після рестарту дошлеться
+                logger.exception("Outbox: збій воркера на #%d: %s", item.id, e)
+            finally:
+                if not held:
+                    self._release_chat(item.chat_key)
+
+    def _retry(self, item: OutboxItem, delay: float, error: str) -> bool:
+        if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+            self._fail(item, error)
+            return False
+        item.next_at = time.time() + delay
+        self._set_state(item, "pending", error=error)
+        # чат лишається зайнятим: коли настане next_at, _dispatch віддасть
+        # повідомлення воркеру в обхід черги _waiting цього чату
+        self._holding.add(item.id)
+        heapq.heappush(self._heap, item)
+        self._wakeup.set()
+        return True
+
+    def _fail(self, item: OutboxItem, error: str) -> None:
+        self.failed += 1
+        logger.warning(
+            "Outbox: не доставив #%d (%s → %s): %s", item.id, item.method, item.chat_id, error
+        )
+        self._set_state(item, "failed", error=error)
+
+    def start(self, bot: Bot) -> None:
+        self._restore()
+        self._tasks = [
+            asyncio.create_task(self._dispatch()),
+            asyncio.create_task(self._state_writer()),
+        ]
+        self._tasks += [
+            asyncio.create_task(self._worker(bot)) for _ in range(OUTBOX_WORKERS)
+        ]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush_states()
+        if self._state_db is not None:
+            self._state_db.close()
+            self._state_db = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+OUTBOX = Outbox(OUTBOX_DB_FILE)
+
+
+def relay_message(
+    message: Message,
+    peer_id: int,
+    prefix: str,
+    bridge: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    Ставить в OUTBOX пересилання повідомлення до peer_id: текст / підпис
+    з префіксом і копію медіа (фото, відео і т.д.).
+    Міст bridge чіпляємо до тексту, а якщо його немає — до медіа.
+    Повертає False, якщо пересилати нічого.
+    """
+    text_part = message.text or message.caption or ""
+    has_media = bool(message.photo or message.document or message.video or message.animation)
+    if text_part:
+        OUTBOX.enqueue(peer_id, "send_message", bridge=bridge, text=f"{prefix}{text_part}")
+    if has_media:
+        OUTBOX.enqueue(
+            peer_id,
+            "copy_message",
+            bridge=None if text_part else bridge,
+            from_chat_id=message.chat.id,
+            message_id=message.message_id,
+        )
+    return bool(text_part or has_media)
+
+
+def copy_messages_items(
+    chat_id: int, messages: list[tuple[int, int]]
+) -> list[tuple[int, str, Dict[str, Any]]]:
+    """
+    Елементи для OUTBOX.enqueue_many: копії messages [(from_chat_id, message_id)]
+    у chat_id пачками copy_messages до COPY_MESSAGES_BATCH id.
+    Сусідні повідомлення з одного чату йдуть однією пачкою за зростанням id
+    (так вимагає Telegram), а альбоми, які гість надіслав альбомом,
+    copyMessages і доставляє альбомом.
+    """
+    items: list[tuple[int, str, Dict[str, Any]]] = []
+    runs: list[tuple[int, list[int]]] = []
+    for from_chat_id, message_id in messages:
+        if runs and runs[-1][0] == from_chat_id:
+            runs[-1][1].append(message_id)
+        else:
+            runs.append((from_chat_id, [message_id]))
+    for from_chat_id, ids in runs:
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), COPY_MESSAGES_BATCH):
+            items.append((
+                chat_id,
+                "copy_messages",
+                {"from_chat_id": from_chat_id, "message_ids": ids[start:start + COPY_MESSAGES_BATCH]},
+            ))
+    return items
+
+
+class PacedReply:
+    """
+    Кілька повідомлень в один чат з «театральними» паузами між ними —
+    без asyncio.sleep у хендлері: усе йде в OUTBOX із затримками,
+    а хендлер повертається одразу.
+
+        PacedReply(chat_id).gif(START_GIF_ID).pause(1).text("…", reply_markup=kb).send()
+
+    Порядок у чаті тримає OUTBOX (по одному повідомленню на чат, за часом
+    і номером у черзі), а смуга відповідей обганяє розсилки. Тому хендлер,
+    що вже шле через PacedReply, шле через нього і решту відповіді —
+    прямий message.answer обігнав би повідомлення, що ще в черзі.
+    """
+
+    def __init__(self, chat_id: int) -> None:
+        self.chat_id = chat_id
+        self._at = 0.0
+        self._items: list[tuple[float, str, Dict[str, Any]]] = []
+
+    def pause(self, seconds: float) -> "PacedReply":
+        self._at += seconds
+        return self
+
+    def gif(self, gif_id: Optional[str]) -> "PacedReply":
+        if gif_id:
+            self._items.append((self._at, "send_animation", {"animation": gif_id}))
+        return self
+
+    def text(self, text: str, reply_markup: Any = None) -> "PacedReply":
+        params: Dict[str, Any] = {"text": text}
+        if reply_markup is not None:
+            params["reply_markup"] = reply_markup
+        self._items.append((self._at, "send_message", params))
+        return self
+
+    def send(self) -> list[int]:
+        return [
+            OUTBOX.enqueue(self.chat_id, method, delay=delay, **params)
+            for delay, method, params in self._items
+        ]
+
+
+# ================== МЕДІА (GIF) ==================
+# GIF-и шлемо за file_id. Якщо Telegram каже, що id уже недійсний, —
+# вантажимо локальну копію з MEDIA_DIR, а новий file_id запамʼятовуємо
+# в OUTBOX_DB_FILE (таблиця media), щоб далі знову слати за id.
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_CAPTION_LIMIT = 1024
+GIF_FILES: Dict[str, str] = {
+    START_GIF_ID: "start.mp4",
+    REMINDER_GIF_ID: "reminder.mp4",
+    FEEDBACK_GIF_ID: "feedback.mp4",
+    MENU_DONE_GIF_ID: "menu_done.mp4",
+    ORG_CHAT_GIF_ID: "org_chat.mp4",
+    SANTA_GIF_ID: "santa.mp4",
+    TASKS_GIF_ID: "tasks.mp4",
+}
+
+
+class MediaRegistry:
+    """
+    Реєстр «file_id з коду → чинний file_id» з резервом у локальних файлах.
+
+    validated[gif_id] — коли цей GIF востаннє успішно пішов (time.time()).
+    latency — тривалість кожного виклику send_animation, разом із
+    резервним завантаженням, якщо воно знадобилось.
+    """
+
+    SQL_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS media ("
+        " gif_id TEXT PRIMARY KEY,"
+        " file_id TEXT NOT NULL,"
+        " updated_at REAL NOT NULL)",
+    )
+
+    def __init__(self, path: str, files: Dict[str, str]) -> None:
+        self.path = path
+        self.files = files
+        self._db: Optional[sqlite3.Connection] = None
+        self._file_ids: Optional[Dict[str, str]] = None
+        self.validated: Dict[str, float] = {}
+        self.latency = LatencyStats()
+        self.sent = 0
+        self.fallbacks = 0
+        self.failed = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = open_store_db(self.path, self.SQL_SCHEMA)
+        return self._db
+
+    def file_id(self, gif_id: str) -> str:
+        if self._file_ids is None:
+            self._file_ids = dict(self.db.execute("SELECT gif_id, file_id FROM media"))
+        return self._file_ids.get(gif_id, gif_id)
+
+    def _remember(self, gif_id: str, file_id: str) -> None:
+        self.file_id(gif_id)
+        self._file_ids[gif_id] = file_id
+        with self.db:
+            self.db.execute(
+                "INSERT INTO media (gif_id, file_id, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(gif_id) DO UPDATE SET"
+                " file_id = excluded.file_id, updated_at = excluded.updated_at",
+                (gif_id, file_id, time.time()),
+            )
+
+    def local_file(self, gif_id: str) -> Optional[str]:
+        name = self.files.get(gif_id)
+        if not name:
+            return None
+        path = os.path.join(MEDIA_DIR, name)
+        return path if os.path.exists(path) else None
+
+    async def send_animation(self, bot: Bot, chat_id: int, gif_id: str, **kwargs: Any) -> Message:
+        started = time.perf_counter()
+        try:
+            try:
+                sent = await bot.send_animation(chat_id, self.file_id(gif_id), **kwargs)
+            except TelegramBadRequest as e:
+                path = self.local_file(gif_id)
+                if path is None:
+                    raise
+                logger.warning("GIF %s… недійсний (%s), вантажу %s", gif_id[:16], e, path)
+                self.fallbacks += 1
+                # завантаження — це секунди, хай гість бачить, що щось іде
+                await bot.send_chat_action(chat_id, ChatAction.UPLOAD_VIDEO)
+                sent = await bot.send_animation(chat_id, FSInputFile(path), **kwargs)
+                media = sent.animation or sent.document
+                if media is not None:
+                    self._remember(gif_id, media.file_id)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.latency.add(time.perf_counter() - started)
+        self.sent += 1
+        self.validated[gif_id] = time.time()
+        return sent
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "fallbacks": self.fallbacks,
+            "failed": self.failed,
+            "ms": self.latency.summary_ms(),
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+MEDIA = MediaRegistry(OUTBOX_DB_FILE, GIF_FILES)
+
+
+# ================== ПЛАНУВАЛЬНИК ==================
+# Відкладені кроки (due_at, user_id, kind, step) лежать у таблиці jobs того ж
+# OUTBOX_DB_FILE і в heap у памʼяті. Один цикл забирає все, що «дозріло»,
+# пачками — замість тисяч приспаних asyncio-задач, які губились при рестарті.
+SCHEDULER_BATCH = int(os.getenv("SCHEDULER_BATCH", "500"))
+
+
+class Scheduler:
+    """
+    Персистентний планувальник на heap.
+
+    kind — імʼя обробника (див. handler), step — номер кроку в ланцюжку.
+    Обробник викликається як handler(user_id, step) і сам планує наступний
+    крок, якщо він потрібен. Скасування (cancel_user) видаляє рядки з бази
+    одразу, а з heap — ліниво: запис без живого job просто пропускається.
+    """
+
+    SQL_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " due_at REAL NOT NULL,"
+        " user_id INTEGER NOT NULL,"
+        " kind TEXT NOT NULL,"
+        " step INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS jobs_user ON jobs(user_id, kind)",
+    )
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._heap: list[tuple[float, int]] = []
+        # job id → (user_id, kind, step)
+        self._jobs: Dict[int, tuple[int, str, int]] = {}
+        # user_id → {job id: kind}; для швидкого cancel_user без запиту в базу
+        self._by_user: Dict[int, Dict[int, str]] = {}
+        self._handlers: Dict[str, Callable[[int, int], None]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.fired = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = open_store_db(self.path, self.SQL_SCHEMA)
+        return self._db
+
+    def handler(self, kind: str):
+        def decorator(func: Callable[[int, int], None]) -> Callable[[int, int], None]:
+            self._handlers[kind] = func
+            return func
+
+        return decorator
+
+    def _track(self, id_: int, due_at: float, user_id: int, kind: str, step: int) -> None:
+        self._jobs[id_] = (user_id, kind, step)
+        self._by_user.setdefault(user_id, {})[id_] = kind
+        heapq.heappush(self._heap, (due_at, id_))
+
+    def _forget(self, id_: int) -> Optional[tuple[int, str, int]]:
+        job = self._jobs.pop(id_, None)
+        if job is not None:
+            user_jobs = self._by_user.get(job[0])
+            if user_jobs is not None:
+                user_jobs.pop(id_, None)
+                if not user_jobs:
+                    del self._by_user[job[0]]
+        return job
+
+    def schedule(self, user_id: int, kind: str, step: int = 0, delay: float = 0.0) -> int:
+        if kind not in self._handlers:
+            raise ValueError(f"Невідомий тип задачі планувальника: {kind}")
+        due_at = time.time() + delay
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO jobs (due_at, user_id, kind, step) VALUES (?, ?, ?, ?)",
+                (due_at, user_id, kind, step),
+            )
+        self._track(cur.lastrowid, due_at, user_id, kind, step)
+        self._wakeup.set()
+        return cur.lastrowid
+
+    def cancel_user(self, user_id: int, kind: Optional[str] = None) -> int:
+        """
+        Скасовує всі задачі користувача (або лише задачі типу kind).
+        Якщо задач немає — жодного звернення до бази, тож це можна
+        викликати на кожен клік.
+        """
+        user_jobs = self._by_user.get(user_id)
+        if not user_jobs:
+            return 0
+        ids = [id_ for id_, k in user_jobs.items() if kind is None or k == kind]
+        if not ids:
+            return 0
+        with self.db:
+            self.db.executemany("DELETE FROM jobs WHERE id = ?", [(id_,) for id_ in ids])
+        for id_ in ids:
+            self._forget(id_)
+        return len(ids)
+
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    def _restore(self) -> None:
+        rows = self.db.execute("SELECT id, due_at, user_id, kind, step FROM jobs").fetchall()
+        for id_, due_at, user_id, kind, step in rows:
+            self._track(id_, due_at, user_id, kind, step)
+        if rows:
+            logger.info("Планувальник: відновлено %d відкладених задач", len(rows))
+
+    def _fire(self, due: list[tuple[int, int, str, int]]) -> None:
+        # спершу прибираємо з бази: краще пропустити крок після падіння,
+        # ніж надіслати його двічі
+        with self.db:
+            self.db.executemany("DELETE FROM jobs WHERE id = ?", [(d[0],) for d in due])
+        for id_, user_id, kind, step in due:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                logger.warning("Планувальник: немає обробника для %s (#%s)", kind, id_)
+                continue
+            try:
+                handler(user_id, step)
+            except Exception as e:
+                logger.exception("Планувальник: задача %s #%s для %s впала: %s", kind, id_, user_id, e)
+            self.fired += 1
+
+    async def _run(self) -> None:
+        while True:
+            now = time.time()
+            due: list[tuple[int, int, str, int]] = []
+            while self._heap and self._heap[0][0] <= now and len(due) < SCHEDULER_BATCH:
+                _, id_ = heapq.heappop(self._heap)
+                job = self._forget(id_)
+                if job is not None:  # інакше — скасована
+                    due.append((id_, *job))
+            if due:
+                self._fire(due)
+                await asyncio.sleep(0)
+                continue
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._restore()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+SCHEDULER = Scheduler(OUTBOX_DB_FILE)
+
+# (мін, макс) затримка перед кожним кроком «післяменюшного» ланцюжка, секунди
+POSTMENU_DELAYS = ((3, 5), (60, 300), (30, 30), (30, 30))
+
+
+def start_postmenu_followups(user_id: int) -> None:
+    """
+    Ланцюжок автоматичних повідомлень після того, як користувач заповнив меню.
+    Гаситься в mark_user_active, якщо користувач починає щось тиснути в меню.
+    """
+    SCHEDULER.cancel_user(user_id, "postmenu")
+    SCHEDULER.schedule(user_id, "postmenu", 0, random.uniform(*POSTMENU_DELAYS[0]))
+
+
+@SCHEDULER.handler("postmenu")
+def postmenu_step(user_id: int, step: int) -> None:
+    user = find_user(user_id)
+    if not user or user.postmenu_followups_blocked:
+        return
+
+    if step == 0:
+        # 1. Запросити в канал своєї вечірки (нема каналу — крок пропускаємо)
+        link = party_for(user).channel_link
+        if link:
+            OUTBOX.enqueue(
+                user_id,
+                "send_message",
+                text="Ще один важливий крок! 🎉\n"
+                "Залеті в наш канал — там ми спілкуємось, ділимось фотками та мемами:\n"
+                f"{link}",
+            )
+    elif step == 1:
+        # 2. Через 1–5 хвилин нагадати про меню
+        OUTBOX.enqueue(
+            user_id,
+            "send_message",
+            text="Ось так виглядає твоє меню в боті 👇\n"
+            "Завжди можеш глянути або змінити його через розділ «🍽 Моє меню» "
+            "у «👤 Мій кабінет».",
+        )
+    elif step == 2:
+        # 3. Ще 30 секунд → Таємний Миколайчик
+        OUTBOX.enqueue(
+            user_id,
+            "send_message",
+            text="Також не забувай про гру «Таємний Миколайчик» 🎅\n"
+            "Як тільки все буде готово — отримаєш від мене окреме повідомлення "
+            "для реєстрації в грі.",
+        )
+    elif step == 3:
+        # 4. Ще 30 секунд → GIF + підказка про допомогу
+        OUTBOX.enqueue(
+            user_id,
+            "send_message",
+            text="Ну що, якщо будуть питання — я завжди тут 😉\n"
+            "Натискай «❓ Допомога» в меню, а потім кнопку "
+            "«✉ Звʼязатись з організатором Ніколасом».",
+        )
+        OUTBOX.enqueue(user_id, "send_animation", animation=REMINDER_GIF_ID)
+
+    next_step = step + 1
+    if next_step < len(POSTMENU_DELAYS):
+        SCHEDULER.schedule(user_id, "postmenu", next_step, random.uniform(*POSTMENU_DELAYS[next_step]))
+
+
+# ================== МОСТИ ДЛЯ REPLY ==================
+# Ключ: (chat_id, message_id) → міст
+# value: {"peer_id": int, "prefix_to_peer": str, "reply_prefix_back": str}
+BRIDGE_TTL_DAYS = float(os.getenv("BRIDGE_TTL_DAYS", "14"))
+BRIDGE_MAX_ENTRIES = int(os.getenv("BRIDGE_MAX_ENTRIES", "20000"))
+
+
+class TtlLruEntries:
+    """
+    Спільне витіснення для сховищ з TTL і лімітом розміру.
+
+    entries — OrderedDict key → (час запису, значення) від найстаріших до
+    найновіших, тож протухлі (старші за ttl) і зайві понад max_entries
+    завжди в голові і прибираються за амортизовано O(1). Нащадок задає
+    entries, ttl, max_entries і лічильники expired / evicted.
+    """
+
+    entries: "OrderedDict[Any, tuple[float, Any]]"
+    ttl: float
+    max_entries: int
+    expired: int
+    evicted: int
+
+    def _evict(self, now: float) -> list:
+        """Прибирає протухлі й зайві записи з голови; повертає їхні ключі."""
+        entries = self.entries
+        gone: list = []
+        cutoff = now - self.ttl
+        while entries:
+            key, (written_at, _) = next(iter(entries.items()))
+            if written_at < cutoff:
+                self.expired += 1
+            elif len(entries) > self.max_entries:
+                self.evicted += 1
+            else:
+                break
+            del entries[key]
+            gone.append(key)
+        return gone
+
+
+class BridgeStore(TtlLruEntries):
+    """
+    Обмежене сховище мостів, що переживає рестарт (таблиця bridges
+    в OUTBOX_DB_FILE).
+
+    Мости одноразові: використаний міст видаляється (pop), тому в памʼяті
+    вони лежать у порядку створення, і найстаріші водночас є найдавніше
+    невикористаними. Протухлі (старші за ttl) та зайві понад max_entries
+    витісняються з голови черги при кожному put — амортизовано O(1).
+
+    hits / misses рахуються в pop, тобто на кожен reply у reply_bridge.
+    """
+
+    SQL_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS bridges ("
+        " chat_id INTEGER NOT NULL,"
+        " message_id INTEGER NOT NULL,"
+        " meta TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " PRIMARY KEY (chat_id, message_id)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS bridges_created ON bridges(created_at)",
+    )
+
+    def __init__(self, path: str, ttl: float, max_entries: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db: Optional[sqlite3.Connection] = None
+        # key → (created_at, meta); порядок = порядок створення
+        self._entries: Optional["OrderedDict[tuple[int, int], tuple[float, Dict[str, Any]]]"] = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = open_store_db(self.path, self.SQL_SCHEMA)
+        return self._db
+
+    @property
+    def entries(self) -> "OrderedDict[tuple[int, int], tuple[float, Dict[str, Any]]]":
+        if self._entries is None:
+            self._entries = OrderedDict()
+            cutoff = time.time() - self.ttl
+            with self.db:
+                self.db.execute("DELETE FROM bridges WHERE created_at < ?", (cutoff,))
+            rows = self.db.execute(
+                "SELECT chat_id, message_id, meta, created_at FROM bridges ORDER BY created_at"
+            )
+            for chat_id, message_id, meta, created_at in rows:
+                self._entries[(chat_id, message_id)] = (created_at, json.loads(meta))
+            if self._entries:
+                logger.info("Мости: відновлено %d відкритих діалогів", len(self._entries))
+        return self._entries
+
+    def put(self, key: tuple[int, int], meta: Dict[str, Any]) -> None:
+        now = time.time()
+        entries = self.entries
+        entries.pop(key, None)
+        entries[key] = (now, meta)
+        gone = self._evict(now)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO bridges (chat_id, message_id, meta, created_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key[0], key[1], json.dumps(meta, ensure_ascii=False), now),
+            )
+            if gone:
+                self.db.executemany(
+                    "DELETE FROM bridges WHERE chat_id = ? AND message_id = ?", gone
+                )
+
+    def pop(self, key: tuple[int, int], default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        item = self.entries.pop(key, None)
+        if item is not None:
+            # і використаний, і протухлий міст більше не потрібен у базі
+            with self.db:
+                self.db.execute(
+                    "DELETE FROM bridges WHERE chat_id = ? AND message_id = ?", key
+                )
+            if item[0] < time.time() - self.ttl:
+                self.expired += 1
+                item = None
+        if item is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return item[1]
+
+    def __contains__(self, key: tuple[int, int]) -> bool:
+        item = self.entries.get(key)
+        return item is not None and item[0] >= time.time() - self.ttl
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+BRIDGE_REPLIES = BridgeStore(OUTBOX_DB_FILE, BRIDGE_TTL_DAYS * 86400, BRIDGE_MAX_ENTRIES)
+
+
+# ================== СТАНИ ДІАЛОГІВ (FSM) ==================
+# PENDING_ACTION (user_id → стан) і PENDING_CONTEXT (user_id → dict з даними
+# сценарію) — сховища з TTL і лімітами. Бекенд: PENDING_BACKEND=sqlite
+# (за замовчуванням, таблиця pending в OUTBOX_DB_FILE — гість, що застряг
+# між set_dish і set_dessert, після рестарту продовжить з того ж місця)
+# або memory. Ті самі дані бачить FSM aiogram через PendingFSMStorage.
+PENDING_BACKEND = os.getenv("PENDING_BACKEND", "sqlite").lower()
+PENDING_TTL_HOURS = float(os.getenv("PENDING_TTL_HOURS", "24"))
+PENDING_MAX_USERS = int(os.getenv("PENDING_MAX_USERS", "10000"))
+# ліміт на розмір одного контексту (JSON), щоб покинутий сценарій не ріс безмежно
+PENDING_MAX_CONTEXT_BYTES = int(os.getenv("PENDING_MAX_CONTEXT_BYTES", "16384"))
+FEEDBACK_MAX_MESSAGES = int(os.getenv("FEEDBACK_MAX_MESSAGES", "50"))
+
+
+class MemoryPendingStore(TtlLruEntries):
+    """
+    user_id → значення з TTL від останнього запису.
+
+    Записи лежать в OrderedDict у порядку оновлення, тож протухлі та зайві
+    понад max_users завжди в голові і прибираються при кожному записі.
+    Значення, чий JSON довший за max_bytes, не зберігається (set → False).
+    Інтерфейс — як у dict: get / pop / [] / in.
+    """
+
+    def __init__(self, kind: str, ttl: float, max_users: int, max_bytes: int) -> None:
+        self.kind = kind
+        self.ttl = ttl
+        self.max_entries = max_users
+        self.max_bytes = max_bytes
+        self._entries: Optional["OrderedDict[int, tuple[float, Any]]"] = None
+        self.expired = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    # ---------- гачки для персистентних бекендів ----------
+    def _load(self) -> "OrderedDict[int, tuple[float, Any]]":
+        return OrderedDict()
+
+    def _persist_set(self, user_id: int, value_json: str, now: float, gone: list[int]) -> None:
+        pass
+
+    def _persist_delete(self, user_ids: list[int]) -> None:
+        pass
+
+    # ---------- dict-подібний інтерфейс ----------
+    @property
+    def entries(self) -> "OrderedDict[int, tuple[float, Any]]":
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def set(self, user_id: int, value: Any) -> bool:
+        value_json = json.dumps(value, ensure_ascii=False)
+        if len(value_json.encode()) > self.max_bytes:
+            self.rejected += 1
+            logger.warning(
+                "Стан %s для %s завеликий (%d байт), не зберігаю", self.kind, user_id, len(value_json)
+            )
+            return False
+        now = time.time()
+        entries = self.entries
+        entries.pop(user_id, None)
+        entries[user_id] = (now, value)
+        self._persist_set(user_id, value_json, now, self._evict(now))
+        return True
+
+    def __setitem__(self, user_id: int, value: Any) -> None:
+        self.set(user_id, value)
+
+    def get(self, user_id: int, default: Any = None) -> Any:
+        item = self.entries.get(user_id)
+        if item is None:
+            return default
+        if item[0] < time.time() - self.ttl:
+            self.pop(user_id)
+            self.expired += 1
+            return default
+        return item[1]
+
+    def __getitem__(self, user_id: int) -> Any:
+        marker = object()
+        value = self.get(user_id, marker)
+        if value is marker:
+            raise KeyError(user_id)
+        return value
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def pop(self, user_id: int, default: Any = None) -> Any:
+        item = self.entries.pop(user_id, None)
+        if item is None:
+            return default
+        self._persist_delete([user_id])
+        if item[0] < time.time() - self.ttl:
+            return default
+        return item[1]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def close(self) -> None:
+        pass
+
+
+class SqlitePendingStore(MemoryPendingStore):
+    """
+    Те саме, що MemoryPendingStore, але кожен запис дублюється в таблицю
+    pending (kind, user_id); при першому зверненні живі записи
+    підтягуються назад у памʼять.
+    """
+
+    SQL_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS pending ("
+        " kind TEXT NOT NULL,"
+        " user_id INTEGER NOT NULL,"
+        " value TEXT NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " PRIMARY KEY (kind, user_id)) WITHOUT ROWID",
+    )
+
+    def __init__(self, path: str, kind: str, ttl: float, max_users: int, max_bytes: int) -> None:
+        super().__init__(kind, ttl, max_users, max_bytes)
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = open_store_db(self.path, self.SQL_SCHEMA)
+        return self._db
+
+    def _load(self) -> "OrderedDict[int, tuple[float, Any]]":
+        entries: "OrderedDict[int, tuple[float, Any]]" = OrderedDict()
+        with self.db:
+            self.db.execute(
+                "DELETE FROM pending WHERE kind = ? AND updated_at < ?",
+                (self.kind, time.time() - self.ttl),
+            )
+        rows = self.db.execute(
+            "SELECT user_id, value, updated_at FROM pending WHERE kind = ? ORDER BY updated_at",
+            (self.kind,),
+        )
+        for user_id, value, updated_at in rows:
+            entries[user_id] = (updated_at, json.loads(value))
+        if entries:
+            logger.info("Стани %s: відновлено %d незавершених сценаріїв", self.kind, len(entries))
+        return entries
+
+    def _persist_set(self, user_id: int, value_json: str, now: float, gone: list[int]) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pending (kind, user_id, value, updated_at) VALUES (?, ?, ?, ?)",
+                (self.kind, user_id, value_json, now),
+            )
+            if gone:
+                self.db.executemany(
+                    "DELETE FROM pending WHERE kind = ? AND user_id = ?",
+                    [(self.kind, uid) for uid in gone],
+                )
+
+    def _persist_delete(self, user_ids: list[int]) -> None:
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM pending WHERE kind = ? AND user_id = ?",
+                [(self.kind, uid) for uid in user_ids],
+            )
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def create_pending_store(kind: str) -> MemoryPendingStore:
+    ttl = PENDING_TTL_HOURS * 3600
+    if PENDING_BACKEND == "sqlite":
+        return SqlitePendingStore(
+            OUTBOX_DB_FILE, kind, ttl, PENDING_MAX_USERS, PENDING_MAX_CONTEXT_BYTES
+        )
+    if PENDING_BACKEND != "memory":
+        logger.warning("Невідомий PENDING_BACKEND=%s, використовую memory", PENDING_BACKEND)
+    return MemoryPendingStore(kind, ttl, PENDING_MAX_USERS, PENDING_MAX_CONTEXT_BYTES)
+
+
+PENDING_ACTION = create_pending_store("action")
+PENDING_CONTEXT = create_pending_store("context")
+
+
+class PendingFSMStorage(BaseStorage):
+    """
+    FSM-сховище aiogram поверх PENDING_ACTION / PENDING_CONTEXT:
+    state ↔ стан, data ↔ контекст. Бот працює лише в приватних чатах,
+    тож ключем є user_id.
+    """
+
+    def __init__(self, actions: MemoryPendingStore, contexts: MemoryPendingStore) -> None:
+        self.actions = actions
+        self.contexts = contexts
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            self.actions.pop(key.user_id, None)
+        else:
+            self.actions[key.user_id] = state
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self.actions.get(key.user_id)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if data:
+            self.contexts[key.user_id] = dict(data)
+        else:
+            self.contexts.pop(key.user_id, None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = self.contexts.get(key.user_id)
+        return dict(data) if isinstance(data, dict) else {}
+
+    async def close(self) -> None:
+        self.actions.close()
+        self.contexts.close()
+
+
+# ================== РОЗСИЛКИ ==================
+# посилання на активні розсилки, щоб задачі не зібрав GC
+BROADCAST_TASKS: set[asyncio.Task] = set()
+
+
+class Broadcast:
+    """
+    Одна розсилка: усі повідомлення одним махом ставимо в OUTBOX з міткою
+    batch, а тут лише стежимо за прогресом і показуємо його адміну
+    в progress_msg, який періодично редагується.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        items: list[tuple[int, str]],
+        progress_msg: Message,
+        title: str,
+        done_text: str,
+        done_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> None:
+        self.bot = bot
+        self.items = items
+        self.progress_msg = progress_msg
+        self.title = title
+        self.done_text = done_text
+        self.done_markup = done_markup
+        self.total = len(items)
+        self.batch = f"bc-{int(time.time() * 1000)}-{random.randint(0, 9999)}"
+        self.sent = 0
+        self.failed = 0
+
+    def progress_text(self) -> str:
+        return (
+            f"{self.title}\n"
+            f"Надіслано: {self.sent}/{self.total} | помилок: {self.failed}"
+        )
+
+    def _refresh(self) -> None:
+        counts = OUTBOX.batch_counts(self.batch)
+        self.sent = counts.get("sent", 0)
+        self.failed = counts.get("failed", 0)
+
+    async def _edit_progress(
+        self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None
+    ) -> None:
+        await self.bot.edit_message_text(
+            text,
+            chat_id=self.progress_msg.chat.id,
+            message_id=self.progress_msg.message_id,
+            reply_markup=reply_markup,
+        )
+
+    async def run(self) -> None:
+        OUTBOX.enqueue_many(
+            [(chat_id, "send_message", {"text": text}) for chat_id, text in self.items],
+            batch=self.batch,
+        )
+        last = ""
+        while self.sent + self.failed < self.total:
+            await asyncio.sleep(BROADCAST_PROGRESS_EVERY)
+            self._refresh()
+            text = self.progress_text()
+            if text == last:
+                continue
+            last = text
+            try:
+                await self._edit_progress(text)
+            except Exception as e:
+                logger.warning("Не зміг оновити прогрес розсилки: %s", e)
+
+        logger.info(
+            "Розсилка завершена: %d/%d, помилок %d", self.sent, self.total, self.failed
+        )
+        text = self.done_text.format(sent=self.sent, total=self.total)
+        if self.failed:
+            text += f"\nНе вдалося доставити: {self.failed}"
+        try:
+            await self._edit_progress(text, reply_markup=self.done_markup)
+        except Exception as e:
+            logger.warning("Не зміг показати підсумок розсилки: %s", e)
+
+
+def start_broadcast(broadcast: Broadcast) -> None:
+    """
+    Запускає розсилку у фоні — хендлер адміна одразу звільняється.
+    """
+    task = asyncio.create_task(broadcast.run())
+    BROADCAST_TASKS.add(task)
+    task.add_done_callback(BROADCAST_TASKS.discard)
+
+
+# ================== РЕЄСТРИ ХЕНДЛЕРІВ ==================
+# Кнопки reply-клавіатури і стани PENDING_ACTION — це словники
+# «текст кнопки / стан → хендлер». Замість ланцюжка фільтрів F.text == ...
+# і каскаду if action == ... апдейт знаходить свій хендлер одним пошуком
+# у dict, скільки б кнопок і станів не додавалось.
+MENU_BUTTONS: Dict[str, Callable[[Message], Awaitable[Any]]] = {}
+ACTION_HANDLERS: Dict[str, Callable[[Message, Guest], Awaitable[Any]]] = {}
+
+
+def menu_button(label: str):
+    """
+    Реєструє хендлер для кнопки меню з текстом label.
+    Функція лишається звичайною — її можна викликати й напряму.
+    """
+
+    def decorator(func):
+        if label in MENU_BUTTONS:
+            raise ValueError(f"Кнопка «{label}» вже зареєстрована")
+        MENU_BUTTONS[label] = func
+        return func
+
+    return decorator
+
+
+def pending_action(*actions: str):
+    """
+    Реєструє хендлер повідомлення для станів PENDING_ACTION.
+    Хендлер отримує (message, user) і сам знімає стан, коли треба.
+    """
+
+    def decorator(func):
+        for action in actions:
+            if action in ACTION_HANDLERS:
+                raise ValueError(f"Стан «{action}» вже має хендлер")
+            ACTION_HANDLERS[action] = func
+        return func
+
+    return decorator
+
+
+@router.message(F.text.in_(MENU_BUTTONS))
+async def menu_button_handler(message: Message):
+    await MENU_BUTTONS[message.text](message)
+
+
+# ================== КЛАВІАТУРИ ==================
+KEYBOARD_CACHE_MAX = 4096
+
+
+class KeyboardCache:
+    """
+    Готові ReplyKeyboardMarkup / InlineKeyboardMarkup.
+
+    Pydantic-обʼєкт клавіатури на кожен апдейт — це десятки алокацій і
+    валідація кожної кнопки, хоча варіантів клавіатур лічені одиниці.
+    Тому кожна фабрика описує ключ — ті кілька входів, від яких вона
+    справді залежить (учасник, адмін, чи відкрита реєстрація, стани
+    завдань…), а готова розмітка береться зі словника за (назва, ключ).
+
+    Клавіатури з кешу спільні для всіх гостей — їх не можна змінювати
+    на місці, тільки будувати нові на їхній основі.
+    """
+
+    def __init__(self, max_entries: int = KEYBOARD_CACHE_MAX):
+        self.max_entries = max_entries
+        self._items: Dict[tuple, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, key: tuple, build: Callable[[], Any]) -> Any:
+        full_key = (name, key)
+        kb = self._items.get(full_key)
+        if kb is not None:
+            self.hits += 1
+            return kb
+        self.misses += 1
+        kb = build()
+        if len(self._items) >= self.max_entries:
+            # найстаріший варіант — найімовірніше, вже неактуальний
+            del self._items[next(iter(self._items))]
+        self._items[full_key] = kb
+        return kb
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Скидає клавіатури фабрики name (або всі, якщо name=None)."""
+        if name is None:
+            self._items.clear()
+            return
+        for full_key in [k for k in self._items if k[0] == name]:
+            del self._items[full_key]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+KEYBOARDS = KeyboardCache()
+
+
+def cached_keyboard(key: Callable[..., tuple]):
+    """
+    Кешує фабрику клавіатури за key(*args) — тими ж аргументами, що й
+    у фабрики. Некешована версія лишається доступною як func.build.
+    """
+
+    def decorator(build):
+        name = build.__name__
+
+        @functools.wraps(build)
+        def wrapper(*args):
+            return KEYBOARDS.get(name, key(*args), lambda: build(*args))
+
+        wrapper.build = build
+        return wrapper
+
+    return decorator
+
+
+@cached_keyboard(lambda user: (
+    user.participant,
+    user.participant and party_for(user).is_feedback_time(),
+    user.is_admin,
+))
+def main_menu_kb(user: Guest) -> ReplyKeyboardMarkup:
+    buttons: list[list[KeyboardButton]] = []
+
+    # 1. Учасник / не учасник
+    if user.participant:
+        # перший ряд — кабінет + Миколайчик
+        buttons.append([
+            KeyboardButton(text="👤 Мій кабінет"),
+            KeyboardButton(text="🎅 Мій Миколайчик"),
+        ])
+        # другий ряд — меню + про вечірку
+        buttons.append([
+            KeyboardButton(text="📜 Наше меню"),
+            KeyboardButton(text="ℹ️ Про вечірку"),
+        ])
+    else:
+        # гість не підтвердив участь
+        buttons.append([KeyboardButton(text="ℹ️ Про вечірку")])
+
+    # 2. Канал + чат
+    row = [KeyboardButton(text="📢 Канал вечірки")]
+    row.append(KeyboardButton(text="💬 Чат вечірки"))
+    buttons.append(row)
+
+    # 3. Допомога
+    buttons.append([KeyboardButton(text="❓ Допомога")])
+
+    # 4. Відгук (якщо час)
+    if user.participant and party_for(user).is_feedback_time():
+        buttons.append([KeyboardButton(text="⭐ Відгук про вечірку")])
+
+    # 5. Адмін-панель
+    if user.is_admin:
+        buttons.append([KeyboardButton(text="🛠 Адмін-панель")])
+
+    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+
+
+@cached_keyboard(lambda: ())
+def cabinet_menu_kb() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [
+                KeyboardButton(text="🎨 Мій образ"),
+                KeyboardButton(text="📋 Мої завдання"),
+            ],
+            [KeyboardButton(text="🍽 Моє меню")],
+            [KeyboardButton(text="🔙 Назад")],
+        ],
+        resize_keyboard=True,
+    )
+
+
+@menu_button("🍽 Моє меню")
+async def my_menu(message: Message):
+    user = get_user(message.from_user.id)
+    if not user.participant:
+        await message.answer("Спочатку підтверди участь у вечірці — напиши /start 🎄")
+        return
+
+    mark_user_active(message.from_user.id, user)
+
+    dish = user.menu_dish
+    drink = user.menu_drink
+    dessert = user.menu_dessert
+
+    dish_txt = dish or "ще не вказана"
+    drink_txt = drink or "ще не вказаний"
+    dessert_txt = dessert or "ще не вказаний"
+
+    text = (
+        "<b>Твоє меню:</b>\n"
+        f"• Страва: {dish_txt}\n"
+        f"• Напій: {drink_txt}\n"
+        f"• Десерт: {dessert_txt}\n"
+    )
+
+    # Якщо меню ще взагалі не заповнене — пропонуємо заповнити
+    if not dish and not drink and not dessert:
+        text += (
+            "\nЗараз у тебе ще нічого не вказано.\n"
+            "Можеш заповнити меню прямо зараз 👇"
+        )
+        kb = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(
+                        text="📝 Заповнити меню зараз",
+                        callback_data="menu_now",
+                    )
+                ],
+                [
+                    InlineKeyboardButton(
+                        text="⏱ Пізніше додам",
+                        callback_data="menu_later",
+                    )
+                ],
+            ]
+        )
+        await message.answer(text, reply_markup=kb)
+        return
+
+    # Якщо щось вже є — питаємо, що саме змінити
+    text += (
+        "\nЩо хочеш змінити?\n"
+        "Можеш обрати варіант нижче, або вручну написати:\n"
+        "«Страва: ...», «Напій: ...» або «Десерт: ...»."
+    )
+
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✏ Змінити страву", callback_data="edit_dish"),
+            ],
+            [
+                InlineKeyboardButton(text="🥂 Змінити напій", callback_data="edit_drink"),
+            ],
+            [
+                InlineKeyboardButton(text="🍰 Змінити десерт", callback_data="edit_dessert"),
+            ],
+        ]
+    )
+
+    await message.answer(text, reply_markup=kb)
+
+
+@menu_button("👤 Мій кабінет")
+async def cabinet_menu(message: Message):
+    user = get_user(message.from_user.id)
+    if not user.participant:
+        await message.answer("Спочатку підтверди участь у вечірці — напиши /start 🎄")
+        return
+    mark_user_active(message.from_user.id, user)
+    await message.answer("Твій кабінет гостя:", reply_markup=cabinet_menu_kb())
+
+
+@cached_keyboard(lambda user: (party_for(user).santa.registration_open, user.santa_joined))
+def santa_join_menu_kb(user: Guest) -> InlineKeyboardMarkup:
+    if not party_for(user).santa.registration_open:
+        return InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text="Реєстрація ще не відкрита", callback_data="noop")]
+            ]
+        )
     rows = []
-    if not user.get("santa_joined"):
+    if not user.santa_joined:
         rows.append(
             [
                 InlineKeyboardButton(
@@ -649,9 +3297,10 @@ def santa_join_menu_kb(user: Dict[str, Any]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def santa_chat_kb(user: Dict[str, Any]) -> InlineKeyboardMarkup:
+@cached_keyboard(lambda user: (bool(user.santa_child_id), bool(user.santa_id)))
+def santa_chat_kb(user: Guest) -> InlineKeyboardMarkup:
     rows = []
-    if user.get("santa_child_id"):
+    if user.santa_child_id:
         rows.append(
             [
                 InlineKeyboardButton(
@@ -659,7 +3308,7 @@ def santa_chat_kb(user: Dict[str, Any]) -> InlineKeyboardMarkup:
                 )
             ]
         )
-    if user.get("santa_id"):
+    if user.santa_id:
         rows.append(
             [
                 InlineKeyboardButton(
@@ -678,6 +3327,7 @@ def santa_chat_kb(user: Dict[str, Any]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@cached_keyboard(lambda: ())
 def admin_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -686,10 +3336,12 @@ def admin_menu_kb() -> InlineKeyboardMarkup:
             [InlineKeyboardButton(text="🎅 Налаштування Миколайчика", callback_data="admin_santa")],
             [InlineKeyboardButton(text="📢 Оголошення в приват", callback_data="admin_broadcast")],
             [InlineKeyboardButton(text="💌 Листівка в канал", callback_data="admin_card")],
+            [InlineKeyboardButton(text="📮 Недоставлені", callback_data="admin_outbox")],
         ]
     )
 
 
+@cached_keyboard(lambda: ())
 def admin_santa_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -740,13 +3392,13 @@ async def get_gif_id(message: Message):
     await message.answer(f"file_id:\n<code>{message.animation.file_id}</code>")
 
 
-@router.message(F.text == "🛠 Адмін-панель")
+@menu_button("🛠 Адмін-панель")
 async def admin_panel_button(message: Message):
     if message.from_user.id != ADMIN_ID:
         await message.answer("Це тільки для адміна 🙃")
         return
     user = get_user(message.from_user.id)
-    mark_user_active(user)
+    mark_user_active(message.from_user.id, user)
     await message.answer("Привіт, організаторе 🎄 Що робимо?", reply_markup=admin_menu_kb())
 
 
@@ -755,62 +3407,56 @@ async def admin_panel_button(message: Message):
 async def cmd_start(message: Message):
     user_id = message.from_user.id
     user = get_user(user_id)
-    is_known_guest = user_id in PREASSIGNED_COLORS
+    party = party_for(user)
+    in_party = user.has_valid_code and user.party_code == party.code and party.is_open
+    known_party = KNOWN_GUESTS.get(user_id)
+
+    # якщо гість відомий по списку – автоматично даємо доступ до його вечірки
+    # (але не перетягуємо з іншої відкритої вечірки, куди він сам ввів код)
+    if not in_party and known_party is not None and known_party.is_open:
+        user.has_valid_code = True
+        user.party_code = known_party.code
+        party, in_party = known_party, True
+        await save_data(user_id)
 
-    # якщо гість відомий по списку – автоматично даємо доступ до вечірки
-    if is_known_guest and PARTY.get("active") and PARTY.get("code"):
-        current_code = PARTY["code"]
-        if not user.get("has_valid_code") or user.get("party_code") != current_code:
-            user["has_valid_code"] = True
-            user["party_code"] = current_code
-            await save_data()
-
-    user["name"] = message.from_user.full_name
-    user["username"] = message.from_user.username
+    if (
+        user.name != message.from_user.full_name
+        or user.username != message.from_user.username
+    ):
+        user.name = message.from_user.full_name
+        user.username = message.from_user.username
+        await save_data(user_id)
 
     PENDING_ACTION.pop(user_id, None)
 
-    # Немає активної вечірки
-    if not PARTY.get("active") or not PARTY.get("code"):
-        await send_gif(message, START_GIF_ID)
-        await asyncio.sleep(1)
-        await message.answer(
+    # Немає жодної активної вечірки
+    if not in_party and not any(p.is_open for p in PARTIES.values()):
+        PacedReply(user_id).gif(START_GIF_ID).pause(1).text(
             "Зараз для тебе немає активних вечірок 😌\n\n"
             "Як тільки організатор створить нову тусу і дасть код — ти зможеш зайти сюди знову."
-        )
+        ).send()
         return
 
     # Гість вже учасник і має валідний код
-    if (
-        user.get("participant")
-        and user.get("party_code") == PARTY["code"]
-        and user.get("has_valid_code")
-    ):
-        await send_gif(message, START_GIF_ID)
-        await asyncio.sleep(1)
-        await message.answer(
+    if user.participant and in_party:
+        PacedReply(user_id).gif(START_GIF_ID).pause(1).text(
             "Радий бачити тебе знову 🎄\nТи вже в списку гостей. Ось твоє меню 👇",
             reply_markup=main_menu_kb(user),
-        )
+        ).send()
         return
 
     # Немає валідного коду — просимо ввести, теж з гіфкою
-    if not user.get("has_valid_code") or user.get("party_code") != PARTY["code"]:
-        await send_gif(message, START_GIF_ID)
-        await asyncio.sleep(1)
-        await message.answer(
+    if not in_party:
+        PacedReply(user_id).gif(START_GIF_ID).pause(1).text(
             "Щоб зайти на вечірку, введи, будь ласка, <b>код вечірки</b>, який дав тобі організатор."
-        )
+        ).send()
         PENDING_ACTION[user_id] = "enter_party_code"
         return
 
     # Тут юзер вже має валідний код, але ще не підтвердив участь
-    await send_gif(message, START_GIF_ID)
-    await asyncio.sleep(1)
-
     text = (
         "Вау! ✨\n\n"
-        f"Ти відкрив бота вечірки <b>«{PARTY_NAME}»</b>!\n\n"
+        f"Ти відкрив бота вечірки <b>«{party.name}»</b>!\n\n"
         "Підтверди свою участь нижче — я додам тебе до списку гостей "
         "і допоможу підготуватись до свята 😉\n\n"
         "То ти з нами на вечірці?"
@@ -829,22 +3475,23 @@ async def cmd_start(message: Message):
         ]
     )
 
-    await message.answer(text, reply_markup=kb)
+    PacedReply(user_id).gif(START_GIF_ID).pause(1).text(text, reply_markup=kb).send()
 
 
 @router.callback_query(F.data == "party_yes")
 async def cb_party_yes(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    user["participant"] = True
-    await save_data()
+    user.participant = True
+    await save_data(callback.from_user.id)
 
-    loc_html = f'<span class="tg-spoiler">{PARTY_LOCATION}</span>'
+    party = party_for(user)
+    loc_html = f'<span class="tg-spoiler">{party.location}</span>'
     text = (
         "Для початку — основні дані та правила. Ознайомся і підтверди участь у вечірці:\n\n"
-        f"🎄 <b>{PARTY_NAME}</b>\n"
+        f"🎄 <b>{party.name}</b>\n"
         f"📍 {loc_html}\n"
-        f"🗓 {PARTY_DATES_TEXT}\n\n"
-        f"{party_rules_text()}"
+        f"🗓 {party.dates_text}\n\n"
+        f"{party_rules_text(party)}"
     )
 
     kb = InlineKeyboardMarkup(
@@ -870,19 +3517,18 @@ async def cb_party_confirm_rules(callback: CallbackQuery):
     user_id = callback.from_user.id
     user = get_user(user_id)
 
-    color = get_color_for_user(user_id)
-    tasks = get_tasks_for_user(user_id)
+    party = party_for(user)
+    color_id = party.color_id_of(user_id)
+    color = party.colors[color_id] if color_id else None
+    tasks = party.color_tasks.get(color_id) if color_id else None
 
     if color:
         # запам'ятати color_id
-        for cid, c in COLORS.items():
-            if c is color:
-                user["color_id"] = cid
-                break
-        await save_data()
+        user.color_id = color_id
+        await save_data(user_id)
         logger.info(
             "Користувач %s отримав образ %s",
-            user.get("name") or user_id,
+            user.name or user_id,
             color["label"],
         )
 
@@ -895,16 +3541,15 @@ async def cb_party_confirm_rules(callback: CallbackQuery):
         await callback.message.edit_text(first_text)
 
         # 2. Завдання під спойлером (через невелику паузу)
+        paced = PacedReply(user_id)
         if tasks:
-            await asyncio.sleep(2)
             tasks_text = "\n".join(f"• {t}" for t in tasks)
-            await callback.message.answer(
+            paced.pause(2).text(
                 "А також твої завдання — заховані під спойлером:\n\n"
                 f'<span class="tg-spoiler">{tasks_text}</span>'
             )
 
         # 3. Пропозиція заповнити меню
-        await asyncio.sleep(1)
         kb = InlineKeyboardMarkup(
             inline_keyboard=[
                 [
@@ -921,11 +3566,11 @@ async def cb_party_confirm_rules(callback: CallbackQuery):
                 ],
             ]
         )
-        await callback.message.answer(
+        paced.pause(1).text(
             "Завдання ти ще встигнеш перечитати 🙂\n"
             "Пропоную одразу заповнити твоє меню: страву, напій і десерт.",
             reply_markup=kb,
-        )
+        ).send()
     else:
         await callback.message.edit_text(
             "Ти підтвердив участь 🎄\n\n"
@@ -940,7 +3585,7 @@ async def cb_party_confirm_rules(callback: CallbackQuery):
 async def cb_menu_now(callback: CallbackQuery):
     user_id = callback.from_user.id
     user = get_user(user_id)
-    if not user.get("participant"):
+    if not user.participant:
         await callback.answer("Спочатку підтверди участь через /start 🎄", show_alert=True)
         return
     await callback.message.answer(
@@ -953,7 +3598,7 @@ async def cb_menu_now(callback: CallbackQuery):
 async def cb_menu_later(callback: CallbackQuery):
     user_id = callback.from_user.id
     user = get_user(user_id)
-    if not user.get("participant"):
+    if not user.participant:
         await callback.answer("Спочатку підтверди участь через /start 🎄", show_alert=True)
         return
     await callback.message.answer(
@@ -967,7 +3612,7 @@ async def cb_menu_later(callback: CallbackQuery):
 @router.callback_query(F.data == "edit_dish")
 async def cb_edit_dish(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not user.get("participant"):
+    if not user.participant:
         await callback.answer("Спочатку підтверди участь через /start 🎄", show_alert=True)
         return
     await callback.message.answer("Добре, напиши нову <b>страву</b>, яку ти плануєш принести.")
@@ -978,7 +3623,7 @@ async def cb_edit_dish(callback: CallbackQuery):
 @router.callback_query(F.data == "edit_drink")
 async def cb_edit_drink(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not user.get("participant"):
+    if not user.participant:
         await callback.answer("Спочатку підтверди участь через /start 🎄", show_alert=True)
         return
     await callback.message.answer("Напиши, будь ласка, новий <b>напій</b> для меню.")
@@ -989,7 +3634,7 @@ async def cb_edit_drink(callback: CallbackQuery):
 @router.callback_query(F.data == "edit_dessert")
 async def cb_edit_dessert(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not user.get("participant"):
+    if not user.participant:
         await callback.answer("Спочатку підтверди участь через /start 🎄", show_alert=True)
         return
     await callback.message.answer("Напиши, будь ласка, новий <b>десерт</b> для меню.")
@@ -1000,8 +3645,8 @@ async def cb_edit_dessert(callback: CallbackQuery):
 @router.callback_query(F.data == "party_no_after_rules")
 async def cb_party_no_after_rules(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    user["participant"] = False
-    await save_data()
+    user.participant = False
+    await save_data(callback.from_user.id)
     await callback.message.edit_text(
         "Окей, я не буду записувати тебе у список гостей 🙈\n"
         "Якщо передумаєш — напиши /start."
@@ -1012,33 +3657,35 @@ async def cb_party_no_after_rules(callback: CallbackQuery):
 async def cb_party_no(callback: CallbackQuery):
     await callback.message.edit_text(
         "Шкода 🥺\n\n"
-        f"Можеш просто підглядати за підготовкою до «{PARTY_NAME}».\n"
+        f"Можеш просто підглядати за підготовкою до «{party_for(get_user(callback.from_user.id)).name}».\n"
         "А якщо передумаєш і захочеш приєднатися — просто напиши /start ❤️"
     )
 
 
-@router.message(F.text == "ℹ️ Про вечірку")
+@menu_button("ℹ️ Про вечірку")
 async def about_party(message: Message):
     user = get_user(message.from_user.id)
-    mark_user_active(user)
-    loc_html = f'<span class="tg-spoiler">{PARTY_LOCATION}</span>'
+    mark_user_active(message.from_user.id, user)
+    party = party_for(user)
+    loc_html = f'<span class="tg-spoiler">{party.location}</span>'
     text = (
-        f"🎄 <b>{PARTY_NAME}</b>\n"
+        f"🎄 <b>{party.name}</b>\n"
         f"📍 {loc_html}\n"
-        f"🗓 {PARTY_DATES_TEXT}\n\n"
-        f"{party_rules_text(include_cta=False)}"
+        f"🗓 {party.dates_text}\n\n"
+        f"{party_rules_text(party, include_cta=False)}"
     )
     await message.answer(text)
 
 
-@router.message(F.text == "📢 Канал вечірки")
+@menu_button("📢 Канал вечірки")
 async def party_channel(message: Message):
     user = get_user(message.from_user.id)
-    mark_user_active(user)
-    if PARTY_CHANNEL_LINK:
+    mark_user_active(message.from_user.id, user)
+    link = party_for(user).channel_link
+    if link:
         await message.answer(
             "Ось канал вечірки. Там будуть оголошення, листівки та новини ✨\n"
-            f"{PARTY_CHANNEL_LINK}"
+            f"{link}"
         )
     else:
         await message.answer(
@@ -1046,14 +3693,15 @@ async def party_channel(message: Message):
         )
 
 
-@router.message(F.text == "💬 Чат вечірки")
+@menu_button("💬 Чат вечірки")
 async def party_chat(message: Message):
     user = get_user(message.from_user.id)
-    mark_user_active(user)
-    if PARTY_CHAT_LINK:
+    mark_user_active(message.from_user.id, user)
+    link = party_for(user).chat_link
+    if link:
         await message.answer(
             "Ось чат вечірки. Там можна спілкуватися, ділитись фотками та мемами 🥳\n"
-            f"{PARTY_CHAT_LINK}"
+            f"{link}"
         )
     else:
         await message.answer(
@@ -1061,21 +3709,21 @@ async def party_chat(message: Message):
         )
 
 
-@router.message(F.text == "🎨 Мій образ")
+@menu_button("🎨 Мій образ")
 async def my_look(message: Message):
     user = get_user(message.from_user.id)
-    if not user.get("participant"):
+    if not user.participant:
         await message.answer("Спочатку підтверди участь у вечірці — напиши /start 🎄")
         return
 
-    mark_user_active(user)
+    mark_user_active(message.from_user.id, user)
 
-    color_id = user.get("color_id")
+    color_id = user.color_id
     if not color_id:
         await message.answer("Для тебе ще не призначено колір. Напиши організатору 🙈")
         return
 
-    color = COLORS.get(color_id)
+    color = party_for(user).colors.get(color_id)
     if not color:
         await message.answer("Не можу знайти твій колір, напиши організатору.")
         return
@@ -1089,63 +3737,272 @@ async def my_look(message: Message):
     await message.answer(text)
 
 
-@router.message(F.text == "📜 Наше меню")
-async def guests_menu_for_user(message: Message):
-    user = get_user(message.from_user.id)
-    mark_user_active(user)
+# ================== СПИСКИ ГОСТЕЙ ПО СТОРІНКАХ ==================
+# Telegram приймає не більше 4096 символів в одному повідомленні, а список
+# на кілька десятків гостей уже довший. Тому списки віддаються сторінками
+# з кнопками ⬅ / ➡; запас під підпис сторінки і HTML-теги.
+PAGE_TEXT_LIMIT = int(os.getenv("PAGE_TEXT_LIMIT", "3800"))
 
-    lines = ["📜 <b>Наше меню</b>\n"]
-    has_any = False
 
-    await send_gif(message, TASKS_GIF_ID)
-    
-    for uid, data in USERS.items():
-        if not data.get("participant"):
-            continue
-        has_any = True
+class GuestListPages:
+    """
+    Список гостей, нарізаний на сторінки до PAGE_TEXT_LIMIT символів.
+    Один екземпляр спільний для всіх, хто цей список читає.
 
-        name = data.get("name") or f"Гість {uid}"
-        color = get_color_for_user(uid)
-        if color:
-            color_txt = color["label"]
-            role_txt = color["role"]
+    Сторінки будуються потоково: щоб показати сторінку n, рендеряться
+    лише гості до її кінця (зазвичай — тільки вона сама, бо попередні
+    вже в кеші). Блок кожного гостя і межі кожної сторінки кешуються.
+
+    Зміни приходять через GUEST_CHANGE_HOOKS. Позначені гості
+    перевіряються при наступному читанні, і якщо блок справді змінився
+    (або гість зʼявився / зник у списку), скидаються лише сторінки
+    від його позиції і далі — межі попередніх від нього не залежать.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        ids: Callable[[], list[int]],
+        include: Callable[[Guest], bool],
+        render: Callable[[int, Guest], str],
+        header: str,
+        empty_text: str,
+    ) -> None:
+        self.key = key
+        # кандидати у список у потрібному порядку; include — остаточна перевірка
+        self.ids = ids
+        self.include = include
+        self.render = render
+        self.header = header
+        self.empty_text = empty_text
+        self._order: list[int] = []
+        self._pos: Dict[int, int] = {}
+        self._blocks: Dict[int, str] = {}
+        # (початок, кінець) у _order для кожної вже нарізаної сторінки
+        self._bounds: list[tuple[int, int]] = []
+        self._texts: Dict[int, str] = {}
+        self._dirty: set[int] = set()
+        self._full_rebuild = True
+        self.rendered = 0
+        self.page_hits = 0
+        GUEST_CHANGE_HOOKS.append(self.invalidate)
+
+    def invalidate(self, user_ids: tuple[int, ...]) -> None:
+        if user_ids:
+            self._dirty.update(user_ids)
         else:
-            color_txt = "—"
-            role_txt = "—"
-
-        dish_txt = data.get("menu_dish") or "—"
-        drink_txt = data.get("menu_drink") or "—"
-        dessert_txt = data.get("menu_dessert") or "—"
-        santa_txt = "✅" if data.get("santa_joined") else "❌"
-
-        lines.append(
-            f"• <b>{name}</b>\n"
-            f"  Образ: {color_txt}\n"
-            f"  Роль: {role_txt}\n"
-            f"  Страва: {dish_txt}\n"
-            f"  Напій: {drink_txt}\n"
-            f"  Десерт: {dessert_txt}\n"
-            f"  У грі Миколайчика: {santa_txt}\n"
-        )
+            self._full_rebuild = True
+
+    # ---------- внутрішнє ----------
+    def _drop_pages_from(self, index: int) -> None:
+        """
+        Скидає всі сторінки, на межу яких могла вплинути позиція index:
+        ту, що її містить, попередню, якщо та закінчилась рівно перед нею
+        (туди міг би влізти змінений блок), і всі наступні.
+        """
+        keep = 0
+        while keep < len(self._bounds) and self._bounds[keep][1] < index:
+            keep += 1
+        for n in range(keep, len(self._bounds)):
+            self._texts.pop(n, None)
+        del self._bounds[keep:]
+
+    def _load_order(self) -> None:
+        self._order = []
+        for uid in self.ids():
+            data = find_user(uid)
+            if data is not None and self.include(data):
+                self._order.append(uid)
+        self._pos = {uid: i for i, uid in enumerate(self._order)}
+
+    def _refresh(self) -> None:
+        if self._full_rebuild:
+            self._full_rebuild = False
+            self._dirty.clear()
+            self._load_order()
+            self._blocks = {}
+            self._bounds = []
+            self._texts = {}
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        for uid in dirty:
+            data = find_user(uid)
+            member = data is not None and self.include(data)
+            index = self._pos.get(uid)
+            if member and index is None:
+                # новий у списку — стає на своє місце в загальному порядку гостей;
+                # таке буває рідко, тож простіше перечитати порядок
+                old = self._order
+                self._load_order()
+                first = next(
+                    (i for i, (a, b) in enumerate(zip(old, self._order)) if a != b),
+                    min(len(old), len(self._order)),
+                )
+                self._drop_pages_from(first)
+                self._blocks = {u: b for u, b in self._blocks.items() if u in self._pos and u != uid}
+            elif not member and index is not None:
+                self._order.pop(index)
+                self._blocks.pop(uid, None)
+                self._pos = {u: i for i, u in enumerate(self._order)}
+                self._drop_pages_from(index)
+            elif member and uid in self._blocks:
+                block = self._block_for(uid, data)
+                if block != self._blocks[uid]:
+                    self._blocks[uid] = block
+                    self._drop_pages_from(index)
+
+    def _block_for(self, uid: int, data: Guest) -> str:
+        self.rendered += 1
+        block = self.render(uid, data)
+        # одна дуже довга страва не повинна ламати цілу сторінку
+        if len(block) > PAGE_TEXT_LIMIT - len(self.header):
+            block = block[: PAGE_TEXT_LIMIT - len(self.header) - 2] + "…\n"
+        return block
+
+    def _block(self, uid: int) -> str:
+        block = self._blocks.get(uid)
+        if block is None:
+            block = self._blocks[uid] = self._block_for(uid, find_user(uid) or Guest())
+        return block
+
+    def _cut_next_page(self) -> bool:
+        start = self._bounds[-1][1] if self._bounds else 0
+        if start >= len(self._order) and self._bounds:
+            return False
+        size = len(self.header)
+        end = start
+        while end < len(self._order):
+            block = self._block(self._order[end])
+            if end > start and size + len(block) + 1 > PAGE_TEXT_LIMIT:
+                break
+            size += len(block) + 1
+            end += 1
+        self._bounds.append((start, end))
+        return True
+
+    # ---------- читання ----------
+    def page(self, n: int) -> tuple[str, int, bool]:
+        """
+        Повертає (текст, номер сторінки, чи є наступна).
+        Номер обрізається до існуючих сторінок.
+        """
+        self._refresh()
+        n = max(n, 0)
+        while len(self._bounds) <= n and self._cut_next_page():
+            pass
+        n = min(n, len(self._bounds) - 1)
+        start, end = self._bounds[n]
+        has_next = end < len(self._order)
+
+        text = self._texts.get(n)
+        if text is None:
+            blocks = [self._blocks[uid] for uid in self._order[start:end]] or [self.empty_text]
+            text = self._texts[n] = "\n".join([self.header, *blocks])
+        else:
+            self.page_hits += 1
+        if n > 0 or has_next:
+            total = "" if has_next else f" з {len(self._bounds)}"
+            text = f"{text}\n<i>Сторінка {n + 1}{total}</i>"
+        return text, n, has_next
+
+    def nav_row(self, n: int, has_next: bool) -> list[InlineKeyboardButton]:
+        row = []
+        if n > 0:
+            row.append(InlineKeyboardButton(text="⬅", callback_data=f"{self.key}:{n - 1}"))
+        if has_next:
+            row.append(InlineKeyboardButton(text="➡", callback_data=f"{self.key}:{n + 1}"))
+        return row
+
+
+def page_from_callback(data: str) -> int:
+    try:
+        return int(data.split(":", 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def render_guest_menu_entry(uid: int, data: Guest) -> str:
+    name = data.name or f"Гість {uid}"
+    color = get_color_for_user(uid)
+    if color:
+        color_txt = color["label"]
+        role_txt = color["role"]
+    else:
+        color_txt = "—"
+        role_txt = "—"
+
+    dish_txt = data.menu_dish or "—"
+    drink_txt = data.menu_drink or "—"
+    dessert_txt = data.menu_dessert or "—"
+    santa_txt = "✅" if data.santa_joined else "❌"
+
+    return (
+        f"• <b>{name}</b>\n"
+        f"  Образ: {color_txt}\n"
+        f"  Роль: {role_txt}\n"
+        f"  Страва: {dish_txt}\n"
+        f"  Напій: {drink_txt}\n"
+        f"  Десерт: {dessert_txt}\n"
+        f"  У грі Миколайчика: {santa_txt}\n"
+    )
+
+
+def guests_menu_pages(party: Party) -> GuestListPages:
+    """«Наше меню» вечірки party — свої сторінки в кожної (Party.guests_menu)."""
+    return GuestListPages(
+        "gm_page",
+        ids=party.guest_ids,
+        include=party.is_member,
+        render=render_guest_menu_entry,
+        header="📜 <b>Наше меню</b>\n",
+        empty_text="Поки ще ніхто не додав своє меню 🤔",
+    )
+
+
+def guests_menu_kb(pages: GuestListPages, n: int, has_next: bool) -> Optional[InlineKeyboardMarkup]:
+    row = pages.nav_row(n, has_next)
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
+
+
+@menu_button("📜 Наше меню")
+async def guests_menu_for_user(message: Message):
+    user = get_user(message.from_user.id)
+    mark_user_active(message.from_user.id, user)
+
+    pages = party_for(user).guests_menu
+    text, n, has_next = pages.page(0)
+    # сторінки гортаються через edit_text — тож не підписом під GIF
+    await answer_with_gif(
+        message, TASKS_GIF_ID, text, reply_markup=guests_menu_kb(pages, n, has_next), combine=False
+    )
 
-    if not has_any:
-        lines.append("Поки ще ніхто не додав своє меню 🤔")
 
-    await message.answer("\n".join(lines))
+@router.callback_query(F.data.startswith("gm_page:"))
+async def cb_guests_menu_page(callback: CallbackQuery):
+    pages = party_for(get_user(callback.from_user.id)).guests_menu
+    text, n, has_next = pages.page(page_from_callback(callback.data))
+    await callback.answer()
+    try:
+        await callback.message.edit_text(text, reply_markup=guests_menu_kb(pages, n, has_next))
+    except Exception:
+        # та сама сторінка — Telegram не дає «редагувати» без змін
+        pass
 
 
-def ensure_tasks_state(user: Dict[str, Any]) -> list[int]:
+def ensure_tasks_state(user: Guest) -> list[int]:
     """
     0 = ще не виконав
     1 = виконав (✅)
     2 = провалено / зловили (❌)
     """
-    color_id = user.get("color_id")
-    if not color_id or color_id not in COLOR_TASKS:
+    color_id = user.color_id
+    color_tasks = party_for(user).color_tasks
+    if not color_id or color_id not in color_tasks:
         return []
 
-    total = len(COLOR_TASKS[color_id])
-    raw = user.get("tasks_done") or []
+    total = len(color_tasks[color_id])
+    raw = user.tasks_done or []
 
     norm: list[int] = []
     for v in raw:
@@ -1161,7 +4018,7 @@ def ensure_tasks_state(user: Dict[str, Any]) -> list[int]:
     if len(norm) > total:
         norm = norm[:total]
 
-    user["tasks_done"] = norm
+    user.tasks_done = norm
     return norm
 
 def task_state_icon(state: int) -> str:
@@ -1171,9 +4028,12 @@ def task_state_icon(state: int) -> str:
         return "❌"
     return "⬜"
 
-def tasks_inline_kb(user: Dict[str, Any]) -> InlineKeyboardMarkup:
-    color_id = user.get("color_id")
-    tasks = COLOR_TASKS.get(color_id) or []
+# кількість завдань визначає колір, тож вектора станів достатньо
+@cached_keyboard(lambda user: tuple(ensure_tasks_state(user)))
+def tasks_inline_kb(user: Guest) -> InlineKeyboardMarkup:
+    color_id = user.color_id
+    color_tasks = party_for(user).color_tasks
+    tasks = color_tasks.get(color_id) or []
     done = ensure_tasks_state(user)
     rows = []
     for idx, _ in enumerate(tasks):
@@ -1197,21 +4057,22 @@ def tasks_inline_kb(user: Dict[str, Any]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-@router.message(F.text == "📋 Мої завдання")
+@menu_button("📋 Мої завдання")
 async def my_tasks(message: Message):
     user = get_user(message.from_user.id)
-    if not user.get("participant"):
+    if not user.participant:
         await message.answer("Спочатку підтверди участь у вечірці — напиши /start 🎄")
         return
 
-    mark_user_active(user)
+    mark_user_active(message.from_user.id, user)
 
-    color_id = user.get("color_id")
-    if not color_id or color_id not in COLOR_TASKS:
+    color_id = user.color_id
+    color_tasks = party_for(user).color_tasks
+    if not color_id or color_id not in color_tasks:
         await message.answer("Для тебе поки немає списку завдань. Напиши організатору.")
         return
 
-    tasks = COLOR_TASKS[color_id]
+    tasks = color_tasks[color_id]
     done = ensure_tasks_state(user)
 
     lines = ["📋 <b>Твої завдання</b>\n"]
@@ -1236,14 +4097,15 @@ async def my_tasks(message: Message):
 @router.callback_query(F.data.startswith("task_toggle:"))
 async def cb_task_toggle(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not user.get("participant"):
+    if not user.participant:
         await callback.answer("Спочатку підтверди участь у вечірці — напиши /start 🎄", show_alert=True)
         return
 
-    mark_user_active(user)
+    mark_user_active(callback.from_user.id, user)
 
-    color_id = user.get("color_id")
-    if not color_id or color_id not in COLOR_TASKS:
+    color_id = user.color_id
+    color_tasks = party_for(user).color_tasks
+    if not color_id or color_id not in color_tasks:
         await callback.answer("Для тебе поки немає завдань.", show_alert=True)
         return
 
@@ -1253,7 +4115,7 @@ async def cb_task_toggle(callback: CallbackQuery):
         await callback.answer("Помилка з індексом завдання.", show_alert=True)
         return
 
-    tasks = COLOR_TASKS[color_id]
+    tasks = color_tasks[color_id]
     done = ensure_tasks_state(user)
     if idx < 0 or idx >= len(tasks):
         await callback.answer("Невідоме завдання.", show_alert=True)
@@ -1261,8 +4123,8 @@ async def cb_task_toggle(callback: CallbackQuery):
 
     # 0 -> 1 -> 2 -> 0
     done[idx] = (done[idx] + 1) % 3
-    user["tasks_done"] = done
-    await save_data()
+    user.tasks_done = done
+    await save_data(callback.from_user.id)
     await callback.answer("Оновив стан завдання ✅")
 
     lines = ["📋 <b>Твої завдання</b>\n"]
@@ -1287,7 +4149,7 @@ async def cb_task_toggle(callback: CallbackQuery):
 async def cb_task_ask_org(callback: CallbackQuery):
     user_id = callback.from_user.id
     user = get_user(user_id)
-    mark_user_active(user)
+    mark_user_active(user_id, user)
     PENDING_ACTION[user_id] = "task_ask_org"
     msg = await callback.message.answer(
         "Напиши коротко про завдання, яке хочеш підтвердити, "
@@ -1305,32 +4167,33 @@ async def cb_task_ask_org(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.message(F.text == "🎅 Мій Миколайчик")
+@menu_button("🎅 Мій Миколайчик")
 async def my_santa(message: Message):
     user = get_user(message.from_user.id)
+    santa = party_for(user).santa
 
-    if not user.get("participant"):
+    if not user.participant:
         await message.answer("Спочатку підтвердь, що ти будеш на вечірці — натисни /start 🎄")
         return
 
-    mark_user_active(user)
+    mark_user_active(message.from_user.id, user)
 
-    await send_gif(message, SANTA_GIF_ID)
-
-    if not SANTA.registration_open and not user.get("santa_joined"):
-        await message.answer(
+    if not santa.registration_open and not user.santa_joined:
+        await answer_with_gif(
+            message,
+            SANTA_GIF_ID,
             "Організатор ще не відкрив реєстрацію на гру «Таємний Миколайчик». "
-            "Трохи терпіння, скоро все запустимо 🎅"
+            "Трохи терпіння, скоро все запустимо 🎅",
         )
         return
 
-    if not user.get("santa_joined"):
+    if not user.santa_joined:
         budget_part = (
-            f"Орієнтовний бюджет: <b>{SANTA.budget_text}</b>\n"
-            if SANTA.budget_text
+            f"Орієнтовний бюджет: <b>{santa.budget_text}</b>\n"
+            if santa.budget_text
             else ""
         )
-        desc_part = f"{SANTA.description}\n\n" if SANTA.description else ""
+        desc_part = f"{santa.description}\n\n" if santa.description else ""
         text = (
             f"{SANTA_BASE_RULES}\n\n"
             f"{budget_part}"
@@ -1339,26 +4202,31 @@ async def my_santa(message: Message):
             "Щоб написати або відповісти у грі, ти завжди обираєш в меню кнопку:\n"
             "«✉ Написати підопічному» або «✉ Написати моєму Миколайчику»."
         )
-        await message.answer(text, reply_markup=santa_join_menu_kb(user))
+        # меню реєстрації потім редагується через edit_text — не підписом
+        await answer_with_gif(
+            message, SANTA_GIF_ID, text, reply_markup=santa_join_menu_kb(user), combine=False
+        )
         return
 
-    if not SANTA.started:
-        await message.answer(
+    if not santa.started:
+        await answer_with_gif(
+            message,
+            SANTA_GIF_ID,
             "Ти вже в грі 🎅, але пари ще не розподілені. "
-            "Чекаємо, поки організатор запустить жеребкування."
+            "Чекаємо, поки організатор запустить жеребкування.",
         )
         return
 
-    child_id = user.get("santa_child_id")
-    santa_id = user.get("santa_id")
+    child_id = user.santa_child_id
+    santa_id = user.santa_id
 
     parts = ["🎅 <b>Твій Миколайчик</b>"]
 
     if child_id:
-        child = USERS.get(child_id)
+        child = find_user(child_id)
         parts.append("\n\n<b>Твій підопічний:</b>\n")
-        parts.append(child.get("name") or "Гість")
-        wish = child.get("santa_wish")
+        parts.append(child.name or "Гість")
+        wish = child.santa_wish
         if wish:
             parts.append("\nПобажання / анти-побажання:\n")
             parts.append(wish)
@@ -1376,20 +4244,20 @@ async def my_santa(message: Message):
         "• «✉ Написати моєму Миколайчику» — щоб написати тому, хто готує подарунок для тебе\n\n"
         "Кожне нове повідомлення починається з натискання відповідної кнопки — так зберігається анонімність."
     )
-    await message.answer("".join(parts), reply_markup=santa_chat_kb(user))
+    await answer_with_gif(message, SANTA_GIF_ID, "".join(parts), reply_markup=santa_chat_kb(user))
 
 
-@router.message(F.text == "⭐ Відгук про вечірку")
+@menu_button("⭐ Відгук про вечірку")
 async def feedback_menu(message: Message):
     user = get_user(message.from_user.id)
-    if not user.get("participant"):
+    if not user.participant:
         await message.answer("Ця опція тільки для гостей вечірки 🎄")
         return
-    if not is_feedback_time():
+    if not party_for(user).is_feedback_time():
         await message.answer("Ще рано для відгуків 😉")
         return
 
-    mark_user_active(user)
+    mark_user_active(message.from_user.id, user)
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -1413,11 +4281,11 @@ async def feedback_menu(message: Message):
 @router.callback_query(F.data == "fb_start")
 async def cb_fb_start(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not user.get("participant") or not is_feedback_time():
+    if not user.participant or not party_for(user).is_feedback_time():
         await callback.answer("Поки що не можна залишати відгук.", show_alert=True)
         return
 
-    mark_user_active(user)
+    mark_user_active(callback.from_user.id, user)
 
     PENDING_ACTION[callback.from_user.id] = "fb_collect"
     PENDING_CONTEXT[callback.from_user.id] = {"fb_msgs": []}
@@ -1445,7 +4313,6 @@ async def cb_fb_start(callback: CallbackQuery):
 async def cb_fb_send(callback: CallbackQuery):
     user_id = callback.from_user.id
     user = get_user(user_id)
-    await send_gif(callback.message, FEEDBACK_GIF_ID)
     ctx = PENDING_CONTEXT.get(user_id) or {}
     fb_msgs = ctx.get("fb_msgs") or []
 
@@ -1453,40 +4320,46 @@ async def cb_fb_send(callback: CallbackQuery):
         await callback.answer("Ти ще нічого не написав у відгуку 🙈", show_alert=True)
         return
 
-    bot: Bot = callback.message.bot
-
-    username = user.get("username") or "-"
+    username = user.username or "-"
     header = (
-        f"⭐ Фідбек від {user.get('name') or user_id} "
+        f"⭐ Фідбек від {user.name or user_id} "
         f"(@{username}):"
     )
 
     try:
-        await bot.send_message(ADMIN_ID, header)
-        for chat_id, msg_id in fb_msgs:
-            # просто копіюємо все, що накидав у фідбек
-            await bot.copy_message(ADMIN_ID, chat_id, msg_id)
-
-        await callback.message.answer(
-            "Дякую за відгук! Я передав його організатору 🫶",
-            reply_markup=main_menu_kb(user),
+        # копіюємо все, що накидав у фідбек, пачками copy_messages
+        # (20 фото — один виклик API, а не 20); доставить OUTBOX у фоні
+        OUTBOX.enqueue_many(
+            [(ADMIN_ID, "send_message", {"text": header})]
+            + copy_messages_items(ADMIN_ID, [tuple(m) for m in fb_msgs])
         )
     except Exception as e:
         logger.exception("Не зміг передати фідбек організатору: %s", e)
+        await callback.answer()
         await callback.message.answer("Не зміг передати фідбек організатору 😔")
+        return
+
+    # кнопку «відпускаємо» одразу — решта вже не залежить від Telegram-адміна
+    await callback.answer()
 
     # чистимо стан
     PENDING_ACTION.pop(user_id, None)
     PENDING_CONTEXT.pop(user_id, None)
-    user["feedback_requested"] = True
-    await save_data()
-    await callback.answer()
+    user.feedback_requested = True
+    await save_data(user_id)
 
+    await answer_with_gif(
+        callback.message,
+        FEEDBACK_GIF_ID,
+        "Дякую за відгук! Я передав його організатору 🫶",
+        reply_markup=main_menu_kb(user),
+    )
 
-@router.message(F.text == "❓ Допомога")
+
+@menu_button("❓ Допомога")
 async def help_menu(message: Message):
     user = get_user(message.from_user.id)
-    mark_user_active(user)
+    mark_user_active(message.from_user.id, user)
     text = (
         "❓ <b>Допомога</b>\n\n"
         "Коротко, що вміє цей бот:\n\n"
@@ -1518,12 +4391,13 @@ async def help_menu(message: Message):
 @router.callback_query(F.data == "santa_join")
 async def cb_santa_join(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not SANTA.registration_open:
+    santa = party_for(user).santa
+    if not santa.registration_open:
         await callback.answer("Реєстрація ще не відкрита 🙈", show_alert=True)
         return
-    user["santa_joined"] = True
-    user["santa_gift_ready"] = False
-    await save_data()
+    user.santa_joined = True
+    user.santa_gift_ready = False
+    await save_data(callback.from_user.id)
     await callback.message.edit_text(
         "Ти в грі «Таємний Миколайчик» 🎅\n\n"
         "Напиши, будь ласка, що ти хотів/ла б отримати або чого точно не треба дарувати.\n"
@@ -1537,12 +4411,13 @@ async def cb_santa_leave(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
     user_id = callback.from_user.id
 
-    logger.info("Користувач %s вийшов з вечірки та гри Santa", user.get("name") or user_id)
+    logger.info("Користувач %s вийшов з вечірки та гри Santa", user.name or user_id)
 
     # Повністю скидаємо стан
-    USERS[user_id] = _base_user_template()
-    USERS[user_id]["postmenu_followups_blocked"] = True
-    await save_data()
+    USERS[user_id] = Guest()
+    USERS[user_id].postmenu_followups_blocked = True
+    SCHEDULER.cancel_user(user_id)
+    await save_data(user_id)
 
     await callback.message.edit_text(
         "Я виключив тебе з гри «Таємний Миколайчик» і з вечірки. "
@@ -1553,13 +4428,14 @@ async def cb_santa_leave(callback: CallbackQuery):
 @router.callback_query(F.data == "msg_child")
 async def cb_msg_child(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not user.get("santa_child_id"):
+    santa = party_for(user).santa
+    if not user.santa_child_id:
         await callback.answer("У тебе поки немає підопічного 🤔", show_alert=True)
         return
-    if not SANTA.started:
+    if not santa.started:
         await callback.answer("Гра ще не запущена, пари не активні 🙈", show_alert=True)
         return
-    mark_user_active(user)
+    mark_user_active(callback.from_user.id, user)
     PENDING_ACTION[callback.from_user.id] = "msg_child"
     await callback.message.answer(
         "Напиши повідомлення, яке я анонімно перешлю твоєму підопічному 👇\n\n"
@@ -1570,13 +4446,14 @@ async def cb_msg_child(callback: CallbackQuery):
 @router.callback_query(F.data == "msg_santa")
 async def cb_msg_santa(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    if not user.get("santa_id"):
+    santa = party_for(user).santa
+    if not user.santa_id:
         await callback.answer("У тебе поки немає Миколайчика 🤔", show_alert=True)
         return
-    if not SANTA.started:
+    if not santa.started:
         await callback.answer("Гра ще не запущена, пари не активні 🙈", show_alert=True)
         return
-    mark_user_active(user)
+    mark_user_active(callback.from_user.id, user)
     PENDING_ACTION[callback.from_user.id] = "msg_santa"
     await callback.message.answer(
         "Напиши повідомлення, яке я анонімно перешлю твоєму Миколайчику 👇\n\n"
@@ -1587,7 +4464,7 @@ async def cb_msg_santa(callback: CallbackQuery):
 @router.callback_query(F.data == "ask_santa_admin")
 async def cb_ask_santa_admin(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    mark_user_active(user)
+    mark_user_active(callback.from_user.id, user)
     PENDING_ACTION[callback.from_user.id] = "ask_santa_admin"
     await callback.message.answer(
         "Напиши своє питання про Таємного Миколайчика.\n"
@@ -1603,14 +4480,151 @@ async def cb_noop(callback: CallbackQuery):
 @router.callback_query(F.data == "ask_org")
 async def cb_ask_org(callback: CallbackQuery):
     user = get_user(callback.from_user.id)
-    mark_user_active(user)
+    mark_user_active(callback.from_user.id, user)
     PENDING_ACTION[callback.from_user.id] = "ask_org"
-    await callback.message.answer(
-        "Напиши своє повідомлення організатору. "
-        "Якщо хочеш анонімно — додай слово «анонімно» у текст."
+    # GIF окремим повідомленням, щоб не плутати з інструкцією; шлемо паралельно
+    await asyncio.gather(
+        answer_text(
+            callback.message,
+            "Напиши своє повідомлення організатору. "
+            "Якщо хочеш анонімно — додай слово «анонімно» у текст.",
+        ),
+        send_gif(callback.message, ORG_CHAT_GIF_ID),
     )
-    # GIF чіпляємо до вихідного повідомлення callbackʼа, щоб не плутати з інструкцією
-    await send_gif(callback.message, ORG_CHAT_GIF_ID)
+
+
+# ================== ПАРИ МИКОЛАЙЧИКА ==================
+# Обмеження для пар лежать у SANTA_EXCLUSIONS_FILE (JSON):
+#   {"groups": [[uid, uid], [uid, uid, uid]],   — пари, сімʼї: не дарують одне одному
+#    "pairs":  [[santa_uid, child_uid], ...]}    — заборонені напрямки (минулорічні пари)
+# SANTA_PAIRS_SEED — якщо задано, розподіл відтворюється один в один.
+SANTA_EXCLUSIONS_FILE = os.getenv("SANTA_EXCLUSIONS_FILE", "santa_exclusions.json")
+SANTA_PAIRS_SEED = os.getenv("SANTA_PAIRS_SEED") or None
+# скільки випадкових партнерів пробуємо для обміну, поки не здамось і не
+# перейдемо до точного пошуку
+SANTA_SWAP_TRIES = 32
+
+
+def load_santa_exclusions(players: list[int]) -> Dict[int, set[int]]:
+    """
+    santa_uid → множина тих, кому він дарувати не може.
+    Гості не з players ігноруються. Битий файл — не привід не грати:
+    логуємо і генеруємо без обмежень.
+    """
+    if not os.path.exists(SANTA_EXCLUSIONS_FILE):
+        return {}
+    try:
+        with open(SANTA_EXCLUSIONS_FILE, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        groups = [[int(uid) for uid in g] for g in raw.get("groups", [])]
+        pairs = [(int(s), int(c)) for s, c in raw.get("pairs", [])]
+    except Exception as e:
+        logger.error("Файл обмежень %s пошкоджений: %s", SANTA_EXCLUSIONS_FILE, e)
+        return {}
+
+    in_game = set(players)
+    forbidden: Dict[int, set[int]] = {}
+    for group in groups:
+        members = [uid for uid in group if uid in in_game]
+        for uid in members:
+            others = [o for o in members if o != uid]
+            if others:
+                forbidden.setdefault(uid, set()).update(others)
+    for santa_uid, child_uid in pairs:
+        if santa_uid in in_game and child_uid in in_game:
+            forbidden.setdefault(santa_uid, set()).add(child_uid)
+    return forbidden
+
+
+def make_santa_pairs(
+    players: list[int],
+    forbidden: Optional[Dict[int, set[int]]] = None,
+    seed: Optional[Any] = None,
+) -> Dict[int, int]:
+    """
+    Розподіл santa_uid → child_uid: ніхто не дарує собі і тим, кого
+    забороняє forbidden. Той самий seed — той самий розподіл.
+
+    1. Випадковий цикл по перемішаному списку (як і раніше без обмежень).
+    2. Кожну заборонену пару лагодимо обміном підопічних з випадковим
+       іншим Миколайчиком — за рідких обмежень цього досить.
+    3. Що не полагодилось — добираємо точно: шукаємо збільшувальний шлях
+       у двочастковому графі «хто кому може дарувати». Граф майже повний,
+       тож BFS іде по доповненню — не перебираючи n² ребер.
+    Якщо розподілу не існує — ValueError.
+    """
+    forbidden = forbidden or {}
+    no = frozenset()
+    rng = random.Random(seed)
+    order = list(players)
+    rng.shuffle(order)
+    n = len(order)
+    if n < 2:
+        raise ValueError("Замало учасників для пар")
+
+    def allowed(santa_uid: int, child_uid: int) -> bool:
+        return santa_uid != child_uid and child_uid not in forbidden.get(santa_uid, no)
+
+    child_of = {order[i]: order[(i + 1) % n] for i in range(n)}
+    if not forbidden:
+        return child_of
+
+    bad = [s for s in order if not allowed(s, child_of[s])]
+    unresolved: list[int] = []
+    for s in bad:
+        if allowed(s, child_of[s]):
+            continue  # полагодився попереднім обміном
+        for _ in range(SANTA_SWAP_TRIES):
+            t = order[rng.randrange(n)]
+            cs, ct = child_of[s], child_of[t]
+            if allowed(s, ct) and allowed(t, cs):
+                child_of[s], child_of[t] = ct, cs
+                break
+        else:
+            unresolved.append(s)
+
+    if not unresolved:
+        return child_of
+
+    santa_of = {c: s for s, c in child_of.items()}
+    for s in unresolved:
+        del santa_of[child_of.pop(s)]
+    for s in unresolved:
+        _augment_santa_pair(s, order, allowed, child_of, santa_of)
+    return child_of
+
+
+def _augment_santa_pair(
+    start: int,
+    order: list[int],
+    allowed: Callable[[int, int], bool],
+    child_of: Dict[int, int],
+    santa_of: Dict[int, int],
+) -> None:
+    """
+    Знаходить підопічного для start, перекидаючи вже розподілених по
+    збільшувальному шляху. Кожен підопічний відвідується не більше разу,
+    тож пошук — O(n + кількість заборон).
+    """
+    unvisited = dict.fromkeys(order)  # упорядкована множина — відтворюваність
+    came_from: Dict[int, int] = {}  # child → santa, з якого до нього прийшли
+    queue = [start]
+    for santa_uid in queue:
+        for child_uid in [c for c in unvisited if allowed(santa_uid, c)]:
+            del unvisited[child_uid]
+            came_from[child_uid] = santa_uid
+            if child_uid not in santa_of:
+                # вільний підопічний — розвертаємо шлях
+                while True:
+                    s = came_from[child_uid]
+                    prev = child_of.get(s)
+                    child_of[s] = child_uid
+                    santa_of[child_uid] = s
+                    if s == start:
+                        return
+                    child_uid = prev
+            queue.append(santa_of[child_uid])
+    raise ValueError("З такими обмеженнями пари скласти неможливо")
 
 
 # ================== АДМІН ==================
@@ -1620,55 +4634,147 @@ async def cmd_admin(message: Message):
         await message.answer("Ти не виглядаєш як організатор цієї тусовки 😏")
         return
     user = get_user(message.from_user.id)
-    mark_user_active(user)
+    mark_user_active(message.from_user.id, user)
     await message.answer("Привіт, організаторе 🎄 Що робимо?", reply_markup=admin_menu_kb())
 
 
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("Ти не виглядаєш як організатор цієї тусовки 😏")
+        return
+    await message.answer(stats_report())
+
+
+def render_admin_guest_entry(uid: int, data: Guest) -> str:
+    name = data.name or f"id {uid}"
+    color = get_color_for_user(uid)
+    if color:
+        color_txt = color["label"]
+        role_txt = color["role"]
+    else:
+        color_txt = "-"
+        role_txt = "-"
+
+    dish_txt = data.menu_dish or "—"
+    drink_txt = data.menu_drink or "—"
+    dessert_txt = data.menu_dessert or "—"
+    santa_txt = "✅" if data.santa_joined else "❌"
+    gift_txt = "🎁" if data.santa_gift_ready else "—"
+
+    return (
+        f"• <b>{name}</b>\n"
+        f"  Колір: {color_txt}\n"
+        f"  Роль: {role_txt}\n"
+        f"  Страва: {dish_txt}\n"
+        f"  Напій: {drink_txt}\n"
+        f"  Десерт: {dessert_txt}\n"
+        f"  Santa: {santa_txt} | Подарунок готовий: {gift_txt}\n"
+    )
+
+
+def admin_guests_pages(party: Party) -> GuestListPages:
+    return GuestListPages(
+        "ag_page",
+        ids=party.guest_ids,
+        include=party.is_member,
+        render=render_admin_guest_entry,
+        header=f"👥 <b>Гості вечірки «{party.name}»</b>",
+        empty_text="Поки нікого немає.",
+    )
+
+
+def admin_guests_kb(pages: GuestListPages, n: int, has_next: bool) -> InlineKeyboardMarkup:
+    kb = admin_menu_kb()
+    row = pages.nav_row(n, has_next)
+    if row:
+        return InlineKeyboardMarkup(inline_keyboard=[row, *kb.inline_keyboard])
+    return kb
+
+
 @router.callback_query(F.data == "admin_guests")
+@router.callback_query(F.data.startswith("ag_page:"))
 async def admin_guests(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Це тільки для адміна 🙃", show_alert=True)
         return
 
-    lines = ["👥 <b>Гості вечірки</b>"]
-    has_any = False
+    pages = managed_party().admin_guests
+    text, n, has_next = pages.page(page_from_callback(callback.data))
+    try:
+        await callback.message.edit_text(text, reply_markup=admin_guests_kb(pages, n, has_next))
+    except Exception:
+        # та сама сторінка — Telegram не дає «редагувати» без змін
+        pass
+    await callback.answer()
 
-    for uid, data in USERS.items():
-        if not data.get("participant"):
-            continue
-        has_any = True
-        name = data.get("name") or f"id {uid}"
-        color = get_color_for_user(uid)
-        if color:
-            color_txt = color["label"]
-            role_txt = color["role"]
-        else:
-            color_txt = "-"
-            role_txt = "-"
-
-        dish_txt = data.get("menu_dish") or "—"
-        drink_txt = data.get("menu_drink") or "—"
-        dessert_txt = data.get("menu_dessert") or "—"
-        santa_txt = "✅" if data.get("santa_joined") else "❌"
-        gift_txt = "🎁" if data.get("santa_gift_ready") else "—"
-
-        lines.append(
-            f"• <b>{name}</b>\n"
-            f"  Колір: {color_txt}\n"
-            f"  Роль: {role_txt}\n"
-            f"  Страва: {dish_txt}\n"
-            f"  Напій: {drink_txt}\n"
-            f"  Десерт: {dessert_txt}\n"
-            f"  Santa: {santa_txt} | Подарунок готовий: {gift_txt}\n"
-        )
 
-    if not has_any:
-        lines.append("Поки нікого немає.")
+STATE_LABELS = {
+    "pending": "⏳ в черзі",
+    "sending": "📤 відправляються",
+    "sent": "✅ доставлено",
+    "failed": "❌ не доставлено",
+}
+
+
+def outbox_report() -> str:
+    counts = OUTBOX.state_counts()
+    lines = ["📮 <b>Вихідна черга</b>"]
+    for state, label in STATE_LABELS.items():
+        lines.append(f"{label}: {counts.get(state, 0)}")
+
+    bridges = BRIDGE_REPLIES.stats()
+    lines.append(
+        f"\n🔗 Відкритих мостів: {bridges['size']}\n"
+        f"Reply через міст: {bridges['hits']}/{bridges['hits'] + bridges['misses']}"
+        f" ({bridges['hit_rate']:.0%}), протухло: {bridges['expired']},"
+        f" витіснено: {bridges['evicted']}"
+    )
+
+    failed = OUTBOX.failed_items()
+    if failed:
+        lines.append("\n<b>Останні недоставлені:</b>")
+        for id_, chat_id, method, attempts, updated_at, last_error in failed:
+            name = (find_user(chat_id) or Guest()).name or f"id {chat_id}"
+            when = datetime.fromtimestamp(updated_at).strftime("%d.%m %H:%M")
+            error = html.escape((last_error or "—")[:120])
+            lines.append(f"• #{id_} {name} ({method}, спроб: {attempts}, {when})\n  {error}")
+    return "\n".join(lines)
+
+
+def admin_outbox_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="🔁 Повторити недоставлені", callback_data="admin_outbox_retry")],
+        ]
+    )
+
+
+@router.callback_query(F.data == "admin_outbox")
+async def admin_outbox(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Це тільки для адміна 🙃", show_alert=True)
+        return
+    await callback.answer()
+    await OUTBOX.flush_states()
+    await callback.message.edit_text(outbox_report(), reply_markup=admin_outbox_kb())
+
 
-    await callback.message.edit_text("\n".join(lines), reply_markup=admin_menu_kb())
+@router.callback_query(F.data == "admin_outbox_retry")
+async def admin_outbox_retry(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Це тільки для адміна 🙃", show_alert=True)
+        return
+    count = await OUTBOX.retry_failed()
+    await callback.answer(f"Повторно поставив у чергу: {count}")
+    try:
+        await callback.message.edit_text(outbox_report(), reply_markup=admin_outbox_kb())
+    except Exception:
+        # текст міг не змінитися — Telegram тоді відмовляє в редагуванні
+        pass
 
 
-def admin_party_menu_kb() -> InlineKeyboardMarkup:
+def admin_party_menu_kb(party: Party) -> InlineKeyboardMarkup:
     buttons = []
 
     buttons.append(
@@ -1680,7 +4786,7 @@ def admin_party_menu_kb() -> InlineKeyboardMarkup:
         ]
     )
 
-    if PARTY.get("active"):
+    if party.active:
         buttons.append(
             [
                 InlineKeyboardButton(
@@ -1690,31 +4796,90 @@ def admin_party_menu_kb() -> InlineKeyboardMarkup:
             ]
         )
 
+    if len(PARTIES) > 1:
+        buttons.append(
+            [
+                InlineKeyboardButton(
+                    text="🔀 Інша вечірка",
+                    callback_data="admin_pick_party",
+                )
+            ]
+        )
+
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def admin_pick_party_kb(current: Party) -> InlineKeyboardMarkup:
+    rows = []
+    for code, party in PARTIES.items():
+        mark = "✅ " if party is current else ""
+        rows.append(
+            [
+                InlineKeyboardButton(
+                    text=f"{mark}{party.name} ({code})",
+                    callback_data=f"admin_pick_party:{code}",
+                )
+            ]
+        )
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_party")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 @router.callback_query(F.data == "admin_party")
 async def admin_party(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Це тільки для адміна 🙃", show_alert=True)
         return
 
-    status = "активна ✅" if PARTY.get("active") else "неактивна ❌"
-    code = PARTY.get("code") or "не заданий (PARTY_CODE)"
+    party = managed_party()
+
+    status = "активна ✅" if party.active else "неактивна ❌"
+    code = party.code or "не заданий (PARTY_CODE)"
 
     text = (
         "🎉 <b>Налаштування вечірки</b>\n\n"
         f"Статус: {status}\n"
-        f"Назва: {PARTY_NAME}\n"
-        f"Локація: {PARTY_LOCATION}\n"
-        f"Дати: {PARTY_DATES_TEXT}\n"
+        f"Назва: {party.name}\n"
+        f"Локація: {party.location}\n"
+        f"Дати: {party.dates_text}\n"
         f"Код для гостей: <code>{code}</code>\n"
-        f"Дата старту відгуків: {PARTY.get('feedback_date') or 'не задана'}\n\n"
+        f"Дата старту відгуків: {party.feedback_date or 'не задана'}\n\n"
+        f"Вечірок у боті: {len(PARTIES)}\n\n"
         "Змінюється усе через Variables:\n"
         "<code>PARTY_NAME, PARTY_LOCATION, PARTY_DATES_TEXT, PARTY_ACTIVE, PARTY_CODE, PARTY_FEEDBACK_DATE</code>\n"
+        f"(інші вечірки — у <code>{PARTIES_FILE}</code>; перемкнутись на іншу — «🔀 Інша вечірка»).\n"
         "Після змін — перезапусти сервіс."
     )
-    await callback.message.edit_text(text, reply_markup=admin_party_menu_kb())
+    await callback.message.edit_text(text, reply_markup=admin_party_menu_kb(party))
+
+
+@router.callback_query(F.data == "admin_pick_party")
+async def admin_pick_party(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Це тільки для адміна 🙃", show_alert=True)
+        return
+    await callback.message.edit_text(
+        "🔀 <b>Якою вечіркою керуємо?</b>\n\n"
+        "Список гостей, Миколайчик, розсилки й листівки підуть в обрану вечірку. "
+        "Твоя власна участь як гостя від цього не змінюється.",
+        reply_markup=admin_pick_party_kb(managed_party()),
+    )
+
+
+@router.callback_query(F.data.startswith("admin_pick_party:"))
+async def admin_pick_party_set(callback: CallbackQuery):
+    global ADMIN_PARTY_CODE
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Це тільки для адміна 🙃", show_alert=True)
+        return
+    party = party_by_code(callback.data.split(":", 1)[1])
+    if party is None:
+        await callback.answer("Такої вечірки вже немає 🤔", show_alert=True)
+        return
+    ADMIN_PARTY_CODE = party.code
+    await save_data()
+    await callback.answer(f"Керуємо вечіркою «{party.name}»")
+    await admin_party(callback)
 
 
 @router.callback_query(F.data == "admin_santa")
@@ -1723,10 +4888,12 @@ async def admin_santa(callback: CallbackQuery):
         await callback.answer("Це тільки для адміна 🙃", show_alert=True)
         return
 
-    reg_state = "відкрита ✅" if SANTA.registration_open else "закрита ❌"
-    started_state = "запущена 🎲" if SANTA.started else "ще не запущена"
-    budget = SANTA.budget_text or "ще не заданий"
-    desc = SANTA.description or "опис не заданий"
+    santa = managed_party().santa
+
+    reg_state = "відкрита ✅" if santa.registration_open else "закрита ❌"
+    started_state = "запущена 🎲" if santa.started else "ще не запущена"
+    budget = santa.budget_text or "ще не заданий"
+    desc = santa.description or "опис не заданий"
 
     text = (
         "🎅 <b>Налаштування Таємного Миколайчика</b>\n\n"
@@ -1744,11 +4911,13 @@ async def admin_toggle_santa_reg(callback: CallbackQuery):
         await callback.answer("Це тільки для адміна 🙃", show_alert=True)
         return
 
-    if not SANTA.registration_open and not SANTA.budget_text:
+    santa = managed_party().santa
+
+    if not santa.registration_open and not santa.budget_text:
         await callback.answer("Спочатку задай бюджет для гри 💰", show_alert=True)
         return
 
-    SANTA.registration_open = not SANTA.registration_open
+    santa.registration_open = not santa.registration_open
     await save_data()
     await admin_santa(callback)
 
@@ -1781,27 +4950,41 @@ async def admin_gen_pairs(callback: CallbackQuery):
         await callback.answer("Це тільки для адміна 🙃", show_alert=True)
         return
 
-    santa_players = [uid for uid, data in USERS.items() if data.get("santa_joined")]
+    party = managed_party()
+
+    santa_players = [uid for uid in party.guest_ids("santa_joined") if find_user(uid)]
     if len(santa_players) < 2:
         await callback.answer("У грі замало людей для пар 😅", show_alert=True)
         return
 
-    random.shuffle(santa_players)
-
-    for uid in santa_players:
-        USERS[uid]["santa_child_id"] = None
-        USERS[uid]["santa_id"] = None
-
-    n = len(santa_players)
-    for i, santa_uid in enumerate(santa_players):
-        child_uid = santa_players[(i + 1) % n]
-        USERS[santa_uid]["santa_child_id"] = child_uid
-        USERS[child_uid]["santa_id"] = santa_uid
+    forbidden = load_santa_exclusions(santa_players)
+    try:
+        child_of = make_santa_pairs(santa_players, forbidden, SANTA_PAIRS_SEED)
+    except ValueError as e:
+        await callback.answer(f"Не вийшло скласти пари: {e} 😔", show_alert=True)
+        return
 
-    SANTA.started = True
+    # записуємо лише тих, у кого пара справді змінилась
+    changed: set[int] = set()
+    for santa_uid, child_uid in child_of.items():
+        santa = USERS[santa_uid]
+        if santa.santa_child_id != child_uid:
+            santa.santa_child_id = child_uid
+            changed.add(santa_uid)
+        child = USERS[child_uid]
+        if child.santa_id != santa_uid:
+            child.santa_id = santa_uid
+            changed.add(child_uid)
+
+    party.santa.started = True
+    if changed:
+        await save_data(*changed)
     await save_data()
 
-    logger.info("Згенеровано пари Миколайчика для %d учасників", len(santa_players))
+    logger.info(
+        "Згенеровано пари Миколайчика для %d учасників (обмежень: %d, змінено гостей: %d)",
+        len(santa_players), sum(map(len, forbidden.values())), len(changed),
+    )
 
     await callback.message.edit_text(
         f"Пари Таємного Миколайчика згенеровано 🎲\nУчасників у грі: {len(santa_players)}",
@@ -1815,23 +4998,26 @@ async def admin_notify_pairs(callback: CallbackQuery):
         await callback.answer("Це тільки для адміна 🙃", show_alert=True)
         return
 
+    party = managed_party()
+
     bot: Bot = callback.message.bot
-    count = 0
-    for uid, data in USERS.items():
-        if not data.get("santa_joined"):
+    items: list[tuple[int, str]] = []
+    for uid in party.guest_ids("santa_joined"):
+        data = find_user(uid)
+        if not data:
             continue
-        child_id = data.get("santa_child_id")
+        child_id = data.santa_child_id
         if not child_id:
             continue
-        child = USERS.get(child_id)
+        child = find_user(child_id)
         if not child:
             continue
 
         parts = [
             "🎅 <b>Твій підопічний у грі «Таємний Миколайчик»</b>\n",
-            f"Імʼя: <b>{child.get('name', 'Гість')}</b>",
+            f"Імʼя: <b>{child.name or 'Гість'}</b>",
         ]
-        wish = child.get("santa_wish")
+        wish = child.santa_wish
         if wish:
             parts.append("\nПобажання / анти-побажання:\n")
             parts.append(wish)
@@ -1843,16 +5029,18 @@ async def admin_notify_pairs(callback: CallbackQuery):
             "Можеш написати йому/їй через меню «🎅 Мій Миколайчик».\n"
             "Щоб написати — обирай «✉ Написати підопічному» в меню бота."
         )
-        text = "".join(parts)
-        try:
-            await bot.send_message(uid, text)
-            count += 1
-        except Exception as e:
-            logger.exception("Не зміг надіслати пару Santa користувачу %s: %s", uid, e)
-
-    await callback.message.edit_text(
-        f"Розіслав інформацію про підопічних {count} учасникам 🎄",
-        reply_markup=admin_santa_menu_kb(),
+        items.append((uid, "".join(parts)))
+
+    await callback.message.edit_text(f"📨 Розсилаю підопічних: 0/{len(items)}")
+    start_broadcast(
+        Broadcast(
+            bot,
+            items,
+            progress_msg=callback.message,
+            title="📨 Розсилаю підопічних…",
+            done_text="Розіслав інформацію про підопічних {sent} учасникам 🎄",
+            done_markup=admin_santa_menu_kb(),
+        )
     )
 
 
@@ -1884,103 +5072,485 @@ async def admin_card_publish(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Це тільки для адміна 🙃", show_alert=True)
         return
-    text = PENDING_CONTEXT.pop(callback.from_user.id, None)
+    text = (PENDING_CONTEXT.pop(callback.from_user.id, None) or {}).get("card_text")
     if not text:
         await callback.answer("Немає тексту листівки 🤔", show_alert=True)
         return
-    if not PARTY_CHANNEL_LINK:
+    party = managed_party()
+    if not party.channel_link:
+        source = "PARTY_CHANNEL_LINK" if party is DEFAULT_PARTY else f"channel_link у {PARTIES_FILE}"
         await callback.message.answer(
-            "PARTY_CHANNEL_LINK не заданий, не знаю, куди відправити листівку. "
-            "Додай змінну середовища і перезапусти сервіс."
+            f"У вечірки «{party.name}» не заданий канал ({source}), "
+            "не знаю, куди відправити листівку. Додай його і перезапусти сервіс."
+        )
+        return
+    try:
+        await callback.message.bot.send_message(party.channel_link, text)
+        await callback.message.edit_text("Листівку опубліковано в каналі 🎄")
+    except Exception as e:
+        logger.exception("Не зміг опублікувати листівку в каналі: %s", e)
+        await callback.message.answer("Не зміг опублікувати листівку в каналі 😔")
+
+
+@router.callback_query(F.data == "admin_card_cancel")
+async def admin_card_cancel(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Це тільки для адміна 🙃", show_alert=True)
+        return
+    PENDING_CONTEXT.pop(callback.from_user.id, None)
+    await callback.message.edit_text("Скасовано відправку листівки.")
+
+
+# ================== /cancel ==================
+@router.message(Command("cancel"))
+async def cmd_cancel(message: Message):
+    uid = message.from_user.id
+    user = get_user(uid)
+    if uid in PENDING_ACTION:
+        PENDING_ACTION.pop(uid, None)
+        PENDING_CONTEXT.pop(uid, None)
+        await message.answer(
+            "Скасовано ✅ Можеш користуватись меню нижче.", reply_markup=main_menu_kb(user)
+        )
+    else:
+        await message.answer("Нічого скасовувати 😉", reply_markup=main_menu_kb(user))
+
+
+@router.message(F.reply_to_message)
+async def reply_bridge(message: Message):
+    """
+    Міст для всіх варіантів:
+    - гість ↔ організатор
+    - Santa ↔ підопічний
+    - запит по завданнях
+    Працює багаторазово за рахунок дзеркальних якірів.
+    """
+    key = (message.chat.id, message.reply_to_message.message_id)
+    # робимо міст одноразовим: використали — видалили
+    # (pop заодно рахує hits/misses для статистики мостів)
+    meta = BRIDGE_REPLIES.pop(key, None)
+    if not meta:
+        # Немає мосту – віддамо це universal_handler'у
+        return
+
+    peer_id = meta["peer_id"]
+    prefix_to_peer = meta["prefix_to_peer"]
+    reply_prefix_back = meta["reply_prefix_back"]
+
+    try:
+        # текст з префіксом + медіа копією; дзеркальний міст зареєструється
+        # після доставки, щоб відповіді з іншого боку теж ходили по колу
+        relayed = relay_message(
+            message,
+            peer_id,
+            prefix_to_peer,
+            bridge={
+                "peer_id": message.chat.id,
+                "prefix_to_peer": reply_prefix_back,
+                "reply_prefix_back": prefix_to_peer,
+            },
+        )
+        if relayed:
+            # позначаємо активність того, кому щойно відправили
+            try:
+                peer_user = get_user(peer_id)
+                mark_user_active(peer_id, peer_user)
+            except Exception:
+                pass
+
+    except Exception as e:
+        logger.exception("Помилка при пересиланні reply: %s", e)
+
+
+# ================== ОЧІКУВАНІ ДІЇ (PENDING_ACTION) ==================
+# --- Введення коду вечірки ---
+@pending_action("enter_party_code")
+async def action_enter_party_code(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    party = party_by_code(message.text)
+
+    if party is None and not any(p.is_open for p in PARTIES.values()):
+        PacedReply(user_id).gif(START_GIF_ID).pause(1).text(
+            "Зараз немає активних вечірок. Запитай код у організатора, коли він створить нову 😊"
+        ).send()
+        return
+
+    if party is None or not party.is_open:
+        PacedReply(user_id).gif(START_GIF_ID).pause(1).text(
+            "Код не підходить 😔\n"
+            "Перевір, будь ласка, чи все правильно, або уточни у організатора."
+        ).send()
+        PENDING_ACTION[user_id] = "enter_party_code"
+        return
+
+    left_behind: list[int] = []
+    if user.party_code and user.party_code != party.code:
+        # участь, образ, меню і Миколайчик — свої в кожній вечірці
+        left_behind = reset_party_state(user_id, user)
+        SCHEDULER.cancel_user(user_id)
+    user.has_valid_code = True
+    user.party_code = party.code
+    await save_data(user_id, *left_behind)
+
+    text = (
+        "Вау! ✨\n\n"
+        f"Тебе запросили на вечірку <b>«{party.name}»</b>!\n\n"
+        "Підтверди свою участь нижче — я додам тебе до списку гостей "
+        "і допоможу підготуватись до свята 😉\n\n"
+        "То ти з нами на вечірці?"
+    )
+
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="🎉 Так, я буду!", callback_data="party_yes"),
+            ],
+            [
+                InlineKeyboardButton(
+                    text="🙈 Я просто дивлюсь", callback_data="party_no"
+                )
+            ],
+        ]
+    )
+
+    PacedReply(user_id).gif(START_GIF_ID).pause(1).text(text, reply_markup=kb).send()
+
+
+# --- Моє меню (покроково з затримками) ---
+@pending_action("set_dish")
+async def action_set_dish(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    user.menu_dish = (message.text or "").strip()
+    PacedReply(user_id).text("Записав твою страву 🍽️").pause(0.5).text(
+        "Тепер напиши, будь ласка, який <b>напій</b> ти плануєш принести "
+        "(алкогольний або безалкогольний)."
+    ).send()
+    PENDING_ACTION[user_id] = "set_drink"
+    await save_data(user_id)
+
+
+@pending_action("set_drink")
+async def action_set_drink(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    user.menu_drink = (message.text or "").strip()
+    PacedReply(user_id).text("Супер! 🥂").pause(0.5).text(
+        "Тепер напиши, будь ласка, який <b>десерт</b> ти плануєш принести.\n"
+        "Це може бути щось невелике і недороге, але круто, якщо хоч трохи "
+        "пасує до твого кольору."
+    ).send()
+    PENDING_ACTION[user_id] = "set_dessert"
+    await save_data(user_id)
+
+
+# --- Локальне редагування меню: тільки один пункт ---
+@pending_action("edit_dish")
+async def action_edit_dish(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    user.menu_dish = (message.text or "").strip()
+    await save_data(user_id)
+    await message.answer(
+        f"Оновив твою страву 🍽️\nНове значення: {user.menu_dish}",
+    )
+    # Після редагування одразу показуємо актуальне меню з кнопками що ще змінити
+    await my_menu(message)
+
+
+@pending_action("edit_drink")
+async def action_edit_drink(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    user.menu_drink = (message.text or "").strip()
+    await save_data(user_id)
+    await message.answer(
+        f"Оновив твій напій 🥂\nНове значення: {user.menu_drink}",
+    )
+    await my_menu(message)
+
+
+@pending_action("edit_dessert")
+async def action_edit_dessert(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    user.menu_dessert = (message.text or "").strip()
+    await save_data(user_id)
+    await message.answer(
+        f"Оновив твій десерт 🍰\nНове значення: {user.menu_dessert}",
+    )
+    await my_menu(message)
+
+
+@pending_action("set_dessert")
+async def action_set_dessert(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    user.menu_dessert = (message.text or "").strip()
+    await save_data(user_id)
+
+    PacedReply(user_id).text(
+        f"Готово! Я записав твоє меню:\n"
+        f"• Страва: {user.menu_dish}\n"
+        f"• Напій: {user.menu_drink}\n"
+        f"• Десерт: {user.menu_dessert}",
+        reply_markup=main_menu_kb(user),
+    ).gif(MENU_DONE_GIF_ID).pause(0.5).text(
+        "Памʼятай, що меню бажано має підходити під твій образ — "
+        "хоча б по асоціаціях 😉"
+    ).send()
+
+    # запускаємо ланцюжок «післяменюшних» повідомлень
+    user.postmenu_followups_blocked = False
+    start_postmenu_followups(user_id)
+
+
+# --- Підтвердження завдання (текст + фото/відео) ---
+@pending_action("task_ask_org")
+async def action_task_ask_org(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+
+    header = (
+        f"📎 Коментар від гостя щодо завдання "
+        f"({user.name or user_id}, @{user.username or '-'})\n\n"
+    )
+
+    try:
+        # текст + медіа; на «якір» вішаємо міст, щоб організатор
+        # міг відповісти «reply» і гість це побачив
+        relay_message(
+            message,
+            ADMIN_ID,
+            header,
+            bridge={
+                "peer_id": user_id,
+                "prefix_to_peer": "Відповідь організатора щодо завдання: ",
+                "reply_prefix_back": "Гість відповів щодо завдання: ",
+            },
+        )
+    except Exception as e:
+        logger.exception("Не зміг передати info по завданню організатору: %s", e)
+
+    await message.answer(
+        "Ок, я передав інформацію організатору.\n"
+        "Якщо тебе попросять щось дослати — він відповість у цьому чаті 😉"
+    )
+
+
+# --- Santa wish ---
+@pending_action("set_santa_wish")
+async def action_set_santa_wish(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    txt = (message.text or "").strip()
+    if txt.lower() in ("сюрприз", "surprise"):
+        user.santa_wish = None
+    else:
+        user.santa_wish = txt
+    await message.answer(
+        "Зберіг твої побажання для Таємного Миколайчика 🎅\n"
+        "Коли організатор запустить гру, я скажу тобі, хто твій підопічний.",
+        reply_markup=main_menu_kb(user),
+    )
+    await save_data(user_id)
+
+
+# --- Santa messages ---
+@pending_action("msg_child", "msg_santa")
+async def action_santa_message(message: Message, user: Guest):
+    user_id = message.from_user.id
+    action = PENDING_ACTION.pop(user_id, None)
+    target_id = user.santa_child_id if action == "msg_child" else user.santa_id
+    if not target_id:
+        await message.answer("Схоже, зараз немає активного співрозмовника у грі 🤔")
+        return
+
+    if action == "msg_child":
+        prefix_to_target = "Твій Таємний Миколайчик пише:\n\n"
+        reply_prefix_back = "Твій підопічний відповів: "
+    else:
+        prefix_to_target = "Твій підопічний у грі «Таємний Миколайчик» пише:\n\n"
+        reply_prefix_back = "Твій Таємний Миколайчик відповів: "
+
+    try:
+        relay_message(
+            message,
+            target_id,
+            prefix_to_target,
+            bridge={
+                "peer_id": user_id,
+                "prefix_to_peer": reply_prefix_back,
+                "reply_prefix_back": prefix_to_target,
+            },
+        )
+        await message.answer("Я передав твоє повідомлення ✉")
+    except Exception as e:
+        logger.exception("Не зміг доставити Santa-повідомлення %s → %s: %s", user_id, target_id, e)
+        await message.answer("Не зміг доставити повідомлення 😔 Можливо, людина вийшла з гри або заблокувала бота.")
+
+
+# --- Question to admin about Santa ---
+@pending_action("ask_santa_admin")
+async def action_ask_santa_admin(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    text = (message.text or "").strip()
+    lower = text.lower()
+    anonymous = "анонім" in lower
+
+    if anonymous:
+        header = "❓ Анонімне питання про Миколайчика:\n\n"
+    else:
+        header = (
+            f"❓ Питання про Миколайчика від {user.name or user_id} "
+            f"(@{user.username or '-'}):\n\n"
         )
-        return
+
     try:
-        await callback.message.bot.send_message(PARTY_CHANNEL_LINK, text)
-        await callback.message.edit_text("Листівку опубліковано в каналі 🎄")
+        OUTBOX.enqueue(ADMIN_ID, "send_message", text=header + text)
+        await message.answer("Я передав твоє питання організатору 🎅")
     except Exception as e:
-        logger.exception("Не зміг опублікувати листівку в каналі: %s", e)
-        await callback.message.answer("Не зміг опублікувати листівку в каналі 😔")
+        logger.exception("Не зміг передати питання організатору: %s", e)
+        await message.answer("Не зміг передати питання організатору 😔")
 
 
-@router.callback_query(F.data == "admin_card_cancel")
-async def admin_card_cancel(callback: CallbackQuery):
-    if callback.from_user.id != ADMIN_ID:
-        await callback.answer("Це тільки для адміна 🙃", show_alert=True)
+# --- Feedback collect (багато повідомлень, поки не натиснув fb_send) ---
+@pending_action("fb_collect")
+async def action_fb_collect(message: Message, user: Guest):
+    user_id = message.from_user.id
+    # НЕ попаємо action тут — він має жити, поки юзер не натисне "Відправити відгук"
+    ctx = PENDING_CONTEXT.get(user_id) or {}
+    fb_list = ctx.setdefault("fb_msgs", [])
+    if len(fb_list) >= FEEDBACK_MAX_MESSAGES:
+        await message.answer(
+            "Відгук уже чималенький 🙂 Натисни «✅ Відправити відгук», "
+            "а решту можна дописати окремим відгуком."
+        )
         return
-    PENDING_CONTEXT.pop(callback.from_user.id, None)
-    await callback.message.edit_text("Скасовано відправку листівки.")
+    fb_list.append((message.chat.id, message.message_id))
+    # записуємо назад — інакше зміни не потраплять у сховище
+    PENDING_CONTEXT[user_id] = ctx
+    await message.answer("Записав у відгук ✅\nКоли закінчиш — натисни «✅ Відправити відгук».")
 
 
-# ================== /cancel ==================
-@router.message(Command("cancel"))
-async def cmd_cancel(message: Message):
-    uid = message.from_user.id
-    user = get_user(uid)
-    if uid in PENDING_ACTION:
-        PENDING_ACTION.pop(uid, None)
+# --- Contact organizer directly ---
+@pending_action("ask_org")
+async def action_ask_org(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    text = (message.text or "").strip()
+    lower = text.lower()
+    anonymous = "анонім" in lower
+
+    if anonymous:
+        header = "📞 Анонімне повідомлення для організатора:\n\n"
+    else:
+        header = (
+            f"📞 Повідомлення для організатора від {user.name or user_id} "
+            f"(@{user.username or '-'}):\n\n"
+        )
+
+    try:
+        OUTBOX.enqueue(
+            ADMIN_ID,
+            "send_message",
+            bridge={
+                "peer_id": user_id,
+                "prefix_to_peer": "Організатор відповів: ",
+                "reply_prefix_back": "Гість відповів: ",
+            },
+            text=header + text,
+        )
         await message.answer(
-            "Скасовано ✅ Можеш користуватись меню нижче.", reply_markup=main_menu_kb(user)
+            "Я передав твоє повідомлення організатору ✅",
+            reply_markup=main_menu_kb(user),
         )
-    else:
-        await message.answer("Нічого скасовувати 😉", reply_markup=main_menu_kb(user))
+    except Exception as e:
+        logger.exception("Не зміг передати повідомлення організатору: %s", e)
+        await message.answer("Не зміг передати повідомлення організатору 😔")
 
 
-@router.message(F.reply_to_message)
-async def reply_bridge(message: Message):
-    """
-    Міст для всіх варіантів:
-    - гість ↔ організатор
-    - Santa ↔ підопічний
-    - запит по завданнях
-    Працює багаторазово за рахунок дзеркальних якірів.
-    """
-    key = (message.chat.id, message.reply_to_message.message_id)
-    # робимо міст одноразовим: використали — видалили
-    meta = BRIDGE_REPLIES.pop(key, None)
-    if not meta:
-        # Немає мосту – віддамо це universal_handler'у
+# --- Admin: set budget ---
+@pending_action("admin_set_budget")
+async def action_admin_set_budget(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    if user_id != ADMIN_ID:
+        await message.answer("Це тільки для адміна 🙃")
         return
+    santa = managed_party().santa
+    santa.budget_text = (message.text or "").strip()
+    await save_data()
+    await message.answer(f"Оновив бюджет для Миколайчика: {santa.budget_text}")
 
-    bot: Bot = message.bot
 
-    peer_id = meta["peer_id"]
-    prefix_to_peer = meta["prefix_to_peer"]
-    reply_prefix_back = meta["reply_prefix_back"]
+# --- Admin: set santa description ---
+@pending_action("admin_set_santa_desc")
+async def action_admin_set_santa_desc(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    if user_id != ADMIN_ID:
+        await message.answer("Це тільки для адміна 🙃")
+        return
+    managed_party().santa.description = (message.text or "").strip()
+    await save_data()
+    await message.answer("Зберіг опис гри Таємного Миколайчика.")
 
-    text_part = message.text or message.caption or ""
 
-    try:
-        sent_msg: Optional[Message] = None
-
-        # спочатку текст з префіксом
-        if text_part:
-            sent_msg = await bot.send_message(peer_id, f"{prefix_to_peer}{text_part}")
-
-        # якщо є медіа – докинути копією (фото, відео і т.д.)
-        if message.photo or message.document or message.video or message.animation:
-            media_sent = await bot.copy_message(peer_id, message.chat.id, message.message_id)
-            # якщо тексту не було — в якості "якоря" беремо медіа
-            if sent_msg is None:
-                sent_msg = media_sent
-
-        # реєструємо дзеркальний міст, щоб відповіді з іншого боку теж ходили по колу
-        if sent_msg:
-            register_bridge_message(
-                chat_id=sent_msg.chat.id,
-                message_id=sent_msg.message_id,
-                peer_id=message.chat.id,
-                prefix_to_peer=reply_prefix_back,
-                reply_prefix_back=prefix_to_peer,
-            )
-            # позначаємо активність того, кому щойно відправили
-            try:
-                peer_user = get_user(peer_id)
-                mark_user_active(peer_user)
-            except Exception:
-                pass
+# --- Admin: broadcast to all participants ---
+@pending_action("admin_broadcast")
+async def action_admin_broadcast(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    if user_id != ADMIN_ID:
+        await message.answer("Це тільки для адміна 🙃")
+        return
+    text = message.text or ""
+    items = [(uid, text) for uid in managed_party().guest_ids()]
+    progress_msg = await message.answer(f"📢 Розсилаю оголошення: 0/{len(items)}")
+    start_broadcast(
+        Broadcast(
+            message.bot,
+            items,
+            progress_msg=progress_msg,
+            title="📢 Розсилаю оголошення…",
+            done_text="Розіслав оголошення {sent} учасникам 🎄",
+        )
+    )
 
-    except Exception as e:
-        logger.exception("Помилка при пересиланні reply: %s", e)
+
+# --- Admin: card to channel ---
+@pending_action("admin_card")
+async def action_admin_card(message: Message, user: Guest):
+    user_id = message.from_user.id
+    PENDING_ACTION.pop(user_id, None)
+    if user_id != ADMIN_ID:
+        await message.answer("Це тільки для адміна 🙃")
+        return
+    preview = (
+        "Ось превʼю листівки, яку можна відправити в канал:\n\n"
+        f"{message.text}\n\n"
+        "Натисни кнопку нижче, щоб опублікувати в канал."
+    )
+    PENDING_CONTEXT[user_id] = {"card_text": message.text}
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✅ Опублікувати в канал",
+                    callback_data="admin_card_publish",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="❌ Скасувати", callback_data="admin_card_cancel"
+                )
+            ],
+        ]
+    )
+    await message.answer(preview, reply_markup=kb)
 
 
 # ================== УНІВЕРСАЛЬНИЙ ХЕНДЛЕР ==================
@@ -1994,7 +5564,6 @@ async def universal_handler(message: Message):
 
     user_id = message.from_user.id
     user = get_user(user_id)
-    bot: Bot = message.bot
     action = PENDING_ACTION.get(user_id)
 
     # --- якщо немає активної дії: спроба редагувати меню або попередження про "просто чат" ---
@@ -2008,31 +5577,31 @@ async def universal_handler(message: Message):
         if low.startswith("страва:"):
             value = text.split(":", 1)[1].strip()
             if value:
-                user["menu_dish"] = value
+                user.menu_dish = value
                 updated = True
-                mark_user_active(user)
+                mark_user_active(user_id, user)
                 await message.answer(f"Оновив твою страву 🍽️\nНове значення: {value}")
         elif low.startswith("напій:") or low.startswith("напиток:"):
             value = text.split(":", 1)[1].strip()
             if value:
-                user["menu_drink"] = value
+                user.menu_drink = value
                 updated = True
-                mark_user_active(user)
+                mark_user_active(user_id, user)
                 await message.answer(f"Оновив твій напій 🥂\nНове значення: {value}")
         elif low.startswith("десерт:"):
             value = text.split(":", 1)[1].strip()
             if value:
-                user["menu_dessert"] = value
+                user.menu_dessert = value
                 updated = True
-                mark_user_active(user)
+                mark_user_active(user_id, user)
                 await message.answer(f"Оновив твій десерт 🍰\nНове значення: {value}")
 
         if updated:
-            await save_data()
+            await save_data(user_id)
             return
 
         # інакше — пояснюємо, що це бачить тільки бот
-        mark_user_active(user)
+        mark_user_active(user_id, user)
         await message.answer(
             "Я бачу це повідомлення тільки як бот 🙈\n\n"
             "Щоб написати організатору — натисни «❓ Допомога» → «✉ Звʼязатись з організатором Ніколасом».\n"
@@ -2044,433 +5613,367 @@ async def universal_handler(message: Message):
         return
 
     # === далі йдуть стани, де action встановлений ===
+    handler = ACTION_HANDLERS.get(action)
+    if handler is not None:
+        await handler(message, user)
+        return
 
-    # --- Введення коду вечірки ---
-    if action == "enter_party_code":
-        PENDING_ACTION.pop(user_id, None)
-        code = (message.text or "").strip().upper()
-        current_code = (PARTY.get("code") or "").upper()
-
-        if not PARTY.get("active") or not current_code:
-            await send_gif(message, START_GIF_ID)
-            await asyncio.sleep(1)
-            await message.answer(
-                "Зараз немає активних вечірок. Запитай код у організатора, коли він створить нову 😊"
-            )
-            return
-
-        if code != current_code:
-            await send_gif(message, START_GIF_ID)
-            await asyncio.sleep(1)
-            await message.answer(
-                "Код не підходить 😔\n"
-                "Перевір, будь ласка, чи все правильно, або уточни у організатора."
-            )
-            PENDING_ACTION[user_id] = "enter_party_code"
-            return
-
-        user["has_valid_code"] = True
-        user["party_code"] = current_code
-        await save_data()
-
-        text = (
-            "Вау! ✨\n\n"
-            f"Тебе запросили на вечірку <b>«{PARTY_NAME}»</b>!\n\n"
-            "Підтверди свою участь нижче — я додам тебе до списку гостей "
-            "і допоможу підготуватись до свята 😉\n\n"
-            "То ти з нами на вечірці?"
-        )
-
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="🎉 Так, я буду!", callback_data="party_yes"),
-                ],
-                [
-                    InlineKeyboardButton(
-                        text="🙈 Я просто дивлюсь", callback_data="party_no"
-                    )
-                ],
-            ]
-        )
+    # fallback (на всякий випадок)
+    mark_user_active(user_id, user)
+    await message.answer(
+        "Я бачу це повідомлення тільки як бот 🙈\n"
+        "Користуйся кнопками нижче 👇",
+        reply_markup=main_menu_kb(user),
+    )
 
-        await send_gif(message, START_GIF_ID)
-        await asyncio.sleep(1)
-        await message.answer(text, reply_markup=kb)
-        return
 
-    # --- Моє меню (покроково з затримками) ---
-    if action == "set_dish":
-        PENDING_ACTION.pop(user_id, None)
-        user["menu_dish"] = (message.text or "").strip()
-        await message.answer("Записав твою страву 🍽️")
-        await asyncio.sleep(0.5)
-        await message.answer(
-            "Тепер напиши, будь ласка, який <b>напій</b> ти плануєш принести "
-            "(алкогольний або безалкогольний)."
-        )
-        PENDING_ACTION[user_id] = "set_drink"
-        await save_data()
-        return
+# ================== ПОСЛІДОВНІСТЬ АПДЕЙТІВ ГОСТЯ ==================
+class UserLocks:
+    """
+    По одному asyncio.Lock на гостя, поки в нього є що обробляти.
 
-    if action == "set_drink":
-        PENDING_ACTION.pop(user_id, None)
-        user["menu_drink"] = (message.text or "").strip()
-        await message.answer("Супер! 🥂")
-        await asyncio.sleep(0.5)
-        await message.answer(
-            "Тепер напиши, будь ласка, який <b>десерт</b> ти плануєш принести.\n"
-            "Це може бути щось невелике і недороге, але круто, якщо хоч трохи "
-            "пасує до твого кольору."
-        )
-        PENDING_ACTION[user_id] = "set_dessert"
-        await save_data()
-        return
+    Lock віддає чергу у порядку приходу, тож апдейти одного гостя
+    виконуються строго по черзі й у тому ж порядку, а різні гості —
+    паралельно. Коли черга гостя порожніє, lock прибирається,
+    тож словник не росте разом з усіма, хто будь-коли писав боту.
+    """
 
-    # --- Локальне редагування меню: тільки один пункт ---
-    if action == "edit_dish":
-        PENDING_ACTION.pop(user_id, None)
-        user["menu_dish"] = (message.text or "").strip()
-        await save_data()
-        await message.answer(
-            f"Оновив твою страву 🍽️\nНове значення: {user['menu_dish']}",
-        )
-        # Після редагування одразу показуємо актуальне меню з кнопками що ще змінити
-        await my_menu(message)
-        return
+    def __init__(self) -> None:
+        # uid → [lock, скільки апдейтів тримають або чекають його]
+        self._locks: Dict[int, list] = {}
+        self.waited = 0
+
+    async def acquire(self, uid: int) -> asyncio.Lock:
+        entry = self._locks.get(uid)
+        if entry is None:
+            entry = self._locks[uid] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        lock: asyncio.Lock = entry[0]
+        if lock.locked():
+            self.waited += 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._forget(uid, entry)
+            raise
+        return lock
 
-    if action == "edit_drink":
-        PENDING_ACTION.pop(user_id, None)
-        user["menu_drink"] = (message.text or "").strip()
-        await save_data()
-        await message.answer(
-            f"Оновив твій напій 🥂\nНове значення: {user['menu_drink']}",
-        )
-        await my_menu(message)
-        return
+    def release(self, uid: int) -> None:
+        entry = self._locks[uid]
+        entry[0].release()
+        self._forget(uid, entry)
 
-    if action == "edit_dessert":
-        PENDING_ACTION.pop(user_id, None)
-        user["menu_dessert"] = (message.text or "").strip()
-        await save_data()
-        await message.answer(
-            f"Оновив твій десерт 🍰\nНове значення: {user['menu_dessert']}",
-        )
-        await my_menu(message)
-        return
+    def _forget(self, uid: int, entry: list) -> None:
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[uid]
 
-    if action == "set_dessert":
-        PENDING_ACTION.pop(user_id, None)
-        user["menu_dessert"] = (message.text or "").strip()
-        await save_data()
+    def __len__(self) -> int:
+        return len(self._locks)
 
-        await message.answer(
-            f"Готово! Я записав твоє меню:\n"
-            f"• Страва: {user['menu_dish']}\n"
-            f"• Напій: {user['menu_drink']}\n"
-            f"• Десерт: {user['menu_dessert']}",
-            reply_markup=main_menu_kb(user),
-        )
-        await send_gif(message, MENU_DONE_GIF_ID)
-        await asyncio.sleep(0.5)
-        await message.answer(
-            "Памʼятай, що меню бажано має підходити під твій образ — "
-            "хоча б по асоціаціях 😉"
-        )
 
-        # запускаємо ланцюжок «післяменюшних» повідомлень
-        user["postmenu_followups_blocked"] = False
-        asyncio.create_task(postmenu_followups(bot, user_id))
-        return
+USER_LOCKS = UserLocks()
 
-    # --- Підтвердження завдання (текст + фото/відео) ---
-    if action == "task_ask_org":
-        PENDING_ACTION.pop(user_id, None)
 
-        # текст або підпис до фото
-        text_or_caption = (message.text or message.caption or "").strip()
+# скільки хендлер реально займає апдейт (без очікування в черзі гостя)
+HANDLER_LATENCY = LatencyStats()
 
-        header = (
-            f"📎 Коментар від гостя щодо завдання "
-            f"({user.get('name') or user_id}, @{user.get('username') or '-'})\n\n"
-        )
 
-        sent_anchor: Optional[Message] = None
+class UserSequenceMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на рівні апдейту: хендлери одного гостя не
+    перемежовуються. Без цього подвійний тап по завданню — це два
+    cb_task_toggle, що читають той самий стан і один із них губиться,
+    а set_dish / set_drink «наїжджають» одне на одного у своїх паузах.
+    """
 
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        await USER_LOCKS.acquire(user.id)
+        started = time.perf_counter()
         try:
-            # Спочатку відправляємо текст, якщо він є
-            if text_or_caption:
-                sent_anchor = await bot.send_message(
-                    ADMIN_ID,
-                    header + text_or_caption
-                )
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.add(time.perf_counter() - started)
+            USER_LOCKS.release(user.id)
 
-            # Якщо є медіа — докидаємо його окремо
-            if message.photo or message.video or message.document or message.animation:
-                media_msg = await bot.copy_message(
-                    ADMIN_ID,
-                    message.chat.id,
-                    message.message_id
-                )
-                # Якщо тексту не було — цей медіа-меседж стає "якорем"
-                if sent_anchor is None:
-                    sent_anchor = media_msg
 
-            # Якщо щось відправили адмінові — реєструємо міст,
-            # щоб організатор міг відповісти «reply» і гість це побачив
-            if sent_anchor:
-                register_bridge_message(
-                    chat_id=sent_anchor.chat.id,  # ADMIN_ID
-                    message_id=sent_anchor.message_id,
-                    peer_id=user_id,
-                    prefix_to_peer="Відповідь організатора щодо завдання: ",
-                    reply_prefix_back="Гість відповів щодо завдання: ",
-                )
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Inner-middleware роутера: тривалість кожного хендлера в HANDLER_SECONDS.
+    Кнопки меню рахуємо за їхніми хендлерами (а не за спільним
+    menu_button_handler), текст у стані — ще й в ACTION_SECONDS за станом.
+    """
 
-        except Exception as e:
-            logger.exception("Не зміг передати info по завданню організатору: %s", e)
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        callback = data["handler"].callback
+        action = None
+        if callback is menu_button_handler:
+            callback = MENU_BUTTONS.get(event.text, callback)
+        elif callback is universal_handler:
+            action = PENDING_ACTION.get(event.from_user.id)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, callback.__name__)
+            if action:
+                ACTION_SECONDS.observe(elapsed, action)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Тривалість кожного виклику Bot API за методом — в API_SECONDS."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method.__api_method__)
 
-        await message.answer(
-            "Ок, я передав інформацію організатору.\n"
-            "Якщо тебе попросять щось дослати — він відповість у цьому чаті 😉"
-        )
-        return
 
-    # --- Santa wish ---
-    if action == "set_santa_wish":
-        PENDING_ACTION.pop(user_id, None)
-        txt = (message.text or "").strip()
-        if txt.lower() in ("сюрприз", "surprise"):
-            user["santa_wish"] = None
-        else:
-            user["santa_wish"] = txt
-        await message.answer(
-            "Зберіг твої побажання для Таємного Миколайчика 🎅\n"
-            "Коли організатор запустить гру, я скажу тобі, хто твій підопічний.",
-            reply_markup=main_menu_kb(user),
-        )
-        await save_data()
-        return
+router.message.middleware(HandlerTimingMiddleware())
+router.callback_query.middleware(HandlerTimingMiddleware())
 
-    # --- Santa messages ---
-    if action in ("msg_child", "msg_santa"):
-        PENDING_ACTION.pop(user_id, None)
-        target_id = user.get("santa_child_id") if action == "msg_child" else user.get("santa_id")
-        if not target_id:
-            await message.answer("Схоже, зараз немає активного співрозмовника у грі 🤔")
-            return
 
-        if action == "msg_child":
-            prefix_to_target = "Твій Таємний Миколайчик пише:\n\n"
-            reply_prefix_back = "Твій підопічний відповів: "
-        else:
-            prefix_to_target = "Твій підопічний у грі «Таємний Миколайчик» пише:\n\n"
-            reply_prefix_back = "Твій Таємний Миколайчик відповів: "
+def stats_report() -> str:
+    """Зведення для /stats: найповільніші хендлери, Bot API, збереження, черги."""
 
+    def top(family: HistogramFamily, title: str, limit: int = 8) -> list[str]:
+        rows = sorted(family.series.items(), key=lambda kv: kv[1].quantile(0.99), reverse=True)
+        lines = [f"<b>{title}</b> (p50 / p99, к-сть)"]
+        for name, h in rows[:limit]:
+            lines.append(
+                f"• {html.escape(name)}: ≤{h.quantile(0.5) * 1000:g} / "
+                f"≤{h.quantile(0.99) * 1000:g} мс, {h.count}"
+            )
+        if not rows:
+            lines.append("• ще нічого")
+        return lines
+
+    lines = ["📈 <b>Статистика бота</b>\n"]
+    lines += top(HANDLER_SECONDS, "Хендлери")
+    lines.append("")
+    lines += top(ACTION_SECONDS, "Стани PENDING_ACTION")
+    lines.append("")
+    lines += top(API_SECONDS, "Bot API")
+    lines.append("")
+    lines += top(SAVE_SECONDS, "Збереження")
+    lines.append("\n<b>Черги</b>")
+    for name, (help_text, fn) in METRICS.gauges.items():
         try:
-            text_part = message.text or message.caption or ""
-            anchor_msg: Optional[Message] = None
+            lines.append(f"• {help_text}: {fn():g}")
+        except Exception:
+            continue
+    return "\n".join(lines)
 
-            if text_part:
-                anchor_msg = await bot.send_message(
-                    target_id,
-                    prefix_to_target + text_part,
-                )
 
-            if message.photo or message.video or message.document or message.animation:
-                media_msg = await bot.copy_message(
-                    target_id,
-                    message.chat.id,
-                    message.message_id,
-                )
-                if anchor_msg is None:
-                    anchor_msg = media_msg
+# ================== RUN BOT ==================
+# BOT_MODE=polling (за замовчуванням) або webhook. Для webhook потрібна
+# публічна адреса WEBHOOK_BASE_URL; aiohttp слухає PORT (його задає Heroku).
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_BASE_URL else "polling")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Telegram кладе його в заголовок X-Telegram-Bot-Api-Secret-Token кожного запиту;
+# якщо не задано — стабільно виводимо з токена, щоб не мінявся між рестартами
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))
+# інша адреса Bot API (локальний bot-api сервер або фейковий Telegram з bench/)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# скільки при зупинці чекаємо апдейти, які ще обробляються у фоні
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+# /metrics віддаємо локальним скреперам або з "Authorization: Bearer METRICS_TOKEN";
+# у polling-режимі окремий сервер метрик піднімається лише якщо задано METRICS_PORT
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+METRICS.gauge("party_outbox_depth", "Повідомлень у черзі OUTBOX", lambda: OUTBOX.depth())
+METRICS.gauge("party_scheduled_jobs", "Запланованих задач SCHEDULER", lambda: SCHEDULER.pending())
+METRICS.gauge("party_bridges", "Активних мостів відповідей", lambda: len(BRIDGE_REPLIES))
+METRICS.gauge("party_busy_users", "Гостей з апдейтами в обробці", lambda: len(USER_LOCKS))
+METRICS.gauge("party_pending_actions", "Гостей в очікуванні тексту", lambda: len(PENDING_ACTION))
+METRICS.gauge("party_dirty_guests", "Гостей, що чекають flush", lambda: len(DIRTY_USERS))
+METRICS.gauge("party_guests", "Гостей усього", lambda: len(USERS))
+
+_PERSIST_TASK: Optional[asyncio.Task] = None
+
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher) -> None:
+    global _PERSIST_TASK
+    await load_data()
+    _PERSIST_TASK = asyncio.create_task(persist_loop())
+    OUTBOX.start(bot)
+    SCHEDULER.start()
+    if BOT_MODE == "webhook":
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+        logger.info("Webhook встановлено: %s%s", WEBHOOK_BASE_URL, WEBHOOK_PATH)
+    else:
+        # якщо раніше працювали через webhook, getUpdates без цього не запрацює
+        await bot.delete_webhook()
+    logger.info(
+        "🎄 Бот «%s» запущений! (%s, вечірок: %d)", DEFAULT_PARTY.name, BOT_MODE, len(PARTIES)
+    )
 
-            if anchor_msg:
-                register_bridge_message(
-                    chat_id=anchor_msg.chat.id,
-                    message_id=anchor_msg.message_id,
-                    peer_id=user_id,
-                    prefix_to_peer=reply_prefix_back,
-                    reply_prefix_back=prefix_to_target,
-                )
-            await message.answer("Я передав твоє повідомлення ✉")
-        except Exception as e:
-            logger.exception("Не зміг доставити Santa-повідомлення %s → %s: %s", user_id, target_id, e)
-            await message.answer("Не зміг доставити повідомлення 😔 Можливо, людина вийшла з гри або заблокувала бота.")
-        return
 
-    # --- Question to admin about Santa ---
-    if action == "ask_santa_admin":
-        PENDING_ACTION.pop(user_id, None)
-        text = (message.text or "").strip()
-        lower = text.lower()
-        anonymous = "анонім" in lower
+async def on_shutdown() -> None:
+    if _PERSIST_TASK is not None:
+        _PERSIST_TASK.cancel()
+    await SCHEDULER.stop()
+    # недовідправлене лишається в OUTBOX_DB_FILE і піде після рестарту
+    await OUTBOX.stop()
+    BRIDGE_REPLIES.close()
+    MEDIA.close()
+    PENDING_ACTION.close()
+    PENDING_CONTEXT.close()
+    # фінальний гарантований flush перед виходом
+    await flush_data()
+    STORAGE.close()
+    logger.info("Бот зупинений, дані збережено")
+
+
+def create_bot() -> Bot:
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    else:
+        session = AiohttpSession()
+    session.middleware(ApiTimingMiddleware())
+    return Bot(
+        BOT_TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
 
-        if anonymous:
-            header = "❓ Анонімне питання про Миколайчика:\n\n"
-        else:
-            header = (
-                f"❓ Питання про Миколайчика від {user.get('name') or user_id} "
-                f"(@{user.get('username') or '-'}):\n\n"
-            )
 
-        try:
-            await bot.send_message(ADMIN_ID, header + text)
-            await message.answer("Я передав твоє питання організатору 🎅")
-        except Exception as e:
-            logger.exception("Не зміг передати питання організатору: %s", e)
-            await message.answer("Не зміг передати питання організатору 😔")
-        return
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=PendingFSMStorage(PENDING_ACTION, PENDING_CONTEXT))
+    # після вбудованого UserContextMiddleware — він кладе event_from_user
+    dp.update.outer_middleware(UserSequenceMiddleware())
+    dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def healthz(request: web.Request) -> web.Response:
+    return web.json_response(
+        {
+            "status": "ok",
+            "mode": BOT_MODE,
+            "outbox": OUTBOX.depth(),
+            "scheduled": SCHEDULER.pending(),
+            "bridges": len(BRIDGE_REPLIES),
+            "handler_ms": HANDLER_LATENCY.summary_ms(),
+            "media": MEDIA.stats(),
+        }
+    )
 
-    # --- Feedback collect (багато повідомлень, поки не натиснув fb_send) ---
-    if action == "fb_collect":
-        # НЕ попаємо action тут — він має жити, поки юзер не натисне "Відправити відгук"
-        ctx = PENDING_CONTEXT.get(user_id)
-        if not ctx:
-            PENDING_CONTEXT[user_id] = {"fb_msgs": []}
-            ctx = PENDING_CONTEXT[user_id]
-        fb_list = ctx.setdefault("fb_msgs", [])
-        fb_list.append((message.chat.id, message.message_id))
-        await message.answer("Записав у відгук ✅\nКоли закінчиш — натисни «✅ Відправити відгук».")
-        return
 
-    # --- Contact organizer directly ---
-    if action == "ask_org":
-        PENDING_ACTION.pop(user_id, None)
-        text = (message.text or "").strip()
-        lower = text.lower()
-        anonymous = "анонім" in lower
+async def metrics(request: web.Request) -> web.Response:
+    authorized = request.remote in ("127.0.0.1", "::1") or (
+        METRICS_TOKEN and request.headers.get("Authorization") == f"Bearer {METRICS_TOKEN}"
+    )
+    if not authorized:
+        raise web.HTTPForbidden()
+    return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8")
 
-        if anonymous:
-            header = "📞 Анонімне повідомлення для організатора:\n\n"
-        else:
-            header = (
-                f"📞 Повідомлення для організатора від {user.get('name') or user_id} "
-                f"(@{user.get('username') or '-'}):\n\n"
-            )
 
-        try:
-            sent = await bot.send_message(ADMIN_ID, header + text)
-            register_bridge_message(
-                chat_id=ADMIN_ID,
-                message_id=sent.message_id,
-                peer_id=user_id,
-                prefix_to_peer="Організатор відповів: ",
-                reply_prefix_back="Гість відповів: ",
-            )
-            await message.answer(
-                "Я передав твоє повідомлення організатору ✅",
-                reply_markup=main_menu_kb(user),
-            )
-        except Exception as e:
-            logger.exception("Не зміг передати повідомлення організатору: %s", e)
-            await message.answer("Не зміг передати повідомлення організатору 😔")
-        return
+class PartyRequestHandler(SimpleRequestHandler):
+    """
+    Webhook відповідає Telegram'у одразу, а апдейт обробляє у фоні.
+    При зупинці спершу даємо цим фоновим обробникам дозавершитись
+    (вони ще шлють відповіді), і лише потім закриваємо сесію бота.
+    """
 
-    # --- Admin: set budget ---
-    if action == "admin_set_budget":
-        PENDING_ACTION.pop(user_id, None)
-        if user_id != ADMIN_ID:
-            await message.answer("Це тільки для адміна 🙃")
-            return
-        SANTA.budget_text = (message.text or "").strip()
-        await save_data()
-        await message.answer(f"Оновив бюджет для Миколайчика: {SANTA.budget_text}")
-        return
+    async def close(self) -> None:
+        pending = list(self._background_feed_update_tasks)
+        if pending:
+            logger.info("Дочікуюсь %d апдейтів перед зупинкою", len(pending))
+            await asyncio.wait(pending, timeout=WEBHOOK_DRAIN_TIMEOUT)
+        await super().close()
 
-    # --- Admin: set santa description ---
-    if action == "admin_set_santa_desc":
-        PENDING_ACTION.pop(user_id, None)
-        if user_id != ADMIN_ID:
-            await message.answer("Це тільки для адміна 🙃")
-            return
-        SANTA.description = (message.text or "").strip()
-        await save_data()
-        await message.answer("Зберіг опис гри Таємного Миколайчика.")
-        return
 
-    # --- Admin: broadcast to all participants ---
-    if action == "admin_broadcast":
-        PENDING_ACTION.pop(user_id, None)
-        if user_id != ADMIN_ID:
-            await message.answer("Це тільки для адміна 🙃")
-            return
-        text = message.text or ""
-        sent = 0
-        for uid, data in USERS.items():
-            if not data.get("participant"):
-                continue
-            try:
-                await bot.send_message(uid, text)
-                sent += 1
-            except Exception as e:
-                logger.exception("Не зміг надіслати broadcast користувачу %s: %s", uid, e)
-        await message.answer(f"Розіслав оголошення {sent} учасникам 🎄")
-        return
+def create_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """
+    aiohttp-застосунок: POST WEBHOOK_PATH (з перевіркою секрету), GET /healthz
+    і GET /metrics.
+    Старт/зупинка диспетчера (а з ними load_data і фінальний flush)
+    привʼязані до життєвого циклу застосунку.
+    """
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    PartyRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(
+        app, path=WEBHOOK_PATH
+    )
+    setup_application(app, dp, bot=bot)
+    return app
 
-        await message.answer(
-            "Готово! Я оновив вечірку:\n\n"
-            f"Назва: <b>{PARTY_NAME}</b>\n"
-            f"Локація: {PARTY_LOCATION}\n"
-            f"Дати: {PARTY_DATES_TEXT}\n"
-            f"Дата старту відгуків: {PARTY.get('feedback_date') or 'не задана'}\n"
-            f"Код для гостей: <code>{PARTY['code']}</code>\n\n"
-            "Відправ цей код гостям. Без нього вони не зможуть зайти в бота 😉",
-            reply_markup=admin_menu_kb(),
-        )
-        return
 
-    # --- Admin: card to channel ---
-    if action == "admin_card":
-        PENDING_ACTION.pop(user_id, None)
-        if user_id != ADMIN_ID:
-            await message.answer("Це тільки для адміна 🙃")
-            return
-        preview = (
-            "Ось превʼю листівки, яку можна відправити в канал:\n\n"
-            f"{message.text}\n\n"
-            "Натисни кнопку нижче, щоб опублікувати в канал."
-        )
-        PENDING_CONTEXT[user_id] = message.text
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="✅ Опублікувати в канал",
-                        callback_data="admin_card_publish",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text="❌ Скасувати", callback_data="admin_card_cancel"
-                    )
-                ],
-            ]
-        )
-        await message.answer(preview, reply_markup=kb)
-        return
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    runner = web.AppRunner(create_webhook_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+    logger.info("Слухаю webhook на %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
 
-    # fallback (на всякий випадок)
-    mark_user_active(user)
-    await message.answer(
-        "Я бачу це повідомлення тільки як бот 🙈\n"
-        "Користуйся кнопками нижче 👇",
-        reply_markup=main_menu_kb(user),
-    )
+    # Heroku зупиняє dyno через SIGTERM — ловимо його, щоб коректно все зберегти
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
 
 
-# ================== RUN BOT ==================
 async def main():
-    await load_data()
-    bot = Bot(
-        BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
-    dp = Dispatcher()
-    dp.include_router(router)
-    logger.info("🎄 Бот «%s» запущений!", PARTY_NAME)
-    await dp.start_polling(bot)
+    bot = create_bot()
+    dp = create_dispatcher()
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_BASE_URL:
+            raise RuntimeError("BOT_MODE=webhook потребує WEBHOOK_BASE_URL")
+        await run_webhook(dp, bot)
+    elif METRICS_PORT:
+        app = web.Application()
+        app.router.add_get("/healthz", healthz)
+        app.router.add_get("/metrics", metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, WEBAPP_HOST, METRICS_PORT).start()
+        logger.info("Метрики на %s:%s/metrics", WEBAPP_HOST, METRICS_PORT)
+        try:
+            await dp.start_polling(bot)
+        finally:
+            await runner.cleanup()
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
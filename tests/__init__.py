@@ -0,0 +1,23 @@
+"""
+Офлайн-тести бота: OUTBOX, журнал зі знімками і ремонт пар Миколайчика.
+
+Bot API підмінений MockSession з bench/fake_telegram.py, тож мережа
+не потрібна. Файли бот пише відносно поточного каталогу — тести
+переходять у тимчасовий ще до того, як імпортується main.
+
+Запуск:
+    python -m pytest -q tests
+    python -m unittest discover -s tests -t .
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("PARTY_CODE", "TEST")
+# ліміти Telegram тут лише гальмували б тести
+os.environ.setdefault("TG_PER_CHAT_INTERVAL", "0")
+os.chdir(tempfile.mkdtemp(prefix="party_tests_"))
@@ -0,0 +1,22 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+
+def use_tmpdir(test: unittest.TestCase) -> str:
+    """Кожен тест — у своєму порожньому каталозі (DATA_FILE, журнал, бази)."""
+    prev = os.getcwd()
+    path = tempfile.mkdtemp(prefix="party_test_")
+    os.chdir(path)
+    test.addCleanup(os.chdir, prev)
+    return path
+
+
+async def wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("не дочекались умови за %.1f с" % timeout)
+        await asyncio.sleep(0.01)
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import time
+import unittest
+from unittest import mock
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+import main
+from fake_telegram import MockSession
+from tests.helpers import use_tmpdir, wait_for
+
+
+def texts(session: MockSession, chat_id: int) -> list:
+    return [text for cid, _, text in session.sent if cid == chat_id]
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.path = os.path.join(use_tmpdir(self), "outbox.sqlite3")
+        # лімітери тримають asyncio.Lock і паузи — свіжі на кожен тест
+        for name, limiter in (
+            ("TG_RATE_LIMITER", main.RateLimiter(1000)),
+            ("TG_CHAT_LIMITER", main.ChatLimiter(0)),
+        ):
+            patcher = mock.patch.object(main, name, limiter)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def start(self, fail=None) -> tuple[main.Outbox, MockSession]:
+        session = MockSession(fail=fail)
+        outbox = main.Outbox(self.path)
+        outbox.start(Bot("0:test", session=session))
+        self.addAsyncCleanup(outbox.stop)
+        return outbox, session
+
+    async def states(self, outbox: main.Outbox) -> dict:
+        await outbox.flush_states()
+        return outbox.state_counts()
+
+    async def test_retry_after_keeps_chat_order(self) -> None:
+        failed = []
+
+        def fail(method):
+            if getattr(method, "text", None) == "1" and not failed:
+                failed.append(method)
+                return TelegramRetryAfter(method, "Too Many Requests", 1)
+            return None
+
+        outbox, session = await self.start(fail)
+        for text in ("1", "2", "3"):
+            outbox.enqueue(7, "send_message", text=text)
+        await wait_for(lambda: len(session.sent) == 3)
+
+        self.assertEqual(session.calls["sendMessage"], 4)
+        self.assertEqual(texts(session, 7), ["1", "2", "3"])
+        self.assertEqual(await self.states(outbox), {"sent": 3})
+
+    async def test_network_error_backs_off_and_holds_chat(self) -> None:
+        outbox, session = await self.start(lambda method: ConnectionError("обрив"))
+        first = outbox.enqueue(7, "send_message", text="1")
+        outbox.enqueue(7, "send_message", text="2")
+        await wait_for(lambda: first in outbox._holding)
+
+        item = outbox._heap[0]
+        self.assertEqual(item.id, first)
+        self.assertEqual(item.attempts, 1)
+        self.assertAlmostEqual(item.next_at - time.time(), 2, delta=0.5)
+        # друге повідомлення не обганяє перше, поки те чекає на повтор
+        self.assertEqual(session.calls["sendMessage"], 1)
+        self.assertEqual(await self.states(outbox), {"pending": 2})
+
+    async def test_last_attempt_fails_and_releases_chat(self) -> None:
+        calls = []
+
+        def fail(method):
+            calls.append(method.text)
+            return ConnectionError("обрив") if method.text == "1" else None
+
+        with mock.patch.object(main, "OUTBOX_MAX_ATTEMPTS", 1):
+            outbox, session = await self.start(fail)
+            outbox.enqueue(7, "send_message", text="1")
+            outbox.enqueue(7, "send_message", text="2")
+            await wait_for(lambda: texts(session, 7) == ["2"])
+
+        self.assertEqual(calls, ["1", "2"])
+        self.assertEqual(outbox.failed, 1)
+        self.assertEqual(await self.states(outbox), {"failed": 1, "sent": 1})
+        self.assertEqual(outbox.failed_items()[0][5], "обрив")
+
+    async def test_forbidden_is_not_retried(self) -> None:
+        outbox, session = await self.start(
+            lambda method: TelegramForbiddenError(method, "bot was blocked by the user")
+        )
+        outbox.enqueue(7, "send_message", text="1")
+        await wait_for(lambda: outbox.failed == 1)
+
+        self.assertEqual(session.calls["sendMessage"], 1)
+        self.assertEqual(await self.states(outbox), {"failed": 1})
+
+    async def test_worker_survives_failing_bridge_registration(self) -> None:
+        bridge = {"peer_id": 1, "prefix_to_peer": "→ ", "reply_prefix_back": "← "}
+        with mock.patch.object(
+            main, "register_bridge_message",
+            side_effect=sqlite3.OperationalError("database is locked"),
+        ) as register, self.assertLogs(main.logger, "ERROR") as logs:
+            outbox, session = await self.start()
+            outbox.enqueue(7, "send_message", text="1", bridge=bridge)
+            outbox.enqueue(7, "send_message", text="2", bridge=bridge)
+            outbox.enqueue(8, "send_message", text="3")
+            await wait_for(lambda: len(session.sent) == 3)
+            # чати звільнились, хоч міст так і не зареєструвався
+            await wait_for(lambda: not outbox._busy_chats)
+
+        self.assertEqual(register.call_count, 2)
+        self.assertEqual(len(logs.records), 2)
+        self.assertTrue(all("не зареєстрував міст" in r.getMessage() for r in logs.records))
+        self.assertEqual(texts(session, 7), ["1", "2"])
+        self.assertFalse(any(task.done() for task in outbox._tasks))
+        self.assertEqual(await self.states(outbox), {"sent": 3})
+
+    async def test_restore_after_restart(self) -> None:
+        crashed = main.Outbox(self.path)
+        first, _ = crashed.enqueue_many(
+            [(7, "send_message", {"text": "1"}), (7, "send_message", {"text": "2"})]
+        )
+        # впали посеред відправки першого
+        with crashed.db:
+            crashed.db.execute("UPDATE outbox SET state = 'sending' WHERE id = ?", (first,))
+        await crashed.stop()
+
+        outbox, session = await self.start()
+        await wait_for(lambda: len(session.sent) == 2)
+
+        self.assertEqual(texts(session, 7), ["1", "2"])
+        self.assertEqual(await self.states(outbox), {"sent": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+import main
+from tests.helpers import use_tmpdir
+
+EMPTY_STATE = {"SANTA": {}, "PARTIES": {}, "ADMIN_PARTY": None}
+
+
+def snapshot(users: dict, **state) -> dict:
+    return {"USERS": {str(uid): d for uid, d in users.items()}, **EMPTY_STATE, **state}
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self) -> None:
+        use_tmpdir(self)
+        patcher = mock.patch.object(main, "STORAGE_MODE", "journal")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def journal_lines(self) -> list:
+        with open(main.JOURNAL_FILE, "r", encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_replay_over_snapshot(self) -> None:
+        storage = main.JsonStorage()
+        storage.write_snapshot(snapshot({1: {"name": "A"}, 2: {"name": "B"}}))
+        storage.write_changes({1: {"name": "A2"}, 2: None, 3: {"name": "C"}}, None)
+        storage.write_changes({}, {"SANTA": {"1": 3}, "PARTIES": {}, "ADMIN_PARTY": "X"})
+
+        storage = main.JsonStorage()
+        users, state = storage.load()
+
+        self.assertEqual(users, {1: {"name": "A2"}, 3: {"name": "C"}})
+        self.assertEqual(state, {"SANTA": {"1": 3}, "PARTIES": {}, "ADMIN_PARTY": "X"})
+        self.assertEqual(storage.journal_records, 6)
+
+    def test_replay_after_interrupted_compaction(self) -> None:
+        storage = main.JsonStorage()
+        storage.write_changes({1: {"name": "A"}, 2: {"name": "B"}}, None)
+        storage.write_changes({1: {"name": "A2"}, 2: None}, None)
+        users, state = main.JsonStorage().load()
+        # _compact_journal впав між знімком і обнуленням журналу
+        main._write_snapshot(snapshot(users, **state))
+        self.assertEqual(len(self.journal_lines()), 4)
+
+        storage = main.JsonStorage()
+        users, state = storage.load()
+        self.assertEqual((users, state), ({1: {"name": "A2"}}, EMPTY_STATE))
+        # після рестарту стискання доходить до кінця
+        storage.write_snapshot(snapshot(users, **state))
+        self.assertEqual(self.journal_lines(), [])
+        self.assertEqual(main.JsonStorage().load(), ({1: {"name": "A2"}}, EMPTY_STATE))
+
+    def test_torn_journal_tail_is_skipped_and_compacted(self) -> None:
+        storage = main.JsonStorage()
+        storage.write_changes({1: {"name": "A"}}, None)
+        with open(main.JOURNAL_FILE, "a", encoding="utf-8") as f:
+            f.write('{"u":2,"d":{"na')
+
+        users, state = main.JsonStorage().load()
+
+        self.assertEqual(users, {1: {"name": "A"}})
+        self.assertEqual(self.journal_lines(), [])
+        with open(main.DATA_FILE, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["USERS"], {"1": {"name": "A"}})
+
+    def test_corrupt_snapshot_falls_back_to_backup(self) -> None:
+        main._write_snapshot(snapshot({1: {"name": "A"}}))
+        main._write_snapshot(snapshot({1: {"name": "A2"}}))
+        with open(main.DATA_FILE, "w", encoding="utf-8") as f:
+            f.write('{"USERS": {"1": ')
+
+        users, _ = main.JsonStorage().load()
+
+        self.assertEqual(users, {1: {"name": "A"}})
+        self.assertTrue(os.path.exists(main.DATA_FILE + ".corrupt"))
+        self.assertFalse(os.path.exists(main.DATA_FILE))
+
+
+if __name__ == "__main__":
+    unittest.main()
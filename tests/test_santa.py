@@ -0,0 +1,70 @@
+import json
+import unittest
+from unittest import mock
+
+import main
+from tests.helpers import use_tmpdir
+
+
+class ResetPartyStateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        use_tmpdir(self)
+        patcher = mock.patch.object(main, "USERS", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ring(self, *uids: int) -> None:
+        """Коло Миколайчиків: uids[0] дарує uids[1], …, останній — першому."""
+        for uid in uids:
+            main.USERS[uid] = main.Guest()
+            main.USERS[uid].santa_joined = True
+        for santa, child in zip(uids, uids[1:] + uids[:1]):
+            main.USERS[santa].santa_child_id = child
+            main.USERS[child].santa_id = santa
+
+    def pairs(self) -> dict:
+        return {uid: (g.santa_id, g.santa_child_id) for uid, g in main.USERS.items()}
+
+    def test_santa_takes_over_child(self) -> None:
+        self.ring(1, 2, 3)
+
+        changed = main.reset_party_state(2, main.USERS[2])
+
+        self.assertEqual(sorted(changed), [1, 3])
+        self.assertEqual(self.pairs(), {1: (3, 3), 2: (None, None), 3: (1, 1)})
+        self.assertFalse(main.USERS[2].santa_joined)
+
+    def test_pair_of_two_is_dissolved(self) -> None:
+        self.ring(1, 2)
+
+        changed = main.reset_party_state(2, main.USERS[2])
+
+        self.assertEqual(changed, [1])
+        self.assertEqual(self.pairs(), {1: (None, None), 2: (None, None)})
+
+    def test_excluded_pair_is_dissolved(self) -> None:
+        with open(main.SANTA_EXCLUSIONS_FILE, "w", encoding="utf-8") as f:
+            json.dump({"pairs": [[1, 3]]}, f)
+        self.ring(1, 2, 3, 4)
+
+        changed = main.reset_party_state(2, main.USERS[2])
+
+        self.assertEqual(sorted(changed), [1, 3])
+        self.assertEqual(main.USERS[1].santa_child_id, None)
+        self.assertEqual(main.USERS[3].santa_id, None)
+        self.assertEqual(self.pairs()[4], (3, 1))
+
+    def test_stale_links_are_left_alone(self) -> None:
+        self.ring(1, 2, 3)
+        # 1 уже перепризначили, тож на 2 він більше не вказує
+        main.USERS[1].santa_child_id = 3
+
+        changed = main.reset_party_state(2, main.USERS[2])
+
+        self.assertEqual(changed, [3])
+        self.assertEqual(main.USERS[1].santa_child_id, 3)
+        self.assertEqual(main.USERS[3].santa_id, None)
+
+
+if __name__ == "__main__":
+    unittest.main()